@@ -1,20 +1,62 @@
-from django.contrib import admin
-from .models import Source, Customer, Transaction, Notification
+from django.contrib import admin, messages
+from .models import Source, Customer, Transaction, BalanceSnapshot, Notification, NotificationRead, NotificationState
 
 @admin.register(Source)
 class SourceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'prefix', 'is_active')
+    list_display = ('name', 'prefix', 'is_active', 'has_api_key')
+    actions = ['issue_api_keys']
+    
+    @admin.display(boolean=True, description="API key")
+    def has_api_key(self, obj):
+        return bool(obj.api_key_hash)
+    
+    @admin.action(description="إصدار مفتاح API جديد (يبطل السابق)")
+    def issue_api_keys(self, request, queryset):
+        # المفتاح لا يُخزن، لذلك يُعرض هنا مرة واحدة فقط
+        for source in queryset:
+            messages.warning(request, f"{source.name}: {source.issue_api_key()}")
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ('name', 'phone', 'token_balance', 'is_active', 'last_login')
+    actions = ['deactivate_customers']
+
+    @admin.action(description="تعطيل الحسابات وإبطال توكناتها")
+    def deactivate_customers(self, request, queryset):
+        # عبر deactivate وليس queryset.update حتى تصل لخريطة الإبطال في كل العمال
+        for customer in queryset:
+            customer.deactivate()
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ('customer', 'transaction_type', 'amount', 'created_at')
+    list_filter = ('transaction_type',)
+    search_fields = ('customer__name', 'description')
+    
+    # السجل للإضافة فقط
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(BalanceSnapshot)
+class BalanceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('customer', 'balance', 'last_transaction_id', 'created_at')
+    readonly_fields = ('customer', 'balance', 'last_transaction_id')
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
     list_display = ('title', 'notification_type', 'customer', 'is_read', 'created_at')
     list_filter = ('notification_type', 'is_read')
     search_fields = ('title', 'description')
+
+@admin.register(NotificationRead)
+class NotificationReadAdmin(admin.ModelAdmin):
+    list_display = ('notification', 'customer', 'created_at')
+    search_fields = ('customer__name', 'notification__title')
+
+@admin.register(NotificationState)
+class NotificationStateAdmin(admin.ModelAdmin):
+    list_display = ('customer', 'unread_count', 'broadcasts_read', 'version')
+    readonly_fields = ('unread_count', 'broadcasts_read', 'version')
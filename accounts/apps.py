@@ -3,4 +3,9 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
-    verbose_name = 'Accounts'
\ No newline at end of file
+    verbose_name = 'Accounts'
+
+    def ready(self):
+        import atexit
+        from .services.last_login import last_login_tracker
+        atexit.register(last_login_tracker.flush)
\ No newline at end of file
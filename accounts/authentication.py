@@ -1,66 +1,307 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
 import jwt
 from django.conf import settings
 from django.contrib.auth.models import User
-from rest_framework import authentication
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import authentication, exceptions
 from rest_framework.authentication import BaseAuthentication
-from .models import Customer
+from rest_framework.permissions import BasePermission
+from .models import Customer, Source
+from .services.last_login import last_login_tracker
+from .services.revocation import revocation_map
+
+
+# حقول العميل الثابتة التي تُحفظ في الكاش، باقي الحقول (مثل token_balance وlast_login)
+# تبقى مؤجلة وتُجلب من قاعدة البيانات عند أول وصول إليها
+CUSTOMER_SNAPSHOT_FIELDS = ('id', 'name', 'email', 'phone', 'user_id', 'is_active', 'created_at')
+USER_SNAPSHOT_FIELDS = ('id', 'username', 'is_active')
+
+
+class PrincipalCache:
+    """كاش LRU + TTL داخل العملية للعملاء الموثقين، المفتاح هو hash التوكن"""
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_customer = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        key = self.key_for(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry['expires_at'] <= time.time():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, token, payload, customer, user):
+        key = self.key_for(token)
+        expires_at = time.time() + self.ttl
+        if payload.get('exp'):
+            expires_at = min(expires_at, payload['exp'])
+        entry = {
+            'expires_at': expires_at,
+            'payload': payload,
+            'customer': tuple(getattr(customer, f) for f in CUSTOMER_SNAPSHOT_FIELDS),
+            'user': tuple(getattr(user, f) for f in USER_SNAPSHOT_FIELDS),
+        }
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            self._by_customer.setdefault(customer.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_customer(self, customer_id):
+        with self._lock:
+            for key in list(self._by_customer.get(customer_id, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_customer.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        customer_id = entry['customer'][0]
+        keys = self._by_customer.get(customer_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_customer[customer_id]
+
+
+principal_cache = PrincipalCache(
+    max_size=getattr(settings, 'PRINCIPAL_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'PRINCIPAL_CACHE_TTL', 60),
+)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_cached_principal(sender, instance, **kwargs):
+    principal_cache.invalidate_customer(instance.pk)
+    if kwargs.get('signal') is post_delete:
+        instance.is_active = False
+    revocation_map.update(instance)
 
 
 class CustomerJWTAuthentication(BaseAuthentication):
     """مصادقة JWT مخصصة للعملاء"""
-    
+
     def authenticate(self, request):
+        # نتيجة التوثيق على مستوى الطلب، تُقرأ من request.customer في كل الـ Views
+        request.customer = None
+        request.jwt_error = None
+
         auth_header = request.headers.get('Authorization', '')
-        
+
         if not auth_header.startswith('Bearer '):
             return None
-        
+
         token = auth_header[7:]
-        
+
+        cached = principal_cache.get(token)
+        if cached is not None:
+            payload = cached['payload']
+            if revocation_map.is_revoked(payload):
+                principal_cache.invalidate_customer(payload.get('customer_id'))
+                request.jwt_error = 'revoked'
+                return None
+            customer = Customer.from_db('default', CUSTOMER_SNAPSHOT_FIELDS, cached['customer'])
+            user = User.from_db('default', USER_SNAPSHOT_FIELDS, cached['user'])
+            return self._attach(request, token, payload, customer, user)
+
         try:
             # فك تشفير التوكن
             payload = jwt.decode(
-                token, 
-                settings.JWT_SECRET_KEY, 
+                token,
+                settings.JWT_SECRET_KEY,
                 algorithms=[settings.JWT_ALGORITHM]
             )
-            
+
             # التحقق من نوع التوكن
             if payload.get('type') != 'customer':
+                request.jwt_error = 'invalid'
                 return None
-            
+
             # جلب العميل
             customer_id = payload.get('customer_id')
             if not customer_id:
+                request.jwt_error = 'invalid'
                 return None
-            
+
             customer = Customer.objects.get(id=customer_id, is_active=True)
-            
+
+            if payload.get('ver', 0) < customer.token_version:
+                request.jwt_error = 'revoked'
+                return None
+
             # إذا العميل مرتبط بحساب Django User نستخدمه، وإلا نستخدم العميل نفسه
             user = customer.user if customer.user else User.objects.get_or_create(
                 username=f"customer_{customer.id}",
                 defaults={'is_active': True}
             )[0]
-            
-            # تحديث آخر دخول
-            from django.utils import timezone
-            customer.last_login = timezone.now()
-            customer.save(update_fields=['last_login'])
-            
-            # إرفاق التوكن مع الطلب
-            request.jwt_token = token
-            request.jwt_payload = payload
-            request.customer = customer
-            
-            # إرجاع المستخدم والتوكن
-            return (user, token)
-            
+
+            principal_cache.set(token, payload, customer, user)
+            return self._attach(request, token, payload, customer, user)
+
         except jwt.ExpiredSignatureError:
+            request.jwt_error = 'expired'
             return None
         except jwt.InvalidTokenError:
+            request.jwt_error = 'invalid'
             return None
         except Customer.DoesNotExist:
+            request.jwt_error = 'inactive'
             return None
-    
+
+    def _attach(self, request, token, payload, customer, user):
+        # تحديث آخر دخول (يُكتب دفعة واحدة لاحقاً)
+        last_login_tracker.touch(customer)
+
+        # إرفاق التوكن مع الطلب
+        request.jwt_token = token
+        request.jwt_payload = payload
+        request.customer = customer
+
+        # إرجاع المستخدم والتوكن
+        return (user, token)
+
     def authenticate_header(self, request):
         return 'Bearer realm="api"'
+
+
+class ClaimsUser:
+    """مستخدم خفيف مبني من التوكن فقط، يكفي لـ DRF والـ throttling"""
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+    is_staff = False
+    is_superuser = False
+
+    def __init__(self, customer_id):
+        self.id = self.pk = f"customer_{customer_id}"
+        self.username = self.pk
+
+    def __str__(self):
+        return self.username
+
+
+class CustomerClaimsAuthentication(CustomerJWTAuthentication):
+    """وضع خفيف للـ Views القرائية: الثقة في claims التوكن الموقّع بدون قاعدة البيانات
+
+    الإبطال يتم عبر claim "ver" مقارنة بـ revocation_map. العميل المرفق يحمل
+    id و name و email فقط، وأي حقل آخر يُجلب من قاعدة البيانات عند أول وصول.
+    """
+    CLAIM_FIELDS = ('id', 'name', 'email', 'is_active')
+
+    def authenticate(self, request):
+        if not getattr(settings, 'JWT_CLAIMS_AUTH_ENABLED', True):
+            return super().authenticate(request)
+
+        request.customer = None
+        request.jwt_error = None
+
+        auth_header = request.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            return None
+        token = auth_header[7:]
+
+        try:
+            payload = jwt.decode(
+                token,
+                settings.JWT_SECRET_KEY,
+                algorithms=[settings.JWT_ALGORITHM]
+            )
+        except jwt.ExpiredSignatureError:
+            request.jwt_error = 'expired'
+            return None
+        except jwt.InvalidTokenError:
+            request.jwt_error = 'invalid'
+            return None
+
+        customer_id = payload.get('customer_id')
+        if payload.get('type') != 'customer' or not customer_id:
+            request.jwt_error = 'invalid'
+            return None
+
+        if revocation_map.is_revoked(payload):
+            request.jwt_error = 'revoked'
+            return None
+
+        customer = Customer.from_db(
+            'default', self.CLAIM_FIELDS,
+            (customer_id, payload.get('name', ''), payload.get('email'), True),
+        )
+        request.jwt_token = token
+        request.jwt_payload = payload
+        request.customer = customer
+        return (ClaimsUser(customer_id), token)
+
+
+class SourceUser(ClaimsUser):
+    """الموزع (Source) كمستخدم DRF، الـ throttling يعدّ لكل موزع"""
+
+    def __init__(self, source_id):
+        self.id = self.pk = f"source_{source_id}"
+        self.username = self.pk
+
+
+class SourceKeyAuthentication(BaseAuthentication):
+    """مصادقة الموزعين بمفتاح API في الهيدر X-Source-Key"""
+
+    def authenticate(self, request):
+        key = request.headers.get('X-Source-Key')
+        if not key:
+            return None
+        try:
+            source = Source.objects.get(api_key_hash=Source.hash_api_key(key), is_active=True)
+        except Source.DoesNotExist:
+            raise exceptions.AuthenticationFailed('مفتاح API غير صالح')
+        request.source = source
+        return (SourceUser(source.pk), source)
+
+    def authenticate_header(self, request):
+        return 'X-Source-Key'
+
+
+class IsSource(BasePermission):
+    """الطلب موثّق بمفتاح موزع نشط"""
+
+    def has_permission(self, request, view):
+        return isinstance(request.auth, Source)
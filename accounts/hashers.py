@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 مع تكلفة قابلة للضبط من الإعدادات
+
+    تغيير القيم يجعل must_update صحيحاً للهاشات القديمة فيُعاد هاشها عند الدخول.
+    """
+    time_cost = getattr(settings, 'ARGON2_TIME_COST', Argon2PasswordHasher.time_cost)
+    memory_cost = getattr(settings, 'ARGON2_MEMORY_COST', Argon2PasswordHasher.memory_cost)
+    parallelism = getattr(settings, 'ARGON2_PARALLELISM', Argon2PasswordHasher.parallelism)
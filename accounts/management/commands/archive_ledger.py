@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from accounts.models import BalanceSnapshot, Transaction, TransactionArchive
+
+
+class Command(BaseCommand):
+    help = 'نقل المعاملات القديمة المغطاة بـ snapshot إلى TransactionArchive على دفعات'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=180, help='أرشفة المعاملات الأقدم من هذا العدد من الأيام')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # لا نؤرشف إلا ما يغطيه snapshot، حتى يبقى الرصيد قابلاً لإعادة البناء من الجدول الحي
+        covered = BalanceSnapshot.objects.filter(
+            customer_id=OuterRef('customer_id'),
+            last_transaction_id__gte=OuterRef('id'),
+        )
+        candidates = Transaction.objects.order_by('id').filter(created_at__lt=cutoff).filter(Exists(covered))
+        fields = ('id', 'customer_id', 'transaction_type', 'amount', 'description', 'source_id', 'created_at')
+        table = connection.ops.quote_name(Transaction._meta.db_table)
+
+        total = 0
+        while True:
+            with transaction.atomic():
+                rows = list(candidates.values(*fields)[:options['batch_size']])
+                if not rows:
+                    break
+                TransactionArchive.objects.bulk_create(
+                    [TransactionArchive(**row) for row in rows], ignore_conflicts=True
+                )
+                ids = [row['id'] for row in rows]
+                with connection.cursor() as cursor:
+                    # الـ QuerySet يمنع الحذف (سجل للإضافة فقط)، النقل للأرشيف هو الاستثناء الوحيد
+                    cursor.execute(
+                        f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids
+                    )
+            total += len(rows)
+            self.stdout.write(f'… {total}')
+
+        self.stdout.write(self.style.SUCCESS(f'✅ تمت أرشفة {total} معاملة'))
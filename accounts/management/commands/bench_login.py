@@ -0,0 +1,94 @@
+import statistics
+import threading
+import time
+
+import requests
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+
+from accounts.models import Customer
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = 'قياس زمن تسجيل الدخول (p99) مع طلبات أخرى متزامنة على خادم يعمل'
+
+    BENCH_EMAIL = 'bench-login@serialco.tv'
+    BENCH_PASSWORD = 'bench-password-123'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--duration', type=int, default=15)
+        parser.add_argument('--login-threads', type=int, default=8)
+        parser.add_argument('--other-threads', type=int, default=8)
+
+    def handle(self, *args, **options):
+        base = options['url'].rstrip('/')
+        customer, _ = Customer.objects.update_or_create(
+            email=self.BENCH_EMAIL,
+            defaults={
+                'name': 'Bench',
+                'phone': 'bench-login',
+                'password_hash': make_password(self.BENCH_PASSWORD),
+                'is_active': True,
+            },
+        )
+        token = customer.generate_jwt_token()
+
+        results = {'login': [], 'other': []}
+        errors = {'login': 0, 'other': 0, 'busy': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def login_loop():
+            session = requests.Session()
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                r = session.post(f'{base}/api/accounts/login/', json={
+                    'email': self.BENCH_EMAIL, 'password': self.BENCH_PASSWORD,
+                })
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    if r.status_code == 200:
+                        results['login'].append(elapsed)
+                    elif r.status_code == 503:
+                        errors['busy'] += 1
+                    else:
+                        errors['login'] += 1
+
+        def other_loop():
+            session = requests.Session()
+            headers = {'Authorization': f'Bearer {token}'}
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                r = session.get(f'{base}/api/accounts/account-status/', headers=headers)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    if r.status_code == 200:
+                        results['other'].append(elapsed)
+                    else:
+                        errors['other'] += 1
+
+        threads = [threading.Thread(target=login_loop) for _ in range(options['login_threads'])]
+        threads += [threading.Thread(target=other_loop) for _ in range(options['other_threads'])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for name, samples in results.items():
+            if not samples:
+                self.stdout.write(self.style.WARNING(f'{name}: no successful requests'))
+                continue
+            self.stdout.write(
+                f"{name:6} n={len(samples):6} rps={len(samples) / options['duration']:8.1f} "
+                f"p50={statistics.median(samples):7.1f}ms p99={percentile(samples, 99):7.1f}ms "
+                f"errors={errors[name]}"
+            )
+        self.stdout.write(f"login rejected (503 busy): {errors['busy']}")
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from urllib.parse import urlparse
+
+from django.core.management.base import BaseCommand
+
+from accounts.models import Customer
+
+
+def read_rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Command(BaseCommand):
+    help = 'فتح آلاف اتصالات SSE الخاملة على خادم ASGI وقياس ما يتحمله العامل'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--hold', type=int, default=30, help='مدة إبقاء الاتصالات مفتوحة (ثواني)')
+        parser.add_argument('--pid', type=int, help='pid عامل الخادم لقراءة استهلاك الذاكرة')
+
+    def handle(self, *args, **options):
+        customer, _ = Customer.objects.get_or_create(phone='bench-sse', defaults={'name': 'Bench SSE'})
+        token = customer.generate_jwt_token()
+        asyncio.run(self.run(options, token))
+
+    async def run(self, options, token):
+        parsed = urlparse(options['url'])
+        host, port = parsed.hostname, parsed.port or 80
+        request = (
+            f"GET /api/accounts/notifications/stream/?token={token} HTTP/1.1\r\n"
+            f"Host: {host}\r\nAccept: text/event-stream\r\n\r\n"
+        ).encode()
+
+        stats = {'open': 0, 'failed': 0, 'pings': 0, 'events': 0}
+        rss_before = read_rss_kb(options['pid']) if options['pid'] else None
+        deadline = time.monotonic() + options['hold']
+
+        async def client():
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+                if b' 200 ' not in status_line:
+                    stats['failed'] += 1
+                    writer.close()
+                    return
+                stats['open'] += 1
+                while time.monotonic() < deadline:
+                    try:
+                        line = await asyncio.wait_for(reader.readline(), timeout=deadline - time.monotonic())
+                    except asyncio.TimeoutError:
+                        break
+                    if not line:
+                        break
+                    if line.startswith(b': ping'):
+                        stats['pings'] += 1
+                    elif line.startswith(b'event: notification'):
+                        stats['events'] += 1
+                writer.close()
+            except OSError:
+                stats['failed'] += 1
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(client()) for _ in range(options['connections'])]
+        while time.monotonic() < deadline and any(not t.done() for t in tasks):
+            await asyncio.sleep(1)
+            if stats['open'] + stats['failed'] >= options['connections']:
+                break
+        connect_time = time.perf_counter() - started
+        rss_peak = read_rss_kb(options['pid']) if options['pid'] else None
+        await asyncio.gather(*tasks)
+
+        self.stdout.write(
+            f"open={stats['open']} failed={stats['failed']} "
+            f"connect_time={connect_time:.2f}s pings={stats['pings']} events={stats['events']}"
+        )
+        if rss_before is not None and rss_peak is not None and stats['open']:
+            per_conn = (rss_peak - rss_before) / stats['open']
+            self.stdout.write(
+                f"server rss: {rss_before / 1024:.1f}MB -> {rss_peak / 1024:.1f}MB "
+                f"(~{per_conn:.1f}KB per connection)"
+            )
@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from accounts.models import BalanceSnapshot, Transaction
+
+
+class Command(BaseCommand):
+    help = 'إنشاء snapshot لرصيد كل عميل لديه معاملات بعد آخر snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-tail', type=int, default=1,
+                            help='أقل عدد معاملات بعد آخر snapshot لإنشاء snapshot جديد')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--settle-seconds', type=int, default=300,
+                            help='تجاهل المعاملات الأحدث من N ثانية (قد توجد معاملة بـ id أصغر لم تُثبَّت بعد)')
+
+    def handle(self, *args, **options):
+        # كل snapshot في التشغيل الواحد يحمل نفس last_transaction_id (الحد الأعلى)، فأكبرها هو العلامة
+        after = BalanceSnapshot.objects.aggregate(last=Max('last_transaction_id'))['last'] or 0
+        settled = timezone.now() - timedelta(seconds=options['settle_seconds'])
+        upto = Transaction.objects.filter(id__gt=after, created_at__lt=settled).aggregate(last=Max('id'))['last']
+        if upto is None:
+            self.stdout.write('لا توجد معاملات جديدة مستقرة')
+            return
+
+        # GROUP BY customer_id واحد على المعاملات الجديدة فقط
+        tails = (
+            Transaction.objects.filter(id__gt=after, id__lte=upto).order_by()
+            .values('customer_id')
+            .annotate(delta=Sum('amount'), tail=Count('id'))
+            .filter(tail__gte=options['min_tail'])
+            .order_by('customer_id')
+        )
+
+        created = 0
+        batch = []
+        for row in tails.iterator(chunk_size=options['batch_size']):
+            batch.append(row)
+            if len(batch) >= options['batch_size']:
+                created += self.write(batch, after, upto)
+                batch = []
+        created += self.write(batch, after, upto)
+
+        self.stdout.write(self.style.SUCCESS(f'✅ تم إنشاء {created} snapshot حتى المعاملة {upto}'))
+
+    @staticmethod
+    def write(rows, after, upto):
+        """snapshot لكل عميل = آخر snapshot له + معاملاته حتى upto"""
+        if not rows:
+            return 0
+        latest = BalanceSnapshot.objects.filter(customer_id=OuterRef('customer_id')).order_by('-last_transaction_id')
+        bases = {
+            customer_id: (balance, last_id)
+            for customer_id, balance, last_id in BalanceSnapshot.objects.filter(
+                customer_id__in=[row['customer_id'] for row in rows],
+                id=Subquery(latest.values('id')[:1]),
+            ).values_list('customer_id', 'balance', 'last_transaction_id')
+        }
+        # عملاء تخطاهم --min-tail سابقاً: معاملاتهم بين آخر snapshot لهم و after لم تدخل أي snapshot
+        gaps = Q()
+        for row in rows:
+            last_id = bases.get(row['customer_id'], (0, 0))[1]
+            if last_id < after:
+                gaps |= Q(customer_id=row['customer_id'], id__gt=last_id, id__lte=after)
+        gap_totals = {}
+        if gaps:
+            gap_totals = dict(
+                Transaction.objects.filter(gaps).order_by()
+                .values('customer_id').annotate(total=Sum('amount')).values_list('customer_id', 'total')
+            )
+        BalanceSnapshot.objects.bulk_create([
+            BalanceSnapshot(
+                customer_id=row['customer_id'],
+                balance=(
+                    bases.get(row['customer_id'], (0, 0))[0]
+                    + gap_totals.get(row['customer_id'], 0) + row['delta']
+                ),
+                last_transaction_id=upto,
+            )
+            for row in rows
+        ])
+        return len(rows)
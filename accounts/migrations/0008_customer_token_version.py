@@ -0,0 +1,24 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0007_customer_password_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customer",
+            name="token_version",
+            field=models.PositiveIntegerField(default=0, verbose_name="إصدار التوكن"),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["updated_at"], name="accounts_cu_updated_973d01_idx"
+            ),
+        ),
+    ]
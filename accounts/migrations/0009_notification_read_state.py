@@ -0,0 +1,115 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def init_broadcast_counter(apps, schema_editor):
+    Notification = apps.get_model("accounts", "Notification")
+    BroadcastCounter = apps.get_model("accounts", "BroadcastCounter")
+    BroadcastCounter.objects.update_or_create(
+        pk=1,
+        defaults={"total": Notification.objects.filter(customer__isnull=True).count()},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0008_customer_token_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BroadcastCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("total", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Broadcast Counter",
+                "verbose_name_plural": "Broadcast Counter",
+            },
+        ),
+        migrations.CreateModel(
+            name="NotificationRead",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Notification Read",
+                "verbose_name_plural": "Notification Reads",
+            },
+        ),
+        migrations.CreateModel(
+            name="NotificationState",
+            fields=[
+                (
+                    "customer",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="notification_state",
+                        serialize=False,
+                        to="accounts.customer",
+                    ),
+                ),
+                ("unread_count", models.IntegerField(default=0)),
+                ("broadcasts_read", models.IntegerField(default=0)),
+                ("version", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Notification State",
+                "verbose_name_plural": "Notification States",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["customer", "-created_at"],
+                name="accounts_no_custome_e77838_idx",
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationread",
+            name="customer",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="notification_reads",
+                to="accounts.customer",
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationread",
+            name="notification",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="reads",
+                to="accounts.notification",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="notificationread",
+            constraint=models.UniqueConstraint(
+                fields=("customer", "notification"), name="unique_notification_read"
+            ),
+        ),
+        migrations.RunPython(init_broadcast_counter, migrations.RunPython.noop),
+    ]
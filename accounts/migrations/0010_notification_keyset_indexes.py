@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0009_notification_read_state"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="notification",
+            options={
+                "ordering": ["-created_at", "-id"],
+                "verbose_name": "Notification",
+                "verbose_name_plural": "Notifications",
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name="notification",
+            name="accounts_no_custome_e77838_idx",
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["customer", "-created_at", "-id"],
+                name="accounts_no_custome_0576ee_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="accounts_no_created_6ce790_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_opening_snapshots(apps, schema_editor):
+    # الأرصدة الحالية سابقة للسجل، نحفظها كرصيد افتتاحي لكل عميل
+    Customer = apps.get_model("accounts", "Customer")
+    Transaction = apps.get_model("accounts", "Transaction")
+    BalanceSnapshot = apps.get_model("accounts", "BalanceSnapshot")
+    last_id = Transaction.objects.order_by("-id").values_list("id", flat=True).first() or 0
+    batch = []
+    for customer_id, balance in Customer.objects.values_list("id", "token_balance").iterator():
+        batch.append(
+            BalanceSnapshot(customer_id=customer_id, balance=balance or 0, last_transaction_id=last_id)
+        )
+        if len(batch) >= 1000:
+            BalanceSnapshot.objects.bulk_create(batch)
+            batch = []
+    BalanceSnapshot.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0010_notification_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BalanceSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("balance", models.BigIntegerField()),
+                ("last_transaction_id", models.BigIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Balance Snapshot",
+                "verbose_name_plural": "Balance Snapshots",
+            },
+        ),
+        migrations.CreateModel(
+            name="TransactionArchive",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("customer_id", models.BigIntegerField(db_index=True)),
+                ("transaction_type", models.CharField(max_length=20)),
+                ("amount", models.IntegerField()),
+                ("description", models.TextField()),
+                ("source_id", models.BigIntegerField(blank=True, null=True)),
+                ("created_at", models.DateTimeField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Transaction Archive",
+                "verbose_name_plural": "Transactions Archive",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["customer", "id"], name="accounts_tr_custome_e59466_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["created_at"], name="accounts_tr_created_b2c597_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="balancesnapshot",
+            name="customer",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="balance_snapshots",
+                to="accounts.customer",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="balancesnapshot",
+            index=models.Index(
+                fields=["customer", "-last_transaction_id"],
+                name="accounts_ba_custome_deb001_idx",
+            ),
+        ),
+        migrations.RunPython(create_opening_snapshots, migrations.RunPython.noop),
+    ]
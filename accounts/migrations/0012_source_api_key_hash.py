@@ -0,0 +1,20 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0011_token_ledger"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="source",
+            name="api_key_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True, unique=True
+            ),
+        ),
+    ]
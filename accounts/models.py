@@ -1,6 +1,11 @@
-from django.db import models
+import hashlib
+import secrets
+
+from django.db import models, transaction, IntegrityError, connection
+from django.utils import timezone
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
-from django.db.models.functions import Coalesce
 import jwt
 from datetime import datetime, timedelta
 from django.conf import settings
@@ -9,6 +14,8 @@ from django.conf import settings
 class Source(models.Model):
     name = models.CharField(max_length=50)
     prefix = models.CharField(max_length=1, unique=True)
+    # sha256 لمفتاح API الموزع، المفتاح نفسه يُعرض مرة واحدة عند إصداره
+    api_key_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -18,6 +25,17 @@ class Source(models.Model):
     
     def __str__(self):
         return f"{self.name}"
+    
+    @staticmethod
+    def hash_api_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+    
+    def issue_api_key(self):
+        """إصدار مفتاح API جديد (يبطل السابق) وإرجاعه"""
+        key = secrets.token_urlsafe(32)
+        self.api_key_hash = self.hash_api_key(key)
+        self.save(update_fields=['api_key_hash'])
+        return key
 
 
 class Customer(models.Model):
@@ -26,6 +44,7 @@ class Customer(models.Model):
     phone = models.CharField(max_length=15, unique=True)
     password_hash = models.CharField(max_length=128, null=True, blank=True, verbose_name="كلمة المرور")
     token_balance = models.PositiveIntegerField(default=0, null=False, blank=False, verbose_name="رصيد التوكنز")
+    token_version = models.PositiveIntegerField(default=0, verbose_name="إصدار التوكن")
     
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, related_name='customer')
     source = models.ForeignKey(Source, on_delete=models.SET_NULL, null=True, blank=True)
@@ -41,6 +60,7 @@ class Customer(models.Model):
         indexes = [
             models.Index(fields=['email']),
             models.Index(fields=['phone']),
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
@@ -51,25 +71,103 @@ class Customer(models.Model):
             'customer_id': self.id,
             'email': self.email,
             'name': self.name,
+            'ver': self.token_version,
             'exp': datetime.utcnow() + timedelta(days=30),
             'type': 'customer'
         }
         return jwt.encode(payload, settings.JWT_SECRET_KEY, algorithm='HS256')
     
-    def spend_tokens(self, amount):
-        if self.token_balance >= amount:
-            Customer.objects.filter(pk=self.pk).update(
-                token_balance=Coalesce(models.F('token_balance'), 0) - amount
+    def save(self, *args, **kwargs):
+        if not self._state.adding or not self.token_balance:
+            return super().save(*args, **kwargs)
+        # الرصيد الابتدائي يُسجل كحركة حتى يبقى السجل (ledger) مطابقاً للرصيد
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Transaction.record(self.pk, self.token_balance, Transaction.OPENING, "رصيد افتتاحي")
+
+    def revoke_tokens(self):
+        """إبطال كل التوكنات الصادرة سابقاً لهذا العميل"""
+        self.token_version = models.F('token_version') + 1
+        self.save(update_fields=['token_version', 'updated_at'])
+        self.refresh_from_db(fields=['token_version'])
+
+    def deactivate(self):
+        """تعطيل الحساب مع إبطال توكناته، فالتوثيق الخفيف (claims) يرفضها فوراً"""
+        self.is_active = False
+        self.token_version = models.F('token_version') + 1
+        self.save(update_fields=['is_active', 'token_version', 'updated_at'])
+        self.refresh_from_db(fields=['token_version'])
+    
+    @classmethod
+    def adjust_balance(cls, customer_id, delta):
+        """تعديل الرصيد بجملة UPDATE مشروطة واحدة ترجع الرصيد الجديد
+
+        الخصم (delta سالب) يتم فقط إذا كان الرصيد يكفي. ترجع None إذا لم يكفِ
+        الرصيد أو لم يوجد العميل.
+        """
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {qn(cls._meta.db_table)} SET token_balance = token_balance + %s '
+                f'WHERE id = %s AND token_balance + %s >= 0 RETURNING token_balance',
+                [delta, customer_id, delta],
             )
-            self.refresh_from_db()
-            return True
-        return False
+            row = cursor.fetchone()
+        return row[0] if row else None
     
-    def add_tokens(self, amount):
-        Customer.objects.filter(pk=self.pk).update(
-            token_balance=Coalesce(models.F('token_balance'), 0) + amount
-        )
-        self.refresh_from_db()
+    @classmethod
+    def debit_many(cls, amounts, transaction_type='spend', description=''):
+        """خصم مبالغ مختلفة من عدة عملاء بجملة واحدة {customer_id: amount}
+
+        يُخصم فقط من العملاء الذين يكفي رصيدهم وتُسجل حركاتهم في السجل.
+        ترجع {customer_id: الرصيد الجديد} للعملاء الذين تم الخصم منهم.
+        """
+        if not amounts:
+            return {}
+        qn = connection.ops.quote_name
+        case = 'CASE id ' + ' '.join(['WHEN %s THEN %s'] * len(amounts)) + ' END'
+        case_params = [value for pair in amounts.items() for value in pair]
+        ids = list(amounts)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE {qn(cls._meta.db_table)} SET token_balance = token_balance - {case} '
+                    f'WHERE id IN ({", ".join(["%s"] * len(ids))}) AND token_balance >= {case} '
+                    f'RETURNING id, token_balance',
+                    [*case_params, *ids, *case_params],
+                )
+                balances = dict(cursor.fetchall())
+            Transaction.objects.bulk_create([
+                Transaction(
+                    customer_id=customer_id, transaction_type=transaction_type,
+                    amount=-amounts[customer_id], description=description,
+                )
+                for customer_id in balances
+            ])
+        return balances
+    
+    def spend_tokens(self, amount, description=''):
+        with transaction.atomic():
+            balance = Customer.adjust_balance(self.pk, -amount)
+            if balance is None:
+                return False
+            Transaction.record(self.pk, -amount, Transaction.SPEND, description)
+        self.token_balance = balance
+        return True
+    
+    def add_tokens(self, amount, transaction_type='credit', description=''):
+        with transaction.atomic():
+            balance = Customer.adjust_balance(self.pk, amount)
+            Transaction.record(self.pk, amount, transaction_type, description)
+        self.token_balance = balance
+        return balance
+    
+    def ledger_balance(self):
+        """إعادة بناء الرصيد من آخر snapshot + المعاملات التي بعده"""
+        snapshot = self.balance_snapshots.order_by('-last_transaction_id').first()
+        base, after_id = (snapshot.balance, snapshot.last_transaction_id) if snapshot else (0, 0)
+        tail = self.transactions.filter(id__gt=after_id).aggregate(total=models.Sum('amount'))['total']
+        return base + (tail or 0)
     
     @classmethod
     def get_or_create_by_email(cls, email, defaults=None):
@@ -81,7 +179,27 @@ class Customer(models.Model):
         return customer
 
 
+class LedgerError(Exception):
+    pass
+
+
+class TransactionQuerySet(models.QuerySet):
+    # سجل المعاملات للإضافة فقط: لا تعديل ولا حذف (الأرشفة تتم عبر archive_ledger)
+    def update(self, **kwargs):
+        raise LedgerError("Transaction ledger is append-only")
+    
+    def delete(self):
+        raise LedgerError("Transaction ledger is append-only")
+
+
 class Transaction(models.Model):
+    """سجل حركات رصيد التوكنز (موجب = إضافة، سالب = خصم)"""
+    CREDIT = 'credit'
+    SPEND = 'spend'
+    PURCHASE = 'purchase'
+    SERIAL_ACTIVATION = 'serial_activation'
+    OPENING = 'opening'
+    
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='transactions')
     transaction_type = models.CharField(max_length=20)
     amount = models.IntegerField()
@@ -89,13 +207,75 @@ class Transaction(models.Model):
     source = models.ForeignKey(Source, on_delete=models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = TransactionQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Transaction"
         verbose_name_plural = "Transactions"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['customer', 'id']),
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         return f"{self.customer.name} - {self.transaction_type} ({self.amount})"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise LedgerError("Transaction ledger is append-only")
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise LedgerError("Transaction ledger is append-only")
+    
+    @classmethod
+    def record(cls, customer_id, amount, transaction_type, description='', source=None):
+        """كتابة حركة في السجل، يجب استدعاؤها داخل نفس المعاملة التي غيّرت الرصيد"""
+        return cls.objects.create(
+            customer_id=customer_id,
+            transaction_type=transaction_type,
+            amount=amount,
+            description=description,
+            source=source,
+        )
+
+
+class TransactionArchive(models.Model):
+    """معاملات قديمة مغطاة بـ snapshot، منقولة من Transaction للحفاظ على سرعة الجدول"""
+    id = models.BigIntegerField(primary_key=True)
+    customer_id = models.BigIntegerField(db_index=True)
+    transaction_type = models.CharField(max_length=20)
+    amount = models.IntegerField()
+    description = models.TextField()
+    source_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Transaction Archive"
+        verbose_name_plural = "Transactions Archive"
+    
+    def __str__(self):
+        return f"{self.customer_id} - {self.transaction_type} ({self.amount})"
+
+
+class BalanceSnapshot(models.Model):
+    """رصيد العميل بعد المعاملة last_transaction_id، لإعادة بناء الرصيد بدون مسح كامل"""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='balance_snapshots')
+    balance = models.BigIntegerField()
+    last_transaction_id = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Balance Snapshot"
+        verbose_name_plural = "Balance Snapshots"
+        indexes = [
+            models.Index(fields=['customer', '-last_transaction_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.customer_id}: {self.balance} @ {self.last_transaction_id}"
 
 
 class Notification(models.Model):
@@ -117,7 +297,228 @@ class Notification(models.Model):
     class Meta:
         verbose_name = "Notification"
         verbose_name_plural = "Notifications"
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['customer', '-created_at', '-id']),
+            models.Index(fields=['-created_at', '-id']),
+        ]
+    
+    def __str__(self):
+        return self.title
+    
+    @property
+    def is_broadcast(self):
+        return self.customer_id is None
+    
+    @classmethod
+    def send_to(cls, customers, title, description, notification_type='info'):
+        """إرسال إشعار خاص لمجموعة عملاء بـ INSERT ... SELECT واحد، يرجع عدد الصفوف
+
+        customers قد يحوي joins (مثلاً source__prefix)، لذلك DISTINCT على id.
+        """
+        customer_ids = customers.order_by().values('id').distinct()
+        sub_sql, sub_params = customer_ids.query.sql_with_params()
+        table = connection.ops.quote_name(cls._meta.db_table)
+        created_at = timezone.now()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (customer_id, title, description, notification_type, is_read, created_at) "
+                    f"SELECT t.id, %s, %s, %s, %s, %s FROM ({sub_sql}) t RETURNING id, customer_id",
+                    [title, description, notification_type, False,
+                     cls._meta.get_field('created_at').get_db_prep_value(created_at, connection), *sub_params],
+                )
+                inserted = cursor.fetchall()
+            # الصفوف المُدرجة لا تمر بـ post_save، لذا نحدّث العدادات الموجودة هنا
+            # (الحالات غير الموجودة تُحسب من الجداول عند أول قراءة)
+            NotificationState.objects.filter(customer__in=customer_ids).update(
+                unread_count=models.F('unread_count') + 1,
+                version=models.F('version') + 1,
+            )
+            # ولا تُدفع لاتصالات SSE عبر post_save: ندفع صفوف المشتركين في هذه العملية فقط
+            sent = [
+                cls(id=pk, customer_id=customer_id, title=title, description=description,
+                    notification_type=notification_type, created_at=created_at)
+                for pk, customer_id in inserted
+            ]
+            transaction.on_commit(lambda: cls._publish_sent(sent))
+        return len(inserted)
+    
+    @staticmethod
+    def _publish_sent(notifications):
+        from .services.notification_bus import notification_bus, serialize_notification
+        subscribed = notification_bus.subscribed_customers()
+        for notification in notifications:
+            if notification.customer_id in subscribed:
+                notification_bus.publish(serialize_notification(notification))
+    
+    @classmethod
+    def mark_all_read(cls, customer, up_to=None):
+        """تعليم كل إشعارات العميل كمقروءة (أو حتى موضع معيّن (created_at, id) ضمناً)
+
+        الإشعارات الخاصة: UPDATE واحد، العامة: INSERT ... SELECT واحد لإيصالات القراءة.
+        """
+        direct = cls.objects.filter(customer=customer, is_read=False)
+        broadcasts = cls.objects.filter(customer__isnull=True).exclude(
+            models.Exists(NotificationRead.objects.filter(notification=models.OuterRef('pk'), customer=customer))
+        )
+        if up_to is not None:
+            created_at, pk = up_to
+            position = models.Q(created_at__lt=created_at) | models.Q(created_at=created_at, id__lte=pk)
+            direct = direct.filter(position)
+            broadcasts = broadcasts.filter(position)
+        
+        with transaction.atomic():
+            direct_count = direct.update(is_read=True)
+            
+            ids_sql, ids_params = broadcasts.order_by().values('id').query.sql_with_params()
+            table = connection.ops.quote_name(NotificationRead._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (customer_id, notification_id, created_at) "
+                    f"SELECT %s, t.id, %s FROM ({ids_sql}) t WHERE true "
+                    f"ON CONFLICT (customer_id, notification_id) DO NOTHING",
+                    [customer.pk, timezone.now(), *ids_params],
+                )
+                broadcast_count = cursor.rowcount
+            
+            if direct_count or broadcast_count:
+                NotificationState.bump(customer.pk, unread_count=-direct_count, broadcasts_read=broadcast_count)
+        return direct_count + broadcast_count
+    
+    def mark_read(self, customer):
+        """تعليم الإشعار كمقروء لهذا العميل، يرجع True إذا تغيّرت الحالة"""
+        with transaction.atomic():
+            if self.is_broadcast:
+                _, changed = NotificationRead.objects.get_or_create(customer=customer, notification=self)
+                if changed:
+                    NotificationState.bump(customer.pk, broadcasts_read=1)
+            else:
+                changed = bool(Notification.objects.filter(
+                    pk=self.pk, customer=customer, is_read=False
+                ).update(is_read=True))
+                if changed:
+                    NotificationState.bump(customer.pk, unread_count=-1)
+        return changed
+
+
+class NotificationRead(models.Model):
+    """إيصال قراءة إشعار عام (customer = NULL) لكل عميل على حدة"""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='notification_reads')
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='reads')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Notification Read"
+        verbose_name_plural = "Notification Reads"
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'notification'], name='unique_notification_read'),
+        ]
     
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return f"{self.customer_id} - {self.notification_id}"
+
+
+class BroadcastCounter(models.Model):
+    """عدد الإشعارات العامة (صف واحد)، يُحدّث ذرياً عند الإنشاء والحذف"""
+    total = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Broadcast Counter"
+        verbose_name_plural = "Broadcast Counter"
+    
+    @classmethod
+    def bump(cls, delta, create=True):
+        """إنشاء الصف عند أول استعمال يحسب المجموع من الجدول، فيجب أن يتضمن الجدول التغيير الحالي"""
+        if cls.objects.filter(pk=1).update(total=models.F('total') + delta) or not create:
+            return
+        total = Notification.objects.filter(customer__isnull=True).count()
+        cls.objects.get_or_create(pk=1, defaults={'total': total})
+
+
+class NotificationState(models.Model):
+    """عدادات الإشعارات غير المقروءة لكل عميل (denormalized)
+
+    unread = unread_count (الإشعارات الخاصة) + (BroadcastCounter.total - broadcasts_read)
+    بهذا لا نكتب أي صف لكل عميل عند إرسال إشعار عام.
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='notification_state')
+    unread_count = models.IntegerField(default=0)
+    broadcasts_read = models.IntegerField(default=0)
+    version = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Notification State"
+        verbose_name_plural = "Notification States"
+    
+    def __str__(self):
+        return f"{self.customer_id} ({self.unread_count} unread)"
+    
+    @classmethod
+    def _initial_values(cls, customer_id):
+        return {
+            'unread_count': Notification.objects.filter(customer_id=customer_id, is_read=False).count(),
+            'broadcasts_read': NotificationRead.objects.filter(customer_id=customer_id).count(),
+        }
+    
+    @classmethod
+    def bump(cls, customer_id, create=True, **deltas):
+        """زيادة/إنقاص العدادات ذرياً بـ UPDATE واحد، وإنشاء الصف عند أول استعمال"""
+        updates = {field: models.F(field) + delta for field, delta in deltas.items()}
+        updates['version'] = models.F('version') + 1
+        if cls.objects.filter(customer_id=customer_id).update(**updates) or not create:
+            return
+        try:
+            # القيم الأولية تُحسب من الجداول وتتضمن التغيير الحالي
+            with transaction.atomic():
+                cls.objects.create(customer_id=customer_id, version=1, **cls._initial_values(customer_id))
+        except IntegrityError:
+            cls.objects.filter(customer_id=customer_id).update(**updates)
+    
+    @classmethod
+    def unread_for(cls, customer_id):
+        """قراءة العداد في استعلام واحد (صف الحالة + عداد الإشعارات العامة)"""
+        broadcast_total = models.Subquery(BroadcastCounter.objects.filter(pk=1).values('total')[:1])
+        row = (
+            cls.objects.filter(customer_id=customer_id)
+            .annotate(broadcast_total=broadcast_total)
+            .values('unread_count', 'broadcasts_read', 'broadcast_total', 'version')
+            .first()
+        )
+        if row is None:
+            cls.bump(customer_id)
+            return cls.unread_for(customer_id)
+        if row['broadcast_total'] is None:
+            BroadcastCounter.bump(0)
+            return cls.unread_for(customer_id)
+        broadcast_unread = max(0, (row['broadcast_total'] or 0) - row['broadcasts_read'])
+        return row['unread_count'] + broadcast_unread, row['version']
+
+
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, **kwargs):
+    if not created:
+        return
+    
+    # دفع الإشعار لاتصالات SSE في هذه العملية بعد تأكيد المعاملة
+    from .services.notification_bus import notification_bus, serialize_notification
+    event = serialize_notification(instance)
+    transaction.on_commit(lambda: notification_bus.publish(event))
+    
+    if instance.is_broadcast:
+        BroadcastCounter.bump(1)
+    elif not instance.is_read:
+        NotificationState.bump(instance.customer_id, unread_count=1)
+
+
+@receiver(pre_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if instance.is_broadcast:
+        # الصف ما زال موجوداً هنا، فعداد يُنشأ الآن سيحسبه. يُنشأ لاحقاً من الجدول
+        BroadcastCounter.bump(-1, create=False)
+        NotificationState.objects.filter(
+            customer__notification_reads__notification=instance
+        ).update(broadcasts_read=models.F('broadcasts_read') - 1, version=models.F('version') + 1)
+    elif not instance.is_read:
+        # الصف ما زال موجوداً هنا، لذا لا ننشئ حالة جديدة محسوبة منه
+        NotificationState.bump(instance.customer_id, create=False, unread_count=-1)
\ No newline at end of file
@@ -0,0 +1,14 @@
+from rest_framework import serializers
+
+from .models import Notification
+
+
+class SendNotificationSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=200)
+    description = serializers.CharField()
+    type = serializers.ChoiceField(choices=Notification.NOTIFICATION_TYPES, default='info')
+    # فلاتر العملاء (اختيارية)
+    source_id = serializers.IntegerField(required=False)
+    source_prefix = serializers.CharField(required=False)
+    has_source = serializers.BooleanField(required=False, allow_null=True, default=None)
+    customer_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
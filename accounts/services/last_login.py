@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class LastLoginTracker:
+    """تجميع أوقات آخر دخول في الذاكرة وكتابتها دفعة واحدة (write-behind)
+
+    الكتابة تتم عند امتلاء max_pending، أو بعد flush_interval ثانية من أول قيمة معلقة عبر
+    timer في الخلفية، فالعامل الخامل لا يحتفظ بقيم غير مكتوبة.
+    """
+
+    def __init__(self, flush_interval=30, max_pending=500, min_age=300):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.min_age = timedelta(seconds=min_age)
+        self._pending = {}
+        # آخر كتابة لكل عميل في هذه العملية، حتى لا نقرأ last_login من القاعدة
+        # للعملاء القادمين من كاش التوثيق (الحقل مؤجل هناك)
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    def touch(self, customer):
+        """تسجيل دخول العميل، الكتابة الفعلية تتم عند الـ flush"""
+        now = timezone.now()
+
+        last_login = self._recent.get(customer.pk)
+        if last_login is None and 'last_login' not in customer.get_deferred_fields():
+            last_login = customer.last_login
+        # القيمة المخزنة حديثة بما يكفي، لا داعي للكتابة
+        if last_login and now - last_login < self.min_age:
+            return False
+
+        customer.last_login = now
+        with self._lock:
+            self._pending[customer.pk] = now
+            self._recent[customer.pk] = now
+            should_flush = (
+                len(self._pending) >= self.max_pending
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if not should_flush and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._timed_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if should_flush:
+            self.flush()
+        return True
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """كتابة كل الأوقات المعلقة في UPDATE واحد"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            cutoff = timezone.now() - self.min_age
+            self._recent = {pk: ts for pk, ts in self._recent.items() if ts >= cutoff}
+
+        if not pending:
+            return 0
+
+        from accounts.models import Customer
+
+        try:
+            return Customer.objects.filter(pk__in=pending.keys()).update(
+                last_login=Case(
+                    *[When(pk=pk, then=Value(ts)) for pk, ts in pending.items()],
+                    output_field=DateTimeField(),
+                )
+            )
+        except Exception as e:
+            logger.error(f"❌ last_login flush failed ({len(pending)} rows): {e}")
+            # إعادة القيم المعلقة لمحاولة لاحقة دون الكتابة فوق قيم أحدث
+            with self._lock:
+                for pk, ts in pending.items():
+                    self._pending.setdefault(pk, ts)
+            return 0
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+
+last_login_tracker = LastLoginTracker(
+    flush_interval=getattr(settings, 'LAST_LOGIN_FLUSH_INTERVAL', 30),
+    max_pending=getattr(settings, 'LAST_LOGIN_MAX_PENDING', 500),
+    min_age=getattr(settings, 'LAST_LOGIN_MIN_AGE', 300),
+)
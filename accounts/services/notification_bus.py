@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class TooManyConnections(Exception):
+    """تجاوز الحد الأقصى لاتصالات SSE في هذا العامل"""
+
+
+def serialize_notification(notification):
+    return {
+        'id': notification.id,
+        'customer_id': notification.customer_id,
+        'title': notification.title,
+        'description': notification.description,
+        'type': notification.notification_type,
+        'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M'),
+    }
+
+
+class RecentIds:
+    """آخر size id تم تمريرها، لمنع التكرار
+
+    لا نعتمد على أكبر id: المعاملة التي حجزت id أصغر قد تُثبت بعد معاملة بـ id أكبر.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._ids = OrderedDict()
+
+    def __contains__(self, pk):
+        return pk in self._ids
+
+    def add(self, pk):
+        """False إذا كان موجوداً من قبل"""
+        if pk in self._ids:
+            return False
+        self._ids[pk] = None
+        if len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+        return True
+
+
+class Subscription:
+    def __init__(self, customer_id, loop, queue_size):
+        self.customer_id = customer_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.seen = RecentIds(queue_size * 10)
+        self.overflowed = False
+
+    def wants(self, event):
+        return event['customer_id'] is None or event['customer_id'] == self.customer_id
+
+    def offer(self, event):
+        # يُستدعى داخل حلقة الأحداث الخاصة بالاشتراك
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # العميل بطيء: نغلق البث ليعيد الاتصال ويكمل بـ Last-Event-ID
+            self.overflowed = True
+
+
+class NotificationBus:
+    """pub/sub داخل العملية لدفع الإشعارات الجديدة لاتصالات SSE
+
+    النشر فوري داخل نفس العملية (post_save على Notification)، ومهمة واحدة لكل
+    عامل تستعلم دورياً لالتقاط الإشعارات التي أنشأتها عمليات أخرى: id > آخر id، وأيضاً
+    ما أُنشئ خلال آخر settle ثانية ولم يُنشر بعد (معاملة أُثبتت متأخرة بـ id أصغر).
+    كل إشعار يُنشر مرة واحدة (RecentIds).
+    """
+
+    def __init__(self, max_connections=5000, queue_size=100, poll_interval=5, settle=60, recent_size=10000):
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.settle = timedelta(seconds=settle)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._recent = RecentIds(recent_size)
+        self._last_id = None
+        self._poller = None
+
+    @property
+    def connections(self):
+        return len(self._subscribers)
+
+    def subscribe(self, customer_id):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if len(self._subscribers) >= self.max_connections:
+                raise TooManyConnections()
+            subscription = Subscription(customer_id, loop, self.queue_size)
+            self._subscribers.add(subscription)
+        self._ensure_poller(loop)
+        return subscription
+
+    def subscribed_customers(self):
+        with self._lock:
+            return {subscription.customer_id for subscription in self._subscribers}
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        """آمن للاستدعاء من أي خيط (مثلاً من إشارة post_save المتزامنة)"""
+        with self._lock:
+            if not self._recent.add(event['id']):
+                return
+            if self._last_id is None or event['id'] > self._last_id:
+                self._last_id = event['id']
+            targets = [s for s in self._subscribers if s.wants(event)]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # الحلقة أُغلقت
+                self.unsubscribe(subscription)
+
+    def _ensure_poller(self, loop):
+        if self._poller is None or self._poller.done():
+            self._poller = loop.create_task(self._poll_forever())
+
+    async def _poll_forever(self):
+        from asgiref.sync import sync_to_async
+
+        while self._subscribers:
+            try:
+                events = await sync_to_async(self._fetch_new, thread_sensitive=False)()
+                for event in events:
+                    self.publish(event)
+            except Exception as e:
+                logger.error(f"❌ notification poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def _fetch_new(self):
+        from accounts.models import Notification
+
+        recent = Notification.objects.filter(created_at__gte=timezone.now() - self.settle)
+        if self._last_id is None:
+            # الإشعارات الموجودة قبل أول استطلاع ليست جديدة
+            self._last_id = Notification.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            existing = list(recent.filter(id__lte=self._last_id).values_list('id', flat=True))
+            with self._lock:
+                for pk in existing:
+                    self._recent.add(pk)
+            return []
+        last_id = self._last_id
+        rows = list(Notification.objects.filter(id__gt=last_id).order_by('id')[:500])
+        recent_ids = list(recent.filter(id__lte=last_id).values_list('id', flat=True))
+        with self._lock:
+            late = [pk for pk in recent_ids if pk not in self._recent]
+        if late:
+            rows = list(Notification.objects.filter(id__in=late).order_by('id')) + rows
+        return [serialize_notification(n) for n in rows]
+
+
+notification_bus = NotificationBus(
+    max_connections=getattr(settings, 'SSE_MAX_CONNECTIONS', 5000),
+    queue_size=getattr(settings, 'SSE_QUEUE_SIZE', 100),
+    poll_interval=getattr(settings, 'SSE_POLL_INTERVAL', 5),
+    settle=getattr(settings, 'SSE_SETTLE_SECONDS', 60),
+)
@@ -0,0 +1,96 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHashingBusy(Exception):
+    """مجمع الهاش ممتلئ، يُرفض الطلب فوراً بدل حجز العامل"""
+
+
+def _init_worker():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'serialcotv.settings')
+    import django
+    django.setup()
+
+
+def _make(password):
+    return make_password(password)
+
+
+def _verify(password, encoded):
+    # إذا كان الهاش بخوارزمية/تكلفة قديمة، نحسب الهاش الجديد هنا أيضاً
+    upgraded = []
+    valid = check_password(password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return valid, (upgraded[0] if upgraded else None)
+
+
+class PasswordHashingPool:
+    """تنفيذ هاش كلمات المرور في مجمع عمليات محدود خارج عامل gunicorn"""
+
+    def __init__(self, workers=2, max_queue=8, timeout=5):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue) if workers else None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def _run(self, fn, *args):
+        # workers=0 يعني التنفيذ داخل نفس العملية (التطوير والاختبارات)
+        if not self.workers:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHashingBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # المكان يُحرر عند انتهاء المهمة فعلاً، لا عند انتهاء المهلة:
+        # cancel لا يوقف مهمة بدأت، فتحريره مبكراً يترك المجمع بلا حد
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self.rejected += 1
+            raise PasswordHashingBusy()
+
+    def hash_password(self, password):
+        return self._run(_make, password)
+
+    def verify_password(self, password, encoded):
+        """يرجع (صحيحة؟، الهاش الجديد أو None)"""
+        return self._run(_verify, password, encoded)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_pool = PasswordHashingPool(
+    workers=getattr(settings, 'PASSWORD_HASH_WORKERS', 2),
+    max_queue=getattr(settings, 'PASSWORD_HASH_MAX_QUEUE', 8),
+    timeout=getattr(settings, 'PASSWORD_HASH_TIMEOUT', 5),
+)
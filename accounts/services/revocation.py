@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationMap:
+    """خريطة مضغوطة في الذاكرة: customer_id -> (token_version, is_active)
+
+    تحتوي فقط على العملاء الذين تم إبطال توكناتهم أو تعطيل حساباتهم،
+    وتُحدّث تدريجياً بجلب الصفوف التي تغيّر updated_at لها منذ آخر مزامنة.
+    كل تحديث يعيد قراءة آخر overlap ثانية، فالصفوف التي تُثبَّت معاملتها بعد
+    تقدم العلامة (updated_at أقدم من وقت الـ commit) لا تضيع. التعطيل يجب أن
+    يمر عبر Customer.deactivate أو revoke_tokens، فـ QuerySet.update لا يغير updated_at.
+    """
+
+    def __init__(self, refresh_interval=5, overlap=60):
+        self.refresh_interval = refresh_interval
+        self.overlap = overlap
+        self._entries = {}
+        self._synced_until = None
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+        # تحديث واحد فقط في كل مرة، باقي الخيوط تستعمل الخريطة الحالية
+        if not self._lock.acquire(blocking=force):
+            return
+        try:
+            from datetime import timedelta
+
+            from django.db.models import Q
+            from django.utils import timezone
+            from accounts.models import Customer
+
+            # العلامة الجديدة وقت بدء القراءة، وليس أحدث updated_at رأيناه
+            synced_until = timezone.now()
+            rows = Customer.objects.all()
+            if self._synced_until is None:
+                rows = rows.filter(Q(token_version__gt=0) | Q(is_active=False))
+            else:
+                rows = rows.filter(updated_at__gte=self._synced_until - timedelta(seconds=self.overlap))
+
+            entries = dict(self._entries)
+            for pk, version, is_active in rows.values_list('id', 'token_version', 'is_active').iterator():
+                if version or not is_active:
+                    entries[pk] = (version, is_active)
+                else:
+                    entries.pop(pk, None)
+
+            self._entries = entries
+            self._synced_until = synced_until
+            self._next_refresh = now + self.refresh_interval
+        except Exception as e:
+            logger.error(f"❌ revocation map refresh failed: {e}")
+            self._next_refresh = now + self.refresh_interval
+        finally:
+            self._lock.release()
+
+    def is_revoked(self, payload):
+        self.refresh()
+        entry = self._entries.get(payload.get('customer_id'))
+        if entry is None:
+            return False
+        version, is_active = entry
+        return not is_active or payload.get('ver', 0) < version
+
+    def update(self, customer):
+        """تطبيق تغيير محلي فوراً دون انتظار التحديث الدوري"""
+        if not isinstance(customer.token_version, int):
+            # القيمة تعبير F() لم يُقرأ بعد، نطلب تحديثاً عند أول فحص
+            self._next_refresh = 0.0
+            return
+        entries = dict(self._entries)
+        if customer.token_version or not customer.is_active:
+            entries[customer.pk] = (customer.token_version, customer.is_active)
+        else:
+            entries.pop(customer.pk, None)
+        self._entries = entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+revocation_map = RevocationMap(
+    refresh_interval=getattr(settings, 'TOKEN_REVOCATION_REFRESH_INTERVAL', 5),
+    overlap=getattr(settings, 'TOKEN_REVOCATION_OVERLAP', 60),
+)
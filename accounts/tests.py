@@ -1,3 +1,446 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from serials.models import SerialKey, SerialPackage
+from .authentication import principal_cache
+from .models import (
+    BalanceSnapshot, BroadcastCounter, Customer, Notification, NotificationState, Source, Transaction,
+)
+from .services.last_login import LastLoginTracker, last_login_tracker
+from .services.notification_bus import NotificationBus, RecentIds, notification_bus, serialize_notification
+from .services.password_service import PasswordHashingBusy, PasswordHashingPool
+
+
+class SingleDecodeAuthenticationTests(TestCase):
+    """كل endpoint موثق يكلف فك توكن واحد وجلب عميل واحد على الأكثر"""
+
+    def setUp(self):
+        principal_cache.clear()
+        self.customer = Customer.objects.create(name='Test', phone='0550000000', token_balance=10)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {self.customer.generate_jwt_token()}'}
+        self.notification = Notification.objects.create(customer=self.customer, title='t', description='d')
+        package = SerialPackage.objects.create(name='P', tokens_limit=100, price=10)
+        self.serial = SerialKey.objects.create(package=package)
+
+    def tearDown(self):
+        last_login_tracker.flush()
+
+    def assertSingleAuth(self, method, url, data=None, max_customer_lookups=1):
+        principal_cache.clear()
+        with mock.patch('accounts.authentication.jwt.decode', wraps=jwt.decode) as decode, \
+                CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {}, secure=True, **self.auth)
+        customer_lookups = [
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('SELECT') and 'FROM "accounts_customer" WHERE "accounts_customer"."id" =' in q['sql']
+        ]
+        self.assertLess(response.status_code, 400, response.content)
+        self.assertLessEqual(decode.call_count, 1, url)
+        self.assertLessEqual(len(customer_lookups), max_customer_lookups, customer_lookups)
+
+    def test_profile(self):
+        self.assertSingleAuth('get', '/api/accounts/profile/')
+
+    def test_profile_from_cached_principal(self):
+        self.client.get('/api/accounts/profile/', secure=True, **self.auth)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/accounts/profile/', secure=True, **self.auth)
+        self.assertEqual(response.json()['customer']['token_balance'], 10)
+        # كاش التوثيق ثم استعلام واحد للحقول المؤجلة (الرصيد وآخر دخول)، عدا تحديث خريطة الإبطال الدوري
+        sql = [q['sql'] for q in queries.captured_queries if '"token_version" >' not in q['sql']]
+        self.assertEqual(len(sql), 1, sql)
+        self.assertIn('"accounts_customer"."last_login"', sql[0])
+
+    def test_account_status(self):
+        # claims فقط: لا استعلام عن العميل إطلاقاً
+        self.assertSingleAuth('get', '/api/accounts/account-status/', max_customer_lookups=0)
+
+    def test_validate_token(self):
+        self.assertSingleAuth('post', '/api/accounts/validate-token/', max_customer_lookups=0)
+
+    def test_deactivated_customer_rejected_in_claims_mode(self):
+        self.customer.deactivate()
+        response = self.client.get('/api/accounts/account-status/', secure=True, **self.auth)
+        self.assertEqual(response.status_code, 401)
+
+    def test_update_profile(self):
+        self.assertSingleAuth('post', '/api/accounts/update-profile/', {'name': 'New'})
+
+    def test_update_profile_keeps_newer_fields(self):
+        # الطلب الأول يملأ كاش التوثيق، ثم تتغير الحقول في عامل آخر
+        self.client.get('/api/accounts/profile/', secure=True, **self.auth)
+        later = timezone.now() + timedelta(hours=1)
+        Customer.objects.filter(pk=self.customer.pk).update(last_login=later, token_balance=99)
+        response = self.client.post('/api/accounts/update-profile/', {'name': 'New'}, secure=True, **self.auth)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.name, self.customer.last_login, self.customer.token_balance), ('New', later, 99))
+
+    def test_notifications(self):
+        self.assertSingleAuth('get', '/api/accounts/notifications/')
+
+    def test_mark_notification_read(self):
+        self.assertSingleAuth('post', f'/api/accounts/notifications/{self.notification.id}/read/')
+
+    def test_link_serial(self):
+        self.assertSingleAuth('post', '/api/accounts/link-serial/', {
+            'serial_number': self.serial.serial_number,
+            'pin': self.serial.raw_pin,
+        })
+
+
+class WalletConcurrencyTests(TransactionTestCase):
+    """الخصم والإضافة المتزامنة على نفس العميل يجب أن تعطي رصيداً دقيقاً"""
+
+    THREADS = 16
+    ATTEMPTS = 25
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Wallet', phone='0551111111', token_balance=200)
+
+    def hammer(self, operation):
+        results = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker():
+            try:
+                customer = Customer.objects.get(pk=self.customer.pk)
+                barrier.wait()
+                for _ in range(self.ATTEMPTS):
+                    outcome = operation(customer)
+                    with lock:
+                        results.append(outcome)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.customer.refresh_from_db()
+        return results
+
+    def test_concurrent_spend_never_overspends(self):
+        results = self.hammer(lambda customer: customer.spend_tokens(1, 'stress'))
+        self.assertEqual(len(results), self.THREADS * self.ATTEMPTS)
+        self.assertEqual(results.count(True), 200)
+        self.assertEqual(self.customer.token_balance, 0)
+        self.assertEqual(self.customer.ledger_balance(), self.customer.token_balance)
+
+    def test_concurrent_credit_and_spend_is_exact(self):
+        def operation(customer):
+            customer.add_tokens(2, description='stress')
+            return customer.spend_tokens(1, 'stress')
+
+        results = self.hammer(operation)
+        self.assertTrue(all(results))
+        self.assertEqual(self.customer.token_balance, 200 + self.THREADS * self.ATTEMPTS)
+        self.assertEqual(
+            self.customer.transactions.exclude(transaction_type=Transaction.OPENING).count(),
+            2 * self.THREADS * self.ATTEMPTS
+        )
+        self.assertEqual(self.customer.ledger_balance(), self.customer.token_balance)
+
+    def test_debit_many(self):
+        other = Customer.objects.create(name='Other', phone='0552222222', token_balance=5)
+        balances = Customer.debit_many({self.customer.pk: 50, other.pk: 10}, description='batch')
+        self.assertEqual(balances, {self.customer.pk: 150})
+        other.refresh_from_db()
+        self.assertEqual(other.token_balance, 5)
+        self.assertEqual(
+            list(self.customer.transactions.filter(transaction_type='spend').values_list('amount', flat=True)), [-50]
+        )
+        self.assertEqual(self.customer.ledger_balance(), 150)
+
+
+class SnapshotBalancesTests(TestCase):
+    """الـ snapshot + ما بعده يساوي الرصيد، حتى لعملاء تخطاهم --min-tail سابقاً"""
+
+    def snapshot(self, **options):
+        call_command('snapshot_balances', settle_seconds=0, stdout=StringIO(), **options)
+
+    def test_ledger_matches_balance_across_runs(self):
+        busy = Customer.objects.create(name='Busy', phone='0553333333', token_balance=100)
+        quiet = Customer.objects.create(name='Quiet', phone='0554444444', token_balance=50)
+        busy.spend_tokens(10)
+        self.snapshot(min_tail=2)
+        # quiet لديه معاملة واحدة فقط فلم يحصل على snapshot
+        self.assertFalse(BalanceSnapshot.objects.filter(customer=quiet).exists())
+        quiet.spend_tokens(5)
+        busy.add_tokens(3)
+        self.snapshot()
+        for customer in (busy, quiet):
+            customer.refresh_from_db()
+            snapshot = customer.balance_snapshots.order_by('-last_transaction_id').first()
+            self.assertEqual(snapshot.balance, customer.token_balance)
+            self.assertEqual(customer.ledger_balance(), customer.token_balance)
+
+
+class SendNotificationTests(TestCase):
+    """إرسال إشعار لمجموعة عملاء: فلاتر مُتحقق منها، صف واحد لكل عميل، ودفع لاتصالات SSE"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        source = Source.objects.create(name='S', prefix='S')
+        self.with_source = Customer.objects.create(name='A', phone='0551111111', source=source)
+        self.without_source = Customer.objects.create(name='B', phone='0552222222')
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+
+    def send(self, **filters):
+        return self.client.post('/api/accounts/notifications/send/', {
+            'title': 't', 'description': 'd', **filters,
+        }, content_type='application/json', secure=True)
+
+    def test_has_source_string_parsed_as_boolean(self):
+        bus = 'accounts.services.notification_bus.notification_bus'
+        with mock.patch(f'{bus}.subscribed_customers', return_value={self.without_source.id}), \
+                mock.patch(f'{bus}.publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.send(has_source='false')
+        self.assertEqual(response.json()['sent'], 1)
+        self.assertEqual(list(Notification.objects.values_list('customer_id', flat=True)), [self.without_source.id])
+        self.assertEqual([call.args[0]['customer_id'] for call in publish.call_args_list], [self.without_source.id])
+
+    def test_invalid_customer_ids_rejected(self):
+        self.assertEqual(self.send(customer_ids=['1; DROP']).status_code, 400)
+        self.assertEqual(self.send(customer_ids=[self.with_source.id, self.with_source.id]).json()['sent'], 1)
+
+
+class PasswordHashingPoolTests(SimpleTestCase):
+    """مهمة تجاوزت المهلة تبقى تحجز مكانها في المجمع حتى تنتهي فعلاً"""
+
+    def test_timed_out_task_keeps_its_slot(self):
+        pool = PasswordHashingPool(workers=1, max_queue=0, timeout=0.01)
+        running = Future()
+        running.set_running_or_notify_cancel()
+        submit = mock.Mock(return_value=running)
+        with mock.patch.object(pool, '_get_executor', return_value=mock.Mock(submit=submit)):
+            with self.assertRaises(PasswordHashingBusy):
+                pool.hash_password('secret')
+            # المهمة الأولى ما زالت تعمل في العملية الفرعية، فالثانية تُرفض دون إرسالها
+            with self.assertRaises(PasswordHashingBusy):
+                pool.hash_password('secret')
+            self.assertEqual(submit.call_count, 1)
+            running.set_result('hash')
+            submit.return_value = done = Future()
+            done.set_result('hash')
+            self.assertEqual(pool.hash_password('secret'), 'hash')
+
+
+class NotificationStreamTests(SimpleTestCase):
+    """الاشتراك في notification_bus يبدأ مع البث فقط، فالعميل المنقطع قبل ذلك لا يترك اشتراكاً"""
+
+    def test_subscribes_only_while_streaming(self):
+        from .views import _event_stream
+
+        async def scenario():
+            stream = _event_stream(customer_id=1, last_event_id=None)
+            self.assertEqual(notification_bus.connections, 0)
+            self.assertEqual(await stream.__anext__(), 'retry: 5000\n\n')
+            self.assertEqual(notification_bus.connections, 1)
+            await stream.aclose()
+            self.assertEqual(notification_bus.connections, 0)
+
+        with mock.patch.object(notification_bus, '_ensure_poller'):
+            asyncio.run(scenario())
+
+    def test_streams_out_of_order_commits_once(self):
+        from .views import _event_stream
+
+        def event(pk):
+            return {'id': pk, 'customer_id': 1, 'title': 't', 'description': 'd', 'type': 'info', 'created_at': ''}
+
+        async def scenario():
+            stream = _event_stream(customer_id=1, last_event_id=None)
+            await stream.__anext__()
+            # المعاملة صاحبة id 4 أُثبتت بعد صاحبة id 5، والنشر المكرر لا يصل مرتين
+            for pk in (5, 4, 5):
+                notification_bus.publish(event(pk))
+            received = [await stream.__anext__(), await stream.__anext__()]
+            await stream.aclose()
+            return received
+
+        with mock.patch.object(notification_bus, '_ensure_poller'), \
+                mock.patch.object(notification_bus, '_recent', RecentIds(100)):
+            received = asyncio.run(scenario())
+        self.assertEqual([chunk.split('\n')[0] for chunk in received], ['id: 5', 'id: 4'])
+
+
+class NotificationBusPollTests(TestCase):
+    """الاستطلاع يلتقط إشعاراً أُثبت متأخراً بـ id أصغر من آخر id منشور"""
+
+    def test_late_commit_with_lower_id_is_fetched(self):
+        bus = NotificationBus()
+        bus._fetch_new()
+        late, newer = (Notification.objects.create(title=title, description='d') for title in ('late', 'newer'))
+        bus.publish(serialize_notification(newer))
+        self.assertEqual([event['id'] for event in bus._fetch_new()], [late.id])
+        bus.publish(serialize_notification(late))
+        self.assertEqual(bus._fetch_new(), [])
+
+
+class NotificationCounterTests(TestCase):
+    """unread_for يطابق العدّ المباشر من الجداول بعد كل عملية"""
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='A', phone='0553333333')
+        self.other = Customer.objects.create(name='B', phone='0554444444')
+
+    def assertCounts(self):
+        for customer in (self.customer, self.other):
+            expected = (
+                Notification.objects.filter(customer=customer, is_read=False).count()
+                + Notification.objects.filter(customer__isnull=True).exclude(reads__customer=customer).count()
+            )
+            self.assertEqual(NotificationState.unread_for(customer.pk)[0], expected)
+
+    def notify(self, customer=None):
+        return Notification.objects.create(customer=customer, title='t', description='d')
+
+    def test_counts_follow_every_operation(self):
+        direct = [self.notify(self.customer) for _ in range(3)]
+        broadcasts = [self.notify() for _ in range(3)]
+        self.assertCounts()
+
+        direct[0].mark_read(self.customer)
+        broadcasts[0].mark_read(self.customer)
+        broadcasts[0].mark_read(self.customer)
+        self.assertCounts()
+
+        Notification.send_to(Customer.objects.all(), 't', 'd')
+        self.assertCounts()
+
+        broadcasts[0].delete()
+        direct[1].delete()
+        self.assertCounts()
+
+        Notification.mark_all_read(self.customer)
+        self.assertCounts()
+        self.notify()
+        self.assertCounts()
+
+    def test_delete_without_counter_row(self):
+        broadcasts = [self.notify() for _ in range(2)]
+        BroadcastCounter.objects.all().delete()
+        broadcasts[0].delete()
+        self.assertCounts()
+        self.notify()
+        self.assertCounts()
+
+
+class NotificationListTests(TestCase):
+    """ترقيم الإشعارات بالـ cursor وإجابة 304 للطلب الذي لم يتغير"""
+
+    def setUp(self):
+        principal_cache.clear()
+        self.customer = Customer.objects.create(name='A', phone='0555555555')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {self.customer.generate_jwt_token()}'}
+
+    def tearDown(self):
+        last_login_tracker.flush()
+
+    def get(self, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get('/api/accounts/notifications/', params, secure=True, **self.auth, **headers)
+
+    def test_pages_across_equal_created_at(self):
+        notifications = [
+            Notification.objects.create(customer=self.customer if i % 2 else None, title=f'n{i}', description='d')
+            for i in range(5)
+        ]
+        Notification.objects.update(created_at=timezone.now())
+
+        ids, cursor = [], None
+        for _ in range(3):
+            body = self.get(limit=2, **({'cursor': cursor} if cursor else {})).json()
+            ids += [n['id'] for n in body['notifications']]
+            cursor = body['next_cursor']
+        self.assertIsNone(cursor)
+        self.assertEqual(ids, sorted((n.id for n in notifications), reverse=True))
+
+    def test_unchanged_list_answers_304(self):
+        Notification.objects.create(customer=self.customer, title='t', description='d')
+        etag = self.get()['ETag']
+        response = self.get(etag=f'"other", {etag}')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get(limit=5, etag=etag).status_code, 200)
+
+    def test_etag_changes_after_new_notification_or_read(self):
+        direct = Notification.objects.create(customer=self.customer, title='t', description='d')
+        broadcast = Notification.objects.create(title='b', description='d')
+        etags = [self.get()['ETag']]
+
+        Notification.objects.create(customer=self.customer, title='t2', description='d')
+        etags.append(self.get(etag=etags[-1])['ETag'])
+        direct.mark_read(self.customer)
+        etags.append(self.get(etag=etags[-1])['ETag'])
+        broadcast.mark_read(self.customer)
+        response = self.get(etag=etags[-1])
+        etags.append(response['ETag'])
+
+        self.assertEqual(response.status_code, 200)
+        read = {n['id']: n['is_read'] for n in response.json()['notifications']}
+        self.assertEqual((read[direct.id], read[broadcast.id]), (True, True))
+        self.assertEqual(len(set(etags)), 4)
+
+
+class LastLoginTrackerTests(TestCase):
+    """أوقات الدخول تُجمع في الذاكرة وتُكتب بـ UPDATE واحد، وtimer يكتبها في العامل الخامل"""
+
+    def setUp(self):
+        self.customers = [Customer.objects.create(name=f'C{i}', phone=f'055000000{i}') for i in range(3)]
+
+    def test_touches_coalesce_into_one_case_update(self):
+        tracker = LastLoginTracker(flush_interval=3600, max_pending=10, min_age=300)
+        self.addCleanup(lambda: tracker._timer and tracker._timer.cancel())
+        self.assertTrue(tracker.touch(self.customers[0]))
+        self.assertFalse(tracker.touch(Customer.objects.get(pk=self.customers[0].pk)))
+        self.assertTrue(tracker.touch(self.customers[1]))
+        self.assertEqual(tracker.pending_count, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(tracker.flush(), 2)
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertIn('CASE WHEN', queries.captured_queries[0]['sql'])
+        saved = dict(Customer.objects.values_list('pk', 'last_login'))
+        self.assertEqual(
+            [saved[customer.pk] for customer in self.customers],
+            [self.customers[0].last_login, self.customers[1].last_login, None],
+        )
+        self.assertEqual(tracker.flush(), 0)
+
+    def test_max_pending_flushes_inline(self):
+        tracker = LastLoginTracker(flush_interval=3600, max_pending=2, min_age=300)
+        self.addCleanup(lambda: tracker._timer and tracker._timer.cancel())
+        tracker.touch(self.customers[0])
+        tracker.touch(self.customers[1])
+        self.assertEqual(tracker.pending_count, 0)
+        self.assertFalse(Customer.objects.filter(last_login__isnull=True).exclude(pk=self.customers[2].pk).exists())
+
+    def test_timer_flushes_idle_worker(self):
+        tracker = LastLoginTracker(flush_interval=0.05, max_pending=10, min_age=300)
+        tracker._last_flush = time.monotonic()
+        flushed = threading.Event()
+        with mock.patch.object(tracker, 'flush', side_effect=lambda: flushed.set()) as flush:
+            tracker.touch(self.customers[0])
+            tracker.touch(self.customers[1])
+            self.assertEqual(flush.call_count, 0)
+            self.assertTrue(flushed.wait(2))
+        self.assertEqual(flush.call_count, 1)
+        self.assertIsNone(tracker._timer)
@@ -9,6 +9,9 @@ urlpatterns = [
     path('update-profile/', views.UpdateProfileAPI.as_view(), name='api_update_profile'),
     path('validate-token/', views.ValidateTokenAPI.as_view(), name='api_validate_token'),
     path('notifications/', views.NotificationListAPI.as_view(), name='api_notifications'),
+    path('notifications/stream/', views.notification_stream, name='api_notifications_stream'),
+    path('notifications/read-all/', views.MarkAllNotificationsReadAPI.as_view(), name='api_mark_all_notifications_read'),
+    path('notifications/send/', views.SendNotificationAPI.as_view(), name='api_send_notification'),
     path('notifications/<int:notification_id>/read/', views.MarkNotificationReadAPI.as_view(), name='api_mark_notification_read'),
     path('link-serial/', views.LinkSerialAPI.as_view(), name='api_link_serial'),
 ]
\ No newline at end of file
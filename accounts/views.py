@@ -1,58 +1,48 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser
 from django.utils import timezone
-from django.contrib.auth.hashers import make_password, check_password
-from django.db.models import Q
-import jwt
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+import asyncio
+import hashlib
+import json
 import re
 from datetime import datetime, timedelta
 from django.conf import settings
-from .models import Customer, Transaction, Source, Notification
+from .authentication import CustomerClaimsAuthentication
+from .pagination import InvalidCursor, decode_cursor, keyset_page, parse_limit
+from .serializers import SendNotificationSerializer
+from .models import Customer, Transaction, Source, Notification, NotificationRead, NotificationState
 from serials.models import SerialKey
+from serials.services.pin_guard import pin_locked_response, record_pin_failure
+from .services.last_login import last_login_tracker
+from .services.password_service import PasswordHashingBusy, password_pool
+from .services.notification_bus import TooManyConnections, notification_bus, serialize_notification
 
 
-class CustomerJWTAuthentication:
-    """توثيق العميل باستخدام JWT Token"""
-    def authenticate(self, request):
-        auth_header = request.headers.get('Authorization', '')
-        
-        if not auth_header.startswith('Bearer '):
-            return None
-        
-        token = auth_header[7:]
-        
-        try:
-            payload = jwt.decode(
-                token, 
-                settings.JWT_SECRET_KEY, 
-                algorithms=[settings.JWT_ALGORITHM]
-            )
-            
-            customer_id = payload.get('customer_id')
-            token_type = payload.get('type')
-            
-            if token_type != 'customer':
-                return None
-            
-            customer = Customer.objects.get(id=customer_id, is_active=True)
-            return (customer, token)
-        except:
-            return None
+def busy_response():
+    response = Response({
+        'success': False,
+        'message': 'الخادم مشغول حالياً، حاول مرة أخرى بعد قليل'
+    }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = '1'
+    return response
 
 
 class JWTAuthMixin:
-    """مزيج لإضافة توثيق JWT للـ Views"""
-    authentication_classes = []
-    permission_classes = [IsAuthenticated]
-    
+    """مزيج لإضافة توثيق JWT للـ Views
+
+    التوثيق يتم مرة واحدة في CustomerJWTAuthentication (الافتراضي في DRF)
+    والنتيجة متاحة عبر request.customer، لذلك لا نعيد فك التوكن هنا.
+    """
+
     def get_customer(self, request):
-        auth = CustomerJWTAuthentication()
-        result = auth.authenticate(request)
-        if result:
-            return result[0]
-        return None
+        return getattr(request, 'customer', None)
 
 
 class RegisterAPI(APIView):
@@ -111,7 +101,10 @@ class RegisterAPI(APIView):
             customer_data['email'] = email
         
         if password:
-            customer_data['password_hash'] = make_password(password)
+            try:
+                customer_data['password_hash'] = password_pool.hash_password(password)
+            except PasswordHashingBusy:
+                return busy_response()
         
         try:
             customer = Customer.objects.create(**customer_data)
@@ -159,9 +152,15 @@ class CustomerLoginAPI(APIView):
                         'message': 'هذا الحساب لا يملك كلمة مرور'
                     }, status=status.HTTP_401_UNAUTHORIZED)
                 
-                if check_password(password, customer.password_hash):
-                    customer.last_login = timezone.now()
-                    customer.save()
+                try:
+                    valid, upgraded_hash = password_pool.verify_password(password, customer.password_hash)
+                except PasswordHashingBusy:
+                    return busy_response()
+                
+                if valid:
+                    if upgraded_hash:
+                        Customer.objects.filter(pk=customer.pk).update(password_hash=upgraded_hash)
+                    last_login_tracker.touch(customer)
                     
                     jwt_token = customer.generate_jwt_token()
                     
@@ -193,8 +192,7 @@ class CustomerLoginAPI(APIView):
         if phone:
             try:
                 customer = Customer.objects.get(phone=phone, is_active=True)
-                customer.last_login = timezone.now()
-                customer.save()
+                last_login_tracker.touch(customer)
                 
                 jwt_token = customer.generate_jwt_token()
                 
@@ -233,6 +231,11 @@ class UserProfileAPI(APIView, JWTAuthMixin):
                 'message': 'المصادقة مطلوبة'
             }, status=status.HTTP_401_UNAUTHORIZED)
         
+        # العميل من كاش التوثيق بدون الحقول المتغيرة: استعلام واحد لها بدل استعلام لكل حقل مؤجل
+        deferred = customer.get_deferred_fields() & {'token_balance', 'last_login'}
+        if deferred:
+            customer.refresh_from_db(fields=sorted(deferred))
+        
         profile_data = {
             'id': customer.id,
             'name': customer.name,
@@ -254,6 +257,8 @@ class UserProfileAPI(APIView, JWTAuthMixin):
 
 class AccountStatusAPI(APIView, JWTAuthMixin):
     """التحقق من حالة الحساب"""
+    authentication_classes = [CustomerClaimsAuthentication]
+    
     def get(self, request):
         customer = self.get_customer(request)
         
@@ -263,59 +268,43 @@ class AccountStatusAPI(APIView, JWTAuthMixin):
                 'message': 'المصادقة مطلوبة'
             }, status=status.HTTP_401_UNAUTHORIZED)
         
+        # من claims التوكن فقط: الحساب المعطل يُرفض في التوثيق (deactivate ترفع token_version)،
+        # والرصيد يُقرأ من profile/ حتى لا يكلف هذا الـ endpoint استعلاماً
         return Response({
             'success': True,
             'status': 'active' if customer.is_active else 'inactive',
             'name': customer.name,
-            'token_balance': customer.token_balance,
         })
 
 
-class ValidateTokenAPI(APIView):
+class ValidateTokenAPI(APIView, JWTAuthMixin):
     """التحقق من صحة التوكن"""
+    authentication_classes = [CustomerClaimsAuthentication]
+    
     def post(self, request):
-        auth_header = request.headers.get('Authorization', '')
+        customer = self.get_customer(request)
         
-        if not auth_header.startswith('Bearer '):
+        if not customer:
+            if getattr(request, 'jwt_error', None) == 'expired':
+                return Response({
+                    'success': False,
+                    'valid': False,
+                    'message': 'انتهت صلاحية التوكن'
+                }, status=status.HTTP_401_UNAUTHORIZED)
             return Response({
                 'success': False,
                 'valid': False,
                 'message': 'توكن غير صالح'
             }, status=status.HTTP_401_UNAUTHORIZED)
         
-        token = auth_header[7:]
-        
-        try:
-            payload = jwt.decode(
-                token, 
-                settings.JWT_SECRET_KEY, 
-                algorithms=[settings.JWT_ALGORITHM]
-            )
-            
-            customer_id = payload.get('customer_id')
-            
-            customer = Customer.objects.get(id=customer_id, is_active=True)
-            
-            return Response({
-                'success': True,
-                'valid': True,
-                'customer': {
-                    'id': customer.id,
-                    'name': customer.name,
-                }
-            })
-        except jwt.ExpiredSignatureError:
-            return Response({
-                'success': False,
-                'valid': False,
-                'message': 'انتهت صلاحية التوكن'
-            }, status=status.HTTP_401_UNAUTHORIZED)
-        except:
-            return Response({
-                'success': False,
-                'valid': False,
-                'message': 'توكن غير صالح'
-            }, status=status.HTTP_401_UNAUTHORIZED)
+        return Response({
+            'success': True,
+            'valid': True,
+            'customer': {
+                'id': customer.id,
+                'name': customer.name,
+            }
+        })
 
 
 class UpdateProfileAPI(APIView, JWTAuthMixin):
@@ -334,11 +323,11 @@ class UpdateProfileAPI(APIView, JWTAuthMixin):
         phone = request.data.get('phone', '').strip()
         password = request.data.get('password', '')
         
-        updated = False
+        updated = []
         
         if name:
             customer.name = name
-            updated = True
+            updated.append('name')
         
         if email and email != customer.email:
             if Customer.objects.filter(email=email).exclude(id=customer.id).exists():
@@ -347,7 +336,7 @@ class UpdateProfileAPI(APIView, JWTAuthMixin):
                     'message': 'البريد الإلكتروني مستخدم من قبل'
                 }, status=status.HTTP_400_BAD_REQUEST)
             customer.email = email
-            updated = True
+            updated.append('email')
         
         if phone and phone != customer.phone:
             if Customer.objects.filter(phone=phone).exclude(id=customer.id).exists():
@@ -356,7 +345,7 @@ class UpdateProfileAPI(APIView, JWTAuthMixin):
                     'message': 'رقم الهاتف مستخدم من قبل'
                 }, status=status.HTTP_400_BAD_REQUEST)
             customer.phone = phone
-            updated = True
+            updated.append('phone')
         
         if password:
             if len(password) < 6:
@@ -364,8 +353,11 @@ class UpdateProfileAPI(APIView, JWTAuthMixin):
                     'success': False,
                     'message': 'كلمة المرور يجب أن تكون 6 أحرف على الأقل'
                 }, status=status.HTTP_400_BAD_REQUEST)
-            customer.password_hash = make_password(password)
-            updated = True
+            try:
+                customer.password_hash = password_pool.hash_password(password)
+            except PasswordHashingBusy:
+                return busy_response()
+            updated.append('password_hash')
         
         if not updated:
             return Response({
@@ -373,7 +365,9 @@ class UpdateProfileAPI(APIView, JWTAuthMixin):
                 'message': 'لم يتم توفير أي بيانات للتحديث'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        customer.save()
+        # الحفظ الجزئي فقط: العميل قد يكون من كاش التوثيق، والحفظ الكامل يكتب فوق
+        # قيم أحدث لـ last_login وtoken_balance وtoken_version
+        customer.save(update_fields=[*updated, 'updated_at'])
         
         return Response({
             'success': True,
@@ -388,7 +382,7 @@ class UpdateProfileAPI(APIView, JWTAuthMixin):
 
 
 class NotificationListAPI(APIView, JWTAuthMixin):
-    """قائمة الإشعارات"""
+    """قائمة الإشعارات (ترقيم بالـ cursor على (created_at, id) مع ETag)"""
     def get(self, request):
         customer = self.get_customer(request)
         if not customer:
@@ -397,11 +391,37 @@ class NotificationListAPI(APIView, JWTAuthMixin):
                 'message': 'المصادقة مطلوبة'
             }, status=status.HTTP_401_UNAUTHORIZED)
         
-        notifications = Notification.objects.filter(
-            Q(customer=customer) | Q(customer__isnull=True)
-        ).order_by('-created_at')[:20]
+        cursor = request.query_params.get('cursor') or None
+        limit = parse_limit(request.query_params.get('limit'))
         
-        return Response({
+        visible = Notification.objects.filter(Q(customer=customer) | Q(customer__isnull=True))
+        
+        # ETag من أحدث إشعار + إصدار حالة القراءة، بدون تحميل الصفحة نفسها
+        newest_id = visible.order_by('-created_at', '-id').values_list('id', flat=True).first()
+        unread_count, version = NotificationState.unread_for(customer.pk)
+        etag_source = f"{customer.pk}:{newest_id}:{version}:{unread_count}:{cursor}:{limit}"
+        etag = '"%s"' % hashlib.sha1(etag_source.encode()).hexdigest()
+        
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+        
+        try:
+            notifications, next_cursor = keyset_page(
+                visible.annotate(
+                    read_receipt=Exists(NotificationRead.objects.filter(notification=OuterRef('pk'), customer=customer))
+                ),
+                cursor=cursor,
+                limit=limit,
+            )
+        except InvalidCursor:
+            return Response({
+                'success': False,
+                'message': 'cursor غير صالح'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = Response({
             'success': True,
             'notifications': [
                 {
@@ -409,13 +429,16 @@ class NotificationListAPI(APIView, JWTAuthMixin):
                     'title': n.title,
                     'description': n.description,
                     'type': n.notification_type,
-                    'is_read': n.is_read,
+                    'is_read': n.read_receipt if n.is_broadcast else n.is_read,
                     'created_at': n.created_at.strftime('%Y-%m-%d %H:%M'),
                 }
                 for n in notifications
             ],
-            'unread_count': notifications.filter(is_read=False).count(),
+            'unread_count': unread_count,
+            'next_cursor': next_cursor,
         })
+        response['ETag'] = etag
+        return response
 
 
 class MarkNotificationReadAPI(APIView, JWTAuthMixin):
@@ -430,11 +453,10 @@ class MarkNotificationReadAPI(APIView, JWTAuthMixin):
         
         try:
             notification = Notification.objects.get(
+                Q(customer=customer) | Q(customer__isnull=True),
                 id=notification_id,
-                customer=customer
             )
-            notification.is_read = True
-            notification.save()
+            notification.mark_read(customer)
             
             return Response({
                 'success': True,
@@ -447,6 +469,76 @@ class MarkNotificationReadAPI(APIView, JWTAuthMixin):
             }, status=status.HTTP_404_NOT_FOUND)
 
 
+class MarkAllNotificationsReadAPI(APIView, JWTAuthMixin):
+    """تعليم كل الإشعارات كمقروءة، أو حتى cursor / up_to_id معيّن"""
+    def post(self, request):
+        customer = self.get_customer(request)
+        if not customer:
+            return Response({
+                'success': False, 
+                'message': 'المصادقة مطلوبة'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        
+        up_to = None
+        cursor = request.data.get('cursor')
+        up_to_id = request.data.get('up_to_id')
+        try:
+            if cursor:
+                up_to = decode_cursor(cursor)
+            elif up_to_id:
+                notification = Notification.objects.only('id', 'created_at').get(
+                    Q(customer=customer) | Q(customer__isnull=True),
+                    id=int(up_to_id),
+                )
+                up_to = (notification.created_at, notification.id)
+        except (InvalidCursor, ValueError, Notification.DoesNotExist):
+            return Response({
+                'success': False,
+                'message': 'cursor غير صالح'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        marked = Notification.mark_all_read(customer, up_to=up_to)
+        unread_count, _ = NotificationState.unread_for(customer.pk)
+        
+        return Response({
+            'success': True,
+            'marked': marked,
+            'unread_count': unread_count,
+        })
+
+
+class SendNotificationAPI(APIView):
+    """إرسال إشعار لمجموعة عملاء مفلترة (للمشرفين فقط)"""
+    permission_classes = [IsAdminUser]
+    
+    def post(self, request):
+        serializer = SendNotificationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'message': 'بيانات غير صحيحة',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        
+        customers = Customer.objects.filter(is_active=True)
+        if 'source_id' in data:
+            customers = customers.filter(source_id=data['source_id'])
+        if data.get('source_prefix'):
+            customers = customers.filter(source__prefix=data['source_prefix'])
+        if data['has_source'] is not None:
+            customers = customers.filter(source__isnull=not data['has_source'])
+        if 'customer_ids' in data:
+            customers = customers.filter(id__in=data['customer_ids'])
+        
+        sent = Notification.send_to(customers, data['title'], data['description'], data['type'])
+        
+        return Response({
+            'success': True,
+            'sent': sent,
+        })
+
+
 class LinkSerialAPI(APIView, JWTAuthMixin):
     """ربط السيريال بحساب العميل"""
     def post(self, request):
@@ -466,19 +558,30 @@ class LinkSerialAPI(APIView, JWTAuthMixin):
                 'message': 'يرجى إدخال السيريال والبين'
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        locked = pin_locked_response(request, serial_number)
+        if locked:
+            return locked
+        
         try:
-            serial_key = SerialKey.objects.get(
-                serial_number=serial_number,
-                pin=pin,
-                customer__isnull=True
-            )
-            
-            serial_key.customer = customer
-            serial_key.used_at = timezone.now()
-            serial_key.save()
+            with transaction.atomic():
+                serial_key = SerialKey.objects.select_for_update().get_by_pin(
+                    serial_number,
+                    pin,
+                    customer__isnull=True,
+                    in_pool=False
+                )
+                
+                serial_key.customer = customer
+                serial_key.used_at = timezone.now()
+                serial_key.save()
+                
+                balance = Customer.adjust_balance(customer.pk, serial_key.tokens_remaining)
+                Transaction.record(
+                    customer.pk, serial_key.tokens_remaining, Transaction.SERIAL_ACTIVATION,
+                    f"ربط السيريال {serial_key.serial_number}"
+                )
             
-            customer.token_balance += serial_key.tokens_remaining
-            customer.save()
+            customer.token_balance = balance
             
             return Response({
                 'success': True,
@@ -487,7 +590,96 @@ class LinkSerialAPI(APIView, JWTAuthMixin):
                 'total_balance': customer.token_balance,
             })
         except SerialKey.DoesNotExist:
+            record_pin_failure(request, serial_number, pin)
             return Response({
                 'success': False,
                 'message': 'السيريال غير صحيح أو مفعل مسبقاً'
-            }, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+            }, status=status.HTTP_404_NOT_FOUND)
+
+
+def _format_event(event):
+    data = json.dumps(event, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: notification\ndata: {data}\n\n"
+
+
+def _missed_notifications(customer_id, last_event_id):
+    return [
+        serialize_notification(n)
+        for n in Notification.objects.filter(
+            Q(customer_id=customer_id) | Q(customer__isnull=True),
+            id__gt=last_event_id,
+        ).order_by('id')[:100]
+    ]
+
+
+async def _event_stream(customer_id, last_event_id):
+    # الاشتراك داخل الـ generator: إذا انقطع العميل قبل أول قراءة لا يبدأ الـ generator
+    # أصلاً، فلا يبقى اشتراك معلق (finally لا يُنفذ لـ generator لم يبدأ)
+    try:
+        subscription = notification_bus.subscribe(customer_id)
+    except TooManyConnections:
+        # امتلأ العامل بين الفحص في الـ view وبدء البث، العميل يعيد المحاولة
+        yield 'retry: 5000\n\n'
+        return
+    loop = asyncio.get_running_loop()
+    # مدة قصوى للاتصال: العميل يعيد الاتصال تلقائياً ويكمل بـ Last-Event-ID
+    deadline = loop.time() + settings.SSE_MAX_STREAM_SECONDS
+    try:
+        missed = []
+        if last_event_id is not None:
+            missed = await sync_to_async(_missed_notifications)(customer_id, last_event_id)
+        yield 'retry: 5000\n\n'
+        for event in missed:
+            subscription.seen.add(event['id'])
+            yield _format_event(event)
+        
+        while not subscription.overflowed and loop.time() < deadline:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=settings.SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            # الإشعار قد يصل مرتين (ضمن missed ثم مباشرة)، وقد يصل بـ id أصغر من سابقه
+            if not subscription.seen.add(event['id']):
+                continue
+            yield _format_event(event)
+    finally:
+        notification_bus.unsubscribe(subscription)
+
+
+async def notification_stream(request):
+    """بث الإشعارات الجديدة عبر Server-Sent Events (يتطلب خادم ASGI)"""
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            'success': False,
+            'message': 'البث المباشر متاح فقط عبر ASGI'
+        }, status=400)
+    
+    # EventSource في المتصفح لا يرسل headers، لذلك نقبل التوكن في الرابط أيضاً
+    token = request.GET.get('token')
+    if token and 'HTTP_AUTHORIZATION' not in request.META:
+        request.META['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    
+    result = await sync_to_async(CustomerClaimsAuthentication().authenticate)(request)
+    if not result:
+        return JsonResponse({
+            'success': False,
+            'message': 'المصادقة مطلوبة'
+        }, status=401)
+    customer_id = request.customer.pk
+    
+    if notification_bus.connections >= notification_bus.max_connections:
+        response = JsonResponse({
+            'success': False,
+            'message': 'الخادم مشغول حالياً، حاول مرة أخرى بعد قليل'
+        }, status=503)
+        response['Retry-After'] = '5'
+        return response
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    
+    response = StreamingHttpResponse(_event_stream(customer_id, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -92,7 +92,7 @@ class DownloadToken(models.Model):
             token=token,
             file_url=file_url,
             file_name=file_name,
-            customer=customer,
+            customer_id=getattr(customer, 'pk', customer),  # يقبل العميل أو رقمه
             expires_at=timezone.now() + timedelta(minutes=15)
         )
     
@@ -2,10 +2,39 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F, Q
 from django.http import HttpResponse, HttpResponseRedirect
 from .models import TVBrand, Firmware, Schematic, DownloadToken
-from serials.models import SerialKey
+from serials.models import SerialKey, SerialUsage
+from serials.services.pin_guard import pin_locked_response, record_pin_failure
+
+
+def debit_serial(request, amount, file_name, file_type, serial_number=None, pin=None):
+    """خصم تكلفة التحميل من السيريال مع سطر SerialUsage، ترجع (TokenDebit، None) أو (None، Response خطأ)
+
+    السيريال والـ PIN من query params ما لم يُمررا صراحة.
+    """
+    serial_number = serial_number or request.query_params.get('serial_number')
+    pin = pin or request.query_params.get('pin')
+    if not serial_number or not pin:
+        return None, Response({'success': False, 'message': 'يرجى إدخال السيريال والبين'}, status=400)
+    locked = pin_locked_response(request, serial_number)
+    if locked:
+        return None, locked
+    with transaction.atomic():
+        debit = SerialKey.debit(amount, serial_number=serial_number, pin=pin)
+        if debit is not None:
+            # كل خصم يُسجل في SerialUsage حتى تطابق reconcile_balances بين tokens_used والاستخدامات
+            SerialUsage.objects.create(
+                serial_key_id=debit.id, customer_id=debit.customer_id,
+                file_name=file_name, file_type=file_type, tokens_used=amount,
+                tokens_before=debit.tokens_remaining + amount, tokens_after=debit.tokens_remaining,
+            )
+            return debit, None
+    if record_pin_failure(request, serial_number, pin):
+        return None, Response({'success': False, 'message': 'السيريال غير صحيح'}, status=404)
+    return None, Response({'success': False, 'message': 'رصيد التوكن غير كافي'}, status=400)
 
 
 class BrandListAPI(APIView):
@@ -35,39 +64,22 @@ class FirmwareDetailAPI(APIView):
     def get(self, request, pk):
         firmware = get_object_or_404(Firmware, pk=pk, is_active=True)
         
-        serial_number = request.query_params.get('serial_number')
-        pin = request.query_params.get('pin')
-        
-        if not serial_number or not pin:
-            return Response({'success': False, 'message': 'يرجى إدخال السيريال والبين'}, status=400)
-        
-        try:
-            serial_key = SerialKey.objects.get(serial_number=serial_number, pin=pin, is_active=True)
-        except SerialKey.DoesNotExist:
-            return Response({'success': False, 'message': 'السيريال غير صحيح'}, status=404)
-        
-        if serial_key.tokens_remaining < firmware.token_cost:
-            return Response({'success': False, 'message': 'رصيد التوكن غير كافي'}, status=400)
-        
-        serial_key.use_tokens(firmware.token_cost)
-        firmware.downloads_count += 1
-        firmware.save()
-        
-        if firmware.file:
-            real_url = request.build_absolute_uri(firmware.file.url)
-        elif firmware.file_url:
-            real_url = firmware.file_url
-        elif firmware.cloud_url:
-            real_url = firmware.cloud_url
-        else:
+        # الملف يُحدد قبل الخصم حتى لا يُخصم رصيد على عنصر بدون ملف
+        real_url = firmware.file_url or firmware.cloud_url
+        if not real_url:
             return Response({'success': False, 'message': 'لا يوجد ملف'}, status=404)
         
         file_name = f"{firmware.brand.name}_{firmware.model_number}_v{firmware.version}.bin"
-        download_token = DownloadToken.generate(real_url, file_name, serial_key.customer)
+        debit, error = debit_serial(request, firmware.token_cost, file_name, 'firmware')
+        if error:
+            return error
+        Firmware.objects.filter(pk=firmware.pk).update(downloads_count=F('downloads_count') + 1)
+        
+        download_token = DownloadToken.generate(real_url, file_name, debit.customer_id)
         
         return Response({
             'success': True,
-            'tokens_remaining': serial_key.tokens_remaining,
+            'tokens_remaining': debit.tokens_remaining,
             'download_url': f"/api/download/{download_token.token}/",
             'firmware': {
                 'id': firmware.id,
@@ -102,39 +114,22 @@ class SchematicDetailAPI(APIView):
     def get(self, request, pk):
         schematic = get_object_or_404(Schematic, pk=pk, is_active=True)
         
-        serial_number = request.query_params.get('serial_number')
-        pin = request.query_params.get('pin')
-        
-        if not serial_number or not pin:
-            return Response({'success': False, 'message': 'يرجى إدخال السيريال والبين'}, status=400)
-        
-        try:
-            serial_key = SerialKey.objects.get(serial_number=serial_number, pin=pin, is_active=True)
-        except SerialKey.DoesNotExist:
-            return Response({'success': False, 'message': 'السيريال غير صحيح'}, status=404)
-        
-        if serial_key.tokens_remaining < schematic.token_cost:
-            return Response({'success': False, 'message': 'رصيد التوكن غير كافي'}, status=400)
-        
-        serial_key.use_tokens(schematic.token_cost)
-        schematic.downloads_count += 1
-        schematic.save()
-        
-        if schematic.file:
-            real_url = request.build_absolute_uri(schematic.file.url)
-        elif schematic.file_url:
-            real_url = schematic.file_url
-        elif schematic.cloud_url:
-            real_url = schematic.cloud_url
-        else:
+        # الملف يُحدد قبل الخصم حتى لا يُخصم رصيد على عنصر بدون ملف
+        real_url = schematic.file_url or schematic.cloud_url
+        if not real_url:
             return Response({'success': False, 'message': 'لا يوجد ملف'}, status=404)
         
         file_name = f"{schematic.brand.name}_{schematic.model_number}_{schematic.title}.pdf"
-        download_token = DownloadToken.generate(real_url, file_name, serial_key.customer)
+        debit, error = debit_serial(request, schematic.token_cost, file_name, 'schematic')
+        if error:
+            return error
+        Schematic.objects.filter(pk=schematic.pk).update(downloads_count=F('downloads_count') + 1)
+        
+        download_token = DownloadToken.generate(real_url, file_name, debit.customer_id)
         
         return Response({
             'success': True,
-            'tokens_remaining': serial_key.tokens_remaining,
+            'tokens_remaining': debit.tokens_remaining,
             'download_url': f"/api/download/{download_token.token}/",
             'schematic': {
                 'id': schematic.id,
@@ -0,0 +1,29 @@
+# إعدادات gunicorn (تُقرأ تلقائياً من مجلد التشغيل)
+
+# عمال uvicorn يشغّلون serialcotv.asgi: بث الإشعارات (SSE) يحتاج ASGI، وباقي الـ views
+# المتزامنة تعمل في خيط واحد لكل عامل كما في العمال sync
+worker_class = 'uvicorn_worker.UvicornWorker'
+
+
+def post_worker_init(worker):
+    """بناء Bloom filter أرقام السيريال في الخلفية لكل عامل"""
+    try:
+        from serials.services.bloom import serial_filter
+        serial_filter.start()
+    except Exception as e:
+        worker.log.error(f"post_worker_init serial filter start failed: {e}")
+
+
+def worker_exit(server, worker):
+    """تفريغ المخازن المؤقتة في الذاكرة وإغلاق المجمعات قبل إغلاق العامل"""
+    try:
+        from accounts.services.last_login import last_login_tracker
+        last_login_tracker.flush()
+    except Exception as e:
+        server.log.error(f"worker_exit flush failed: {e}")
+
+    try:
+        from accounts.services.password_service import password_pool
+        password_pool.shutdown()
+    except Exception as e:
+        server.log.error(f"worker_exit password pool shutdown failed: {e}")
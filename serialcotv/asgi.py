@@ -3,6 +3,11 @@ ASGI config for serialcotv project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is the production entry point (Procfile: gunicorn with uvicorn workers,
+see gunicorn.conf.py). The notification stream
+(/api/accounts/notifications/stream/) is an async Server-Sent Events view and
+needs it; under WSGI it refuses the connection instead of pinning a worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
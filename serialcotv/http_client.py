@@ -0,0 +1,206 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+# طرق آمنة للإعادة: الطلب نفسه لا يغير شيئاً إذا وصل مرتين
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+def not_sent(error):
+    """فشل فتح الاتصال، فالطلب لم يصل للخدمة وإعادة POST آمنة"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class CircuitOpen(requests.RequestException):
+    """القاطع مفتوح: الطلب رُفض محلياً دون الاتصال بالخدمة"""
+
+
+class CircuitBreaker:
+    """يفتح بعد failure_threshold فشل متتالٍ، ويسمح بطلب تجريبي واحد بعد reset_timeout ثانية"""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class Upstream:
+    """خدمة خارجية واحدة: جلسة keep-alive خاصة بها، مهلة إلزامية، إعادة بتفاوت عشوائي وقاطع دائرة
+
+    الإعادة تلقائية للطرق الآمنة (GET...) عند انقطاع الاتصال أو 429/5xx مؤقت، ولـ POST فقط
+    عندما يفشل فتح الاتصال (الطلب لم يُرسل). كل الإحصائيات داخل العملية الحالية فقط.
+    """
+
+    def __init__(self, name, connect_timeout=3, read_timeout=10, retries=2, backoff=0.3,
+                 failure_threshold=5, reset_timeout=30, pool_size=10):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._session = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.counts = {'requests': 0, 'errors': 0, 'retries': 0, 'short_circuited': 0}
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, timeout=None, retries=None, **kwargs):
+        """timeout رقم (مهلة القراءة) أو (اتصال، قراءة)؛ لا يمكن إلغاؤها"""
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (self.connect_timeout, timeout)
+        retries = self.retries if retries is None else retries
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        for attempt in range(retries + 1):
+            if not self.breaker.allow():
+                self._count('short_circuited')
+                raise CircuitOpen(f"{self.name} circuit is open")
+            last = attempt == retries
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                self._record(started, failed=True)
+                if last or not (idempotent or not_sent(e)):
+                    logger.warning(f"⚠️ {self.name} {method} failed: {e}")
+                    raise
+                self._sleep(attempt)
+                continue
+
+            failed = response.status_code >= 500
+            self._record(started, failed=failed)
+            if response.status_code in RETRY_STATUSES and idempotent and not last:
+                response.close()
+                self._sleep(attempt)
+                continue
+            return response
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counts = dict(self.counts)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+        return {
+            **counts,
+            'state': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99)},
+        }
+
+    def _record(self, started, failed):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._latencies.append(elapsed)
+            self.counts['requests'] += 1
+            self.counts['errors'] += failed
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _sleep(self, attempt):
+        self._count('retries')
+        # full jitter: العملاء المتزامنون لا يعيدون في نفس اللحظة
+        time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+
+class HttpClient:
+    """سجل الخدمات الخارجية، Upstream واحد لكل اسم في كل عملية"""
+
+    def __init__(self, defaults=None, upstreams=None):
+        self.defaults = defaults or {}
+        self.config = upstreams or {}
+        self._upstreams = {}
+        self._lock = threading.Lock()
+
+    def upstream(self, name):
+        upstream = self._upstreams.get(name)
+        if upstream is None:
+            with self._lock:
+                upstream = self._upstreams.get(name)
+                if upstream is None:
+                    upstream = Upstream(name, **{**self.defaults, **self.config.get(name, {})})
+                    self._upstreams[name] = upstream
+        return upstream
+
+    def stats(self):
+        return {name: upstream.stats() for name, upstream in sorted(self._upstreams.items())}
+
+
+http_client = HttpClient(
+    defaults={
+        'connect_timeout': getattr(settings, 'HTTP_CONNECT_TIMEOUT', 3),
+        'read_timeout': getattr(settings, 'HTTP_READ_TIMEOUT', 10),
+        'retries': getattr(settings, 'HTTP_RETRIES', 2),
+        'failure_threshold': getattr(settings, 'HTTP_BREAKER_THRESHOLD', 5),
+        'reset_timeout': getattr(settings, 'HTTP_BREAKER_RESET', 30),
+    },
+    upstreams=getattr(settings, 'HTTP_UPSTREAMS', {}),
+)
@@ -77,6 +77,10 @@ DATABASES = {
     )
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # قاعدة اختبار في ملف: اختبارات التزامن بعدة threads تفشل على قاعدة الذاكرة المشتركة ("table is locked")
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator', 'OPTIONS': {'min_length': 8}},
@@ -84,6 +88,32 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator'},
 ]
 
+# بث الإشعارات SSE (عبر serialcotv.asgi فقط)
+SSE_MAX_CONNECTIONS = config('SSE_MAX_CONNECTIONS', default=5000, cast=int)
+SSE_HEARTBEAT_INTERVAL = config('SSE_HEARTBEAT_INTERVAL', default=15, cast=int)
+SSE_POLL_INTERVAL = config('SSE_POLL_INTERVAL', default=5, cast=int)
+SSE_MAX_STREAM_SECONDS = config('SSE_MAX_STREAM_SECONDS', default=300, cast=int)
+SSE_QUEUE_SIZE = config('SSE_QUEUE_SIZE', default=100, cast=int)
+# الاستطلاع يعيد فحص إشعارات آخر N ثانية، لالتقاط المعاملات التي أُثبتت بعد id أكبر منها
+SSE_SETTLE_SECONDS = config('SSE_SETTLE_SECONDS', default=60, cast=int)
+
+# Argon2 هو المفضل، والهاشات القديمة (PBKDF2) تُرقّى تلقائياً عند الدخول
+PASSWORD_HASHERS = [
+    'accounts.hashers.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+ARGON2_TIME_COST = config('ARGON2_TIME_COST', default=2, cast=int)
+ARGON2_MEMORY_COST = config('ARGON2_MEMORY_COST', default=102400, cast=int)
+ARGON2_PARALLELISM = config('ARGON2_PARALLELISM', default=8, cast=int)
+
+# مجمع عمليات الهاش (0 = داخل نفس العامل)
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=2, cast=int)
+PASSWORD_HASH_MAX_QUEUE = config('PASSWORD_HASH_MAX_QUEUE', default=8, cast=int)
+PASSWORD_HASH_TIMEOUT = config('PASSWORD_HASH_TIMEOUT', default=5, cast=int)
+
 LANGUAGE_CODE = 'ar'
 TIME_ZONE = 'Asia/Riyadh'
 USE_I18N = True
@@ -129,13 +159,68 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/hour',
         'user': '1000/hour'
-    }
+    },
+    # عدد الـ proxies أمام التطبيق: IP العميل (للـ throttling وأقفال الـ PIN) هو العنصر رقم NUM_PROXIES
+    # من نهاية X-Forwarded-For، وما قبله يكتبه العميل نفسه. 0 = REMOTE_ADDR فقط
+    'NUM_PROXIES': config('NUM_PROXIES', default=1, cast=int),
 }
 
 JWT_SECRET_KEY = config('JWT_SECRET_KEY', default=SECRET_KEY)
 JWT_ALGORITHM = 'HS256'
+# وضع التوثيق الخفيف (claims فقط) للـ Views القرائية، والإبطال عبر token_version
+JWT_CLAIMS_AUTH_ENABLED = config('JWT_CLAIMS_AUTH_ENABLED', default=True, cast=bool)
+TOKEN_REVOCATION_REFRESH_INTERVAL = config('TOKEN_REVOCATION_REFRESH_INTERVAL', default=5, cast=int)
+# كل تحديث لخريطة الإبطال يعيد قراءة آخر OVERLAP ثانية (معاملات تُثبَّت متأخرة)
+TOKEN_REVOCATION_OVERLAP = config('TOKEN_REVOCATION_OVERLAP', default=60, cast=int)
 WALLET_CHARGE_SECRET = config('WALLET_CHARGE_SECRET', default='wallet-secret-key-123')
 
+# تجميع كتابات last_login (ثواني / عدد)
+LAST_LOGIN_FLUSH_INTERVAL = config('LAST_LOGIN_FLUSH_INTERVAL', default=30, cast=int)
+LAST_LOGIN_MAX_PENDING = config('LAST_LOGIN_MAX_PENDING', default=500, cast=int)
+LAST_LOGIN_MIN_AGE = config('LAST_LOGIN_MIN_AGE', default=300, cast=int)
+
+# كاش العملاء الموثقين داخل كل عامل، TTL هو أقصى مدة لظهور تعطيل حساب في العمال الآخرين
+PRINCIPAL_CACHE_SIZE = config('PRINCIPAL_CACHE_SIZE', default=10000, cast=int)
+PRINCIPAL_CACHE_TTL = config('PRINCIPAL_CACHE_TTL', default=60, cast=int)
+
+# أقصى عدد سيريالات لكل باقة من إجراء الأدمن، الأعداد الأكبر عبر generate_serials
+SERIAL_ADMIN_GENERATE_MAX = config('SERIAL_ADMIN_GENERATE_MAX', default=50000, cast=int)
+
+# مخزون السيريالات المولّدة مسبقاً لكل باقة: التعبئة تبدأ تحت LOW_WATER وتصل إلى TARGET
+SERIAL_POOL_LOW_WATER = config('SERIAL_POOL_LOW_WATER', default=200, cast=int)
+SERIAL_POOL_TARGET = config('SERIAL_POOL_TARGET', default=1000, cast=int)
+SERIAL_POOL_BATCH_SIZE = config('SERIAL_POOL_BATCH_SIZE', default=5000, cast=int)
+
+# مفتاح HMAC لأرقام PIN السيريالات (الافتراضي SECRET_KEY)، تغييره يبطل كل الـ PIN المخزنة
+SERIAL_PIN_KEY = config('SERIAL_PIN_KEY', default='')
+
+# حد محاولات PIN الخاطئة: نافذة منزلقة (ثواني) ثم قفل يبدأ بـ LOCKOUT ويتضاعف حتى MAX_LOCKOUT
+PIN_GUARD_STORE = config('PIN_GUARD_STORE', default='serials.services.pin_guard.DatabaseAttemptStore')
+PIN_GUARD_MAX_FAILURES = config('PIN_GUARD_MAX_FAILURES', default=5, cast=int)
+PIN_GUARD_IP_MAX_FAILURES = config('PIN_GUARD_IP_MAX_FAILURES', default=20, cast=int)
+PIN_GUARD_WINDOW = config('PIN_GUARD_WINDOW', default=900, cast=int)
+PIN_GUARD_LOCKOUT = config('PIN_GUARD_LOCKOUT', default=60, cast=int)
+PIN_GUARD_MAX_LOCKOUT = config('PIN_GUARD_MAX_LOCKOUT', default=86400, cast=int)
+PIN_GUARD_REFRESH_INTERVAL = config('PIN_GUARD_REFRESH_INTERVAL', default=5, cast=int)
+
+# أقصى عدد أزواج (serial, pin) في طلب التحقق/التفعيل الجماعي للموزعين (413 إذا تجاوزه)،
+# وعدد الأزواج في كل استعلام/كتلة من الرد
+SERIAL_BULK_MAX_ITEMS = config('SERIAL_BULK_MAX_ITEMS', default=5000, cast=int)
+SERIAL_BULK_CHUNK_SIZE = config('SERIAL_BULK_CHUNK_SIZE', default=500, cast=int)
+
+# الـ outbox: إعادة المحاولة بتأخير يتضاعف من BASE_DELAY حتى MAX_DELAY ثم dead بعد MAX_ATTEMPTS
+OUTBOX_MAX_ATTEMPTS = config('OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+OUTBOX_BASE_DELAY = config('OUTBOX_BASE_DELAY', default=30, cast=int)
+OUTBOX_MAX_DELAY = config('OUTBOX_MAX_DELAY', default=3600, cast=int)
+OUTBOX_LEASE = config('OUTBOX_LEASE', default=300, cast=int)
+
+# Bloom filter لأرقام السيريال في كل عامل: 1% ≈ 1.2 بايت لكل سيريال (10 مليون ≈ 12MB)
+SERIAL_FILTER_FP_RATE = config('SERIAL_FILTER_FP_RATE', default=0.01, cast=float)
+SERIAL_FILTER_REFRESH_INTERVAL = config('SERIAL_FILTER_REFRESH_INTERVAL', default=1, cast=float)
+SERIAL_FILTER_REBUILD_INTERVAL = config('SERIAL_FILTER_REBUILD_INTERVAL', default=21600, cast=int)
+# أقل فاصل (ثوانٍ) بين تحديثين إجباريين عند سيريال غير موجود، في كل عامل
+SERIAL_FILTER_MISS_REFRESH_INTERVAL = config('SERIAL_FILTER_MISS_REFRESH_INTERVAL', default=0.1, cast=float)
+
 if not DEBUG:
     SECURE_SSL_REDIRECT = True
     SESSION_COOKIE_SECURE = True
@@ -152,11 +237,36 @@ EMAIL_HOST_USER = 'b3440f001@smtp-brevo.com'
 EMAIL_HOST_PASSWORD = config('BREVO_API_KEY', default='')
 DEFAULT_FROM_EMAIL = 'SerialCo TV <ectroshop9@gmail.com>'
 
+# الاتصالات الخارجية (Chargily, Ecotrack, Google Sheet): مهلة اتصال/قراءة إلزامية بالثواني،
+# إعادة بتفاوت عشوائي، وقاطع دائرة يفتح بعد BREAKER_THRESHOLD فشل متتالٍ لمدة BREAKER_RESET ثانية
+HTTP_CONNECT_TIMEOUT = config('HTTP_CONNECT_TIMEOUT', default=3, cast=float)
+HTTP_READ_TIMEOUT = config('HTTP_READ_TIMEOUT', default=10, cast=float)
+HTTP_RETRIES = config('HTTP_RETRIES', default=2, cast=int)
+HTTP_BREAKER_THRESHOLD = config('HTTP_BREAKER_THRESHOLD', default=5, cast=int)
+HTTP_BREAKER_RESET = config('HTTP_BREAKER_RESET', default=30, cast=int)
+HTTP_UPSTREAMS = {
+    # داخل طلب الـ webhook: مهلة قصيرة وإعادة واحدة
+    'chargily': {'read_timeout': 5, 'retries': 1},
+    'ecotrack': {'read_timeout': 10},
+    'sheets': {'read_timeout': 10, 'pool_size': 2},
+}
+
+# مرسل البريد: اتصال SMTP دائم لكل عامل، أقصى RATE_LIMIT رسالة/ثانية (حد المزود)، يُغلق بعد IDLE_TIMEOUT ثانية خمول
+EMAIL_RATE_LIMIT = config('EMAIL_RATE_LIMIT', default=10, cast=float)
+EMAIL_IDLE_TIMEOUT = config('EMAIL_IDLE_TIMEOUT', default=30, cast=int)
+
 CHARGILY_SECRET_KEY = config('CHARGILY_SECRET_KEY', default='')
 CHARGILY_PUBLIC_KEY = config('CHARGILY_PUBLIC_KEY', default='')
 CHARGILY_APP_SECRET = config('CHARGILY_APP_SECRET', default='')
+# الرد السريع: التحقق من التوقيع وحفظ الجسم فقط، والتنفيذ في run_outbox_worker
+CHARGILY_WEBHOOK_FAST_ACK = config('CHARGILY_WEBHOOK_FAST_ACK', default=False, cast=bool)
 
 GOOGLE_SHEET_URL = config('GOOGLE_SHEET_URL', default='')
+# تصدير الـ Sheet: POST واحد لكل BATCH_SIZE صف أو بعد MAX_WAIT ثانية على أقدم صف.
+# 1 يرسل كل صف بالشكل القديم، وأكبر من 1 يتطلب Apps Script يقبل {"rows": [...]}
+GOOGLE_SHEET_BATCH_SIZE = config('GOOGLE_SHEET_BATCH_SIZE', default=1, cast=int)
+GOOGLE_SHEET_MAX_WAIT = config('GOOGLE_SHEET_MAX_WAIT', default=5, cast=int)
+GOOGLE_SHEET_TIMEOUT = config('GOOGLE_SHEET_TIMEOUT', default=10, cast=int)
 
 LOGGING = {
     'version': 1,
@@ -1,18 +1,44 @@
-from django.contrib import admin
-from .models import SerialPackage, SerialKey, SerialUsage
+import csv
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.http import HttpResponse
+from django.utils import timezone
+from .models import (
+    OutboxMessage, PinAttempt, ReconciliationRun, SerialPackage, SerialKey, SerialUsage, UsageRollupRun, WebhookEvent,
+)
+from .services.generator import SerialGenerator
+from .services.outbox import outbox
+
+
+class GenerateSerialsActionForm(ActionForm):
+    count = forms.IntegerField(min_value=1, initial=10, required=False, label="العدد")
+
 
 @admin.action(description="توليد سيريالات بالجملة")
 def bulk_generate_serials(modeladmin, request, queryset):
+    count = int(request.POST.get('count') or 10)
+    # الطلب يعمل داخل HTTP، الأعداد الكبيرة تمر عبر أمر generate_serials
+    limit = getattr(settings, 'SERIAL_ADMIN_GENERATE_MAX', 50000)
+    if count < 1 or count > limit:
+        modeladmin.message_user(
+            request, f"العدد يجب أن يكون بين 1 و {limit}، استخدم manage.py generate_serials للأعداد الأكبر",
+            messages.ERROR,
+        )
+        return
+    # الـ PIN لا يُخزن إلا كـ HMAC، لذا تُسلم السيريالات المولدة كملف CSV هنا فقط
+    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="serials_{timezone.now():%Y%m%d_%H%M%S}.csv"'
+    writer = csv.writer(response)
+    writer.writerow(['package', 'serial_number', 'pin'])
     for package in queryset:
-        count = 10
-        for _ in range(count):
-            SerialKey.objects.create(
-                package=package,
-                tokens_total=package.tokens_limit,
-                tokens_used=0,
-                tokens_remaining=package.tokens_limit,
-            )
-    modeladmin.message_user(request, f"تم توليد {count} سيريال بنجاح")
+        generator = SerialGenerator(
+            package, on_batch=lambda issued: writer.writerows((package.name, *pair) for pair in issued)
+        )
+        generator.run(count)
+    return response
 
 @admin.register(SerialPackage)
 class SerialPackageAdmin(admin.ModelAdmin):
@@ -20,17 +46,54 @@ class SerialPackageAdmin(admin.ModelAdmin):
     list_filter = ('is_active',)
     search_fields = ('name',)
     actions = [bulk_generate_serials]
+    action_form = GenerateSerialsActionForm
 
 @admin.register(SerialKey)
 class SerialKeyAdmin(admin.ModelAdmin):
     list_display = ('serial_number', 'package', 'tokens_remaining', 'tokens_used', 'is_active', 'is_used_up', 'customer')
-    list_filter = ('is_active', 'is_used_up', 'package')
+    list_filter = ('is_active', 'is_used_up', 'in_pool', 'package')
     search_fields = ('serial_number', 'customer__name')
-    readonly_fields = ('serial_number', 'pin', 'tokens_total', 'tokens_used', 'tokens_remaining')
+    readonly_fields = ('serial_number', 'tokens_total', 'tokens_used', 'tokens_remaining')
+    exclude = ('pin',)
 
 @admin.register(SerialUsage)
 class SerialUsageAdmin(admin.ModelAdmin):
     list_display = ('serial_key', 'customer', 'file_name', 'file_type', 'tokens_before', 'tokens_after', 'created_at')
     list_filter = ('file_type', 'created_at')
     search_fields = ('serial_key__serial_number', 'customer__name', 'file_name')
-    readonly_fields = ('tokens_before', 'tokens_after')
\ No newline at end of file
+    readonly_fields = ('tokens_before', 'tokens_after')
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'topic', 'status', 'attempts', 'available_at', 'created_at', 'processed_at')
+    list_filter = ('status', 'topic')
+    readonly_fields = ('topic', 'payload', 'attempts', 'last_error', 'created_at', 'processed_at')
+    actions = ['retry_messages']
+
+    @admin.action(description="إعادة الرسائل المحددة (dead) إلى الطابور")
+    def retry_messages(self, request, queryset):
+        count = outbox.retry_dead(list(queryset.values_list('id', flat=True)))
+        messages.success(request, f"✅ أُعيدت {count} رسالة إلى الطابور")
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('checkout_id', 'received_at', 'processed_at', 'serial')
+    search_fields = ('checkout_id',)
+    readonly_fields = ('checkout_id', 'body', 'received_at', 'processed_at', 'serial')
+
+@admin.register(UsageRollupRun)
+class UsageRollupRunAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'finished_at', 'rolled_from', 'rolled_until', 'rows')
+    readonly_fields = ('started_at', 'finished_at', 'rolled_from', 'rolled_until', 'rows')
+
+@admin.register(ReconciliationRun)
+class ReconciliationRunAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'finished_at', 'incremental', 'serials_checked', 'customers_checked', 'discrepancies')
+    list_filter = ('incremental',)
+    readonly_fields = ('started_at', 'finished_at', 'incremental', 'serials_checked', 'customers_checked', 'discrepancies', 'report_path')
+
+@admin.register(PinAttempt)
+class PinAttemptAdmin(admin.ModelAdmin):
+    list_display = ('key', 'failures', 'lockouts', 'locked_until', 'updated_at')
+    search_fields = ('key',)
+    readonly_fields = ('key', 'window_start', 'previous_failures', 'failures', 'lockouts', 'updated_at')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from serials.services.partitions import add_months, month_start
+from serials.services.usage import usage_rollup
+
+
+class Command(BaseCommand):
+    help = 'صيانة SerialUsage: partitions الأشهر القادمة وفصل القديمة (Postgres)، أو النقل إلى الأرشيف'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retain-months', type=int, default=12,
+                            help='عدد الأشهر التي تبقى صفوفها الخام في الجدول الحي')
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='عدد الأشهر القادمة التي تُنشأ لها partitions مسبقاً')
+
+    def handle(self, *args, **options):
+        before = add_months(month_start(timezone.now()), -options['retain_months'])
+        result = usage_rollup.archive(before, months_ahead=options['months_ahead'])
+        if 'skipped' in result:
+            self.stdout.write(self.style.WARNING(f"⚠️ {result['skipped']}، شغّل rollup_serial_usage أولاً"))
+            return
+        for key, value in result.items():
+            self.stdout.write(f'{key}: {value}')
+        self.stdout.write(self.style.SUCCESS('✅ تمت الصيانة'))
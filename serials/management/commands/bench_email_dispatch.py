@@ -0,0 +1,83 @@
+import threading
+import time
+
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from serials.services.mailer import EmailDispatcher
+
+
+class Command(BaseCommand):
+    help = 'قياس معدل إرسال البريد: اتصال لكل رسالة (send_mail) مقابل EmailDispatcher باتصال دائم'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500)
+        parser.add_argument('--local-smtp', action='store_true',
+                            help='تشغيل خادم SMTP محلي يتجاهل الرسائل (smtpd) بدل locmem')
+        parser.add_argument('--host', help='خادم SMTP للاختبار (مثلاً aiosmtpd يعمل محلياً)')
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--rate', type=float, default=0, help='حد الإرسال في الثانية (0 بلا حد)')
+        parser.add_argument('--modes', nargs='+', choices=('per-message', 'dispatcher'),
+                            default=['per-message', 'dispatcher'])
+
+    def handle(self, *args, **options):
+        overrides = {'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend'}
+        host = options['host']
+        if options['local_smtp']:
+            host, options['port'] = '127.0.0.1', self.start_local_smtp()
+        if host:
+            overrides = {
+                'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+                'EMAIL_HOST': host, 'EMAIL_PORT': options['port'],
+                'EMAIL_USE_TLS': False, 'EMAIL_HOST_USER': '', 'EMAIL_HOST_PASSWORD': '',
+            }
+        self.stdout.write(f"backend: {overrides['EMAIL_BACKEND']} {host or ''}")
+
+        with override_settings(**overrides):
+            for mode in options['modes']:
+                mail.outbox = []
+                messages = [self.message(i) for i in range(options['count'])]
+                started = time.perf_counter()
+                if mode == 'per-message':
+                    failed = 0
+                    for message in messages:
+                        try:
+                            message.send()
+                        except Exception:
+                            failed += 1
+                else:
+                    dispatcher = EmailDispatcher(rate=options['rate'])
+                    failed = sum(error is not None for error in dispatcher.send_messages(messages))
+                    dispatcher.close()
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{mode:12} {len(messages)} رسالة في {elapsed:.2f}s "
+                    f"({len(messages) / elapsed:.0f} رسالة/ثانية، {failed} فشلت)"
+                )
+
+    @staticmethod
+    def message(i):
+        message = EmailMultiAlternatives(
+            subject='bench', body=f'message {i}', from_email='bench@example.com', to=[f'bench{i}@example.com']
+        )
+        message.attach_alternative(f'<p>message {i}</p>', 'text/html')
+        return message
+
+    @staticmethod
+    def start_local_smtp():
+        try:
+            # متاحان حتى Python 3.11 (runtime.txt)، للقياس فقط
+            import asyncore
+            import smtpd
+        except ImportError:
+            raise CommandError('smtpd غير متاح، شغّل aiosmtpd يدوياً واستعمل --host/--port')
+
+        class Sink(smtpd.SMTPServer):
+            def process_message(self, *args, **kwargs):
+                return None
+
+        server = Sink(('127.0.0.1', 0), None)
+        threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1}, daemon=True).start()
+        return server.socket.getsockname()[1]
@@ -0,0 +1,50 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from serials.models import SerialKey, SerialPackage
+from serials.services import pins
+from serials.services.generator import SerialGenerator
+
+
+class Command(BaseCommand):
+    help = 'مقارنة كلفة البحث عن سيريال: (serial_number, pin) معاً مقابل serial_number ثم HMAC'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--serials', type=int, default=100000, help='عدد السيريالات في الجدول')
+        parser.add_argument('--lookups', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        package, _ = SerialPackage.objects.get_or_create(
+            name='bench-pin', defaults={'tokens_limit': 10, 'price': 0, 'is_active': False}
+        )
+        issued = []
+        missing = options['serials'] - SerialKey.objects.filter(package=package).count()
+        if missing > 0:
+            SerialGenerator(package, on_batch=issued.extend).run(missing)
+        if not issued:
+            self.stdout.write(self.style.WARNING('احذف الباقة bench-pin لإعادة التوليد بأرقام PIN معروفة'))
+            return
+
+        sample = random.sample(issued, min(options['lookups'], len(issued)))
+        hashed = [(serial, pins.hash_pin(serial, pin)) for serial, pin in sample]
+
+        started = time.perf_counter()
+        for serial, pin_hash in hashed:
+            SerialKey.objects.get(serial_number=serial, pin=pin_hash)
+        composite = (time.perf_counter() - started) / len(hashed)
+
+        started = time.perf_counter()
+        for serial, pin in sample:
+            SerialKey.objects.get_by_pin(serial, pin)
+        serial_only = (time.perf_counter() - started) / len(sample)
+
+        started = time.perf_counter()
+        for serial, pin in sample:
+            pins.hash_pin(serial, pin)
+        hmac_cost = (time.perf_counter() - started) / len(sample)
+
+        self.stdout.write(f'serial_number + pin في SQL : {composite * 1e6:8.1f} µs/بحث')
+        self.stdout.write(f'serial_number ثم HMAC      : {serial_only * 1e6:8.1f} µs/بحث')
+        self.stdout.write(f'منها HMAC فقط              : {hmac_cost * 1e6:8.1f} µs')
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+
+from serials.models import SerialKey, SerialPackage
+
+
+class Command(BaseCommand):
+    help = 'مقارنة خصم التوكنز المتزامن: قفل الصف، بدون قفل، و UPDATE مشروط واحد'
+
+    MODES = ('locked', 'unlocked', 'conditional')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--attempts', type=int, default=200, help='محاولات خصم لكل thread')
+        parser.add_argument('--balance', type=int, default=1000, help='رصيد السيريال في كل جولة')
+        parser.add_argument('--modes', nargs='+', choices=self.MODES, default=list(self.MODES))
+
+    def handle(self, *args, **options):
+        package, _ = SerialPackage.objects.get_or_create(
+            name='bench-debit', defaults={'tokens_limit': options['balance'], 'price': 0, 'is_active': False}
+        )
+        for mode in options['modes']:
+            serial = SerialKey.objects.create(
+                package=package, tokens_total=options['balance'], tokens_remaining=options['balance']
+            )
+            try:
+                self.run_mode(mode, serial, options)
+            finally:
+                serial.delete()
+
+    def run_mode(self, mode, serial, options):
+        spend = getattr(self, f'spend_{mode}')
+        counts = {'ok': 0, 'refused': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                for _ in range(options['attempts']):
+                    try:
+                        result = 'ok' if spend(serial.pk) else 'refused'
+                    except DatabaseError:
+                        result = 'errors'
+                    with lock:
+                        counts[result] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        serial.refresh_from_db()
+        debited = options['balance'] - serial.tokens_remaining
+        overspend = counts['ok'] - debited
+        total = sum(counts.values())
+        style = self.style.SUCCESS if overspend == 0 else self.style.ERROR
+        self.stdout.write(style(
+            f'{mode:12} {total / elapsed:8,.0f} محاولة/ث  ok={counts["ok"]} refused={counts["refused"]} '
+            f'errors={counts["errors"]} remaining={serial.tokens_remaining} overspend={overspend}'
+        ))
+
+    @staticmethod
+    def spend_locked(pk):
+        # المسار القديم لـ UseTokenAPI: قفل الصف ثم save كامل
+        with transaction.atomic():
+            serial = SerialKey.objects.select_for_update().get(pk=pk)
+            if serial.tokens_remaining < 1:
+                return False
+            serial.tokens_used += 1
+            serial.tokens_remaining -= 1
+            serial.save()
+            return True
+
+    @staticmethod
+    def spend_unlocked(pk):
+        # المسار القديم لـ Firmware/SchematicDetailAPI: قراءة ثم save بدون قفل
+        serial = SerialKey.objects.get(pk=pk)
+        if serial.tokens_remaining < 1:
+            return False
+        serial.tokens_used += 1
+        serial.tokens_remaining -= 1
+        serial.save()
+        return True
+
+    @staticmethod
+    def spend_conditional(pk):
+        return SerialKey.debit(1, id=pk) is not None
@@ -0,0 +1,96 @@
+import hashlib
+import hmac
+import json
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+
+from serials.models import OutboxMessage, SerialKey, SerialPackage, WebhookEvent
+from serials.views import chargily_webhook
+
+
+class Command(BaseCommand):
+    help = 'قياس زمن رد chargily_webhook لدفعة متزامنة من الطلبات: الوضع السريع مقابل التنفيذ الكامل'
+
+    SECRET = 'bench-webhook-secret'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--retries', type=float, default=0.1, help='نسبة الطلبات المكررة (إعادة Chargily)')
+        parser.add_argument('--modes', nargs='+', choices=('fast', 'full'), default=['fast', 'full'])
+
+    def handle(self, *args, **options):
+        package, _ = SerialPackage.objects.get_or_create(
+            name='bench-webhook', defaults={'tokens_limit': 10, 'price': 0, 'is_active': False}
+        )
+        for mode in options['modes']:
+            run_id = uuid.uuid4().hex[:8]
+            bodies = [self.body(f'bench_{run_id}_{i}', package) for i in range(options['count'])]
+            # إعادات Chargily: نفس الجسم ونفس التوقيع
+            bodies += bodies[:int(len(bodies) * options['retries'])]
+            try:
+                with override_settings(CHARGILY_APP_SECRET=self.SECRET, CHARGILY_WEBHOOK_FAST_ACK=(mode == 'fast'),
+                                       GOOGLE_SHEET_URL=''):
+                    self.run_mode(mode, bodies, options['concurrency'])
+            finally:
+                self.cleanup(run_id)
+
+    def body(self, checkout_id, package):
+        return json.dumps({
+            'type': 'checkout.paid',
+            'data': {
+                'id': checkout_id,
+                'customer': {'email': 'bench@example.com'},
+                'metadata': {'package_id': package.pk, 'name': 'bench'},
+            },
+        }).encode()
+
+    def run_mode(self, mode, bodies, concurrency):
+        factory = RequestFactory()
+        latencies = []
+        statuses = {}
+        lock = threading.Lock()
+
+        def send(body):
+            signature = hmac.new(self.SECRET.encode(), body, hashlib.sha256).hexdigest()
+            request = factory.post('/api/webhook/chargily/', body, content_type='application/json',
+                                   HTTP_SIGNATURE=signature)
+            started = time.perf_counter()
+            try:
+                response = chargily_webhook(request)
+            finally:
+                connection.close()
+            elapsed = time.perf_counter() - started
+            outcome = json.loads(response.content).get('status') or response.status_code
+            with lock:
+                latencies.append(elapsed)
+                statuses[outcome] = statuses.get(outcome, 0) + 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, bodies))
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        q = statistics.quantiles(latencies, n=100)
+        self.stdout.write(self.style.SUCCESS(
+            f'{mode:5} {len(bodies)} طلب في {wall:.2f}s ({len(bodies) / wall:,.0f}/ث)  '
+            f'p50={q[49] * 1000:.1f}ms p95={q[94] * 1000:.1f}ms p99={q[98] * 1000:.1f}ms max={latencies[-1] * 1000:.1f}ms  '
+            f'{statuses}'
+        ))
+
+    def cleanup(self, run_id):
+        prefix = f'bench_{run_id}_'
+        event_ids = list(WebhookEvent.objects.filter(checkout_id__startswith=prefix).values_list('id', flat=True))
+        OutboxMessage.objects.filter(topic='chargily.checkout', payload__event_id__in=event_ids).delete()
+        WebhookEvent.objects.filter(id__in=event_ids).delete()
+        serial_ids = list(SerialKey.objects.filter(payment_id__startswith=prefix).values_list('id', flat=True))
+        OutboxMessage.objects.filter(payload__serial_id__in=serial_ids).delete()
+        SerialKey.objects.filter(id__in=serial_ids).delete()
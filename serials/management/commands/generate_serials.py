@@ -0,0 +1,47 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from serials.models import SerialPackage
+from serials.services.generator import SerialGenerator
+
+
+class Command(BaseCommand):
+    help = 'توليد عدد كبير من السيريالات لباقة بأكواد من secrets وإدخال على دفعات'
+
+    def add_arguments(self, parser):
+        parser.add_argument('package_id', type=int)
+        parser.add_argument('count', type=int)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--output', help='ملف CSV للسيريالات وأرقام الـ PIN (لا تُخزن إلا كـ HMAC)')
+
+    def handle(self, *args, **options):
+        try:
+            package = SerialPackage.objects.get(pk=options['package_id'])
+        except SerialPackage.DoesNotExist:
+            raise CommandError(f"الباقة {options['package_id']} غير موجودة")
+
+        count = options['count']
+        if count <= 0:
+            raise CommandError('العدد يجب أن يكون أكبر من صفر')
+
+        def progress(generator):
+            self.stdout.write(
+                f'{generator.created}/{count} ({generator.created * 100 // count}%) '
+                f'- {generator.rate:,.0f} سيريال/ث'
+            )
+
+        output = options['output'] or f"serials_{package.pk}_{timezone.now():%Y%m%d_%H%M%S}.csv"
+        with open(output, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['serial_number', 'pin'])
+            generator = SerialGenerator(
+                package, batch_size=options['batch_size'], progress=progress, on_batch=writer.writerows
+            )
+            generator.run(count)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ تم توليد {generator.created} سيريال لـ {package.name} في {generator.elapsed:.1f}s '
+            f'({generator.rate:,.0f} سيريال/ث، {generator.collisions} تصادم) → {output}'
+        ))
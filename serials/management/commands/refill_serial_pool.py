@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from serials.models import SerialPackage
+from serials.services.pool import serial_pool
+
+
+class Command(BaseCommand):
+    help = 'تعبئة مخزون السيريالات المولّدة مسبقاً للباقات التي نزلت تحت الحد الأدنى'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=int, default=0,
+                            help='التكرار كل N ثانية بدل التشغيل مرة واحدة')
+
+    def handle(self, *args, **options):
+        while True:
+            refilled = serial_pool.refill_all()
+            depths = serial_pool.depth()
+            for package in SerialPackage.objects.filter(is_active=True).order_by('id'):
+                added = refilled.get(package.pk, 0)
+                self.stdout.write(
+                    f'{package.name}: {depths.get(package.pk, 0)} في المخزون'
+                    + (f' (+{added})' if added else '')
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
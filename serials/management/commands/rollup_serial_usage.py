@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from serials.services.usage import usage_rollup
+
+
+class Command(BaseCommand):
+    help = 'تحديث التجميعات اليومية لـ SerialUsage (لكل سيريال وعميل ونوع ملف) للأيام المكتملة'
+
+    def handle(self, *args, **options):
+        start, end = usage_rollup.next_range()
+        if start >= end:
+            self.stdout.write('لا أيام مكتملة جديدة')
+            return
+        rows = usage_rollup.roll(start, end)
+        self.stdout.write(self.style.SUCCESS(f'✅ {start} → {end}: {rows} صف'))
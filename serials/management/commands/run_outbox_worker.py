@@ -0,0 +1,100 @@
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from serials.services.outbox import BATCH_HANDLERS, EXPORTERS, outbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'تنفيذ رسائل الـ outbox (بريد الشراء، Google Sheet) بعدد خيوط محدود'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='عدد الخيوط المتوازية')
+        parser.add_argument('--batch-size', type=int, default=20, help='عدد الرسائل المحجوزة في كل دفعة')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='الانتظار بالثواني عندما يكون الطابور فارغاً')
+        parser.add_argument('--purge-days', type=int, default=7, help='حذف الرسائل المنفذة الأقدم من N يوم (0 لتعطيله)')
+        parser.add_argument('--dead-days', type=int, default=30, help='حذف رسائل dead الأقدم من N يوم (0 لتعطيله)')
+        parser.add_argument('--once', action='store_true', help='تفريغ الرسائل المستحقة ثم الخروج')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stop.set())
+
+        exporters = [import_string(path) for path in EXPORTERS.values()]
+        # المُصدّرات في خيط واحد خاص بها، فالـ Sheet البطيء لا يؤخر البريد ولا يحجز خيطاً لكل شراء
+        export_thread = threading.Thread(
+            target=self.export_loop, args=(exporters, stop, options['poll_interval']),
+            name='outbox-export', daemon=True,
+        )
+        if not options['once']:
+            export_thread.start()
+
+        processed = failed = 0
+        next_purge = 0.0
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='outbox') as pool:
+            while not stop.is_set():
+                if (options['purge_days'] or options['dead_days']) and time.monotonic() >= next_purge:
+                    outbox.purge(options['purge_days'], options['dead_days'])
+                    next_purge = time.monotonic() + 3600
+
+                messages = outbox.claim(options['batch_size'])
+                if not messages:
+                    if options['once']:
+                        break
+                    stop.wait(options['poll_interval'])
+                    continue
+                # الدفعة التالية تُحجز بعد انتهاء الحالية، فلا يتجاوز العمل الجاري batch_size
+                for size, ok in pool.map(self.process, self.group(messages)):
+                    processed += ok
+                    failed += size - ok
+
+        if options['once']:
+            for exporter in exporters:
+                while exporter.flush(force=True):
+                    pass
+        else:
+            stop.set()
+            export_thread.join()
+        self.stdout.write(self.style.SUCCESS(f'✅ {processed} رسالة نُفذت، {failed} فشلت'))
+
+    @staticmethod
+    def export_loop(exporters, stop, poll_interval):
+        try:
+            while not stop.is_set():
+                try:
+                    exported = sum(exporter.flush() for exporter in exporters)
+                except Exception as e:
+                    logger.error(f"❌ Outbox export failed: {e}")
+                    connection.close()
+                    exported = 0
+                if not exported:
+                    stop.wait(poll_interval)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def group(messages):
+        """مواضيع BATCH_HANDLERS تُنفذ كمجموعة واحدة، والباقي رسالة رسالة"""
+        batches = {}
+        for message in messages:
+            if message.topic in BATCH_HANDLERS:
+                batches.setdefault(message.topic, []).append(message)
+            else:
+                yield [message]
+        yield from batches.values()
+
+    @staticmethod
+    def process(messages):
+        try:
+            return len(messages), outbox.process_batch(messages)
+        finally:
+            connection.close()
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("serials", "0004_alter_serialusage_options_serialkey_payment_id_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReconciliationRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField()),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("incremental", models.BooleanField(default=False)),
+                ("serials_checked", models.IntegerField(default=0)),
+                ("customers_checked", models.IntegerField(default=0)),
+                ("discrepancies", models.IntegerField(default=0)),
+                ("report_path", models.CharField(blank=True, max_length=500)),
+            ],
+            options={
+                "verbose_name": "Reconciliation Run",
+                "verbose_name_plural": "Reconciliation Runs",
+                "ordering": ["-started_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("serials", "0005_reconciliationrun"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="serialkey",
+            name="in_pool",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="serialkey",
+            index=models.Index(
+                condition=models.Q(("in_pool", True)),
+                fields=["package", "id"],
+                name="serialkey_pool_idx",
+            ),
+        ),
+    ]
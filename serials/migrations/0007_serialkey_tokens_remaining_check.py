@@ -0,0 +1,20 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("serials", "0006_serialkey_in_pool"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="serialkey",
+            constraint=models.CheckConstraint(
+                check=models.Q(("tokens_remaining__gte", 0)),
+                name="serialkey_tokens_remaining_gte_0",
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:41
+
+from django.db import migrations, models, transaction
+from django.db.models.functions import Length
+
+from serials.services.pins import hash_pin, pin_key
+
+BATCH_SIZE = 1000
+
+
+def hash_plaintext_pins(apps, schema_editor):
+    # دفعات صغيرة كل منها في معاملة مستقلة، بدون قفل الجدول كاملاً.
+    # الصفوف المحوّلة (64 حرفاً) تُتخطى، فيمكن إعادة التشغيل بعد انقطاع.
+    SerialKey = apps.get_model("serials", "SerialKey")
+    key = pin_key()
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                SerialKey.objects.annotate(pin_length=Length("pin"))
+                .filter(id__gt=last_id, pin_length__lte=8)
+                .order_by("id")
+                .only("id", "serial_number", "pin")[:BATCH_SIZE]
+            )
+            if not batch:
+                return
+            for serial in batch:
+                serial.pin = hash_pin(serial.serial_number, serial.pin, key)
+            SerialKey.objects.bulk_update(batch, ["pin"])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("serials", "0007_serialkey_tokens_remaining_check"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="serialkey",
+            name="serials_ser_serial__d95dee_idx",
+        ),
+        migrations.AlterField(
+            model_name="serialkey",
+            name="pin",
+            field=models.CharField(max_length=64),
+        ),
+        migrations.RunPython(hash_plaintext_pins),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("serials", "0008_hash_serial_pins"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PinAttempt",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=100, unique=True)),
+                ("window_start", models.DateTimeField()),
+                ("previous_failures", models.IntegerField(default=0)),
+                ("failures", models.IntegerField(default=0)),
+                ("lockouts", models.IntegerField(default=0)),
+                (
+                    "locked_until",
+                    models.DateTimeField(blank=True, db_index=True, null=True),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "PIN Attempt",
+                "verbose_name_plural": "PIN Attempts",
+            },
+        ),
+    ]
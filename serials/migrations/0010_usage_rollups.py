@@ -0,0 +1,186 @@
+# Generated by Django 4.2.16 on 2026-10-16 23:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0012_source_api_key_hash"),
+        ("serials", "0009_pinattempt"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CustomerDailyUsage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("downloads", models.IntegerField(default=0)),
+                ("tokens_used", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Customer Daily Usage",
+                "verbose_name_plural": "Customer Daily Usage",
+            },
+        ),
+        migrations.CreateModel(
+            name="FileTypeDailyUsage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("downloads", models.IntegerField(default=0)),
+                ("tokens_used", models.BigIntegerField(default=0)),
+                ("file_type", models.CharField(max_length=20)),
+            ],
+            options={
+                "verbose_name": "File Type Daily Usage",
+                "verbose_name_plural": "File Type Daily Usage",
+            },
+        ),
+        migrations.CreateModel(
+            name="SerialDailyUsage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("downloads", models.IntegerField(default=0)),
+                ("tokens_used", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Serial Daily Usage",
+                "verbose_name_plural": "Serial Daily Usage",
+            },
+        ),
+        migrations.CreateModel(
+            name="SerialUsageArchive",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("serial_key_id", models.BigIntegerField(db_index=True)),
+                ("customer_id", models.BigIntegerField(blank=True, null=True)),
+                ("file_name", models.CharField(max_length=200)),
+                ("file_type", models.CharField(max_length=20)),
+                ("tokens_before", models.IntegerField()),
+                ("tokens_after", models.IntegerField()),
+                ("tokens_used", models.IntegerField()),
+                ("created_at", models.DateTimeField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Serial Usage Archive",
+                "verbose_name_plural": "Serial Usages Archive",
+            },
+        ),
+        migrations.CreateModel(
+            name="UsageRollupRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField()),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("rolled_from", models.DateField()),
+                ("rolled_until", models.DateField()),
+                ("rows", models.IntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Usage Rollup Run",
+                "verbose_name_plural": "Usage Rollup Runs",
+                "ordering": ["-started_at"],
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="serialusage",
+            options={
+                "ordering": ["-created_at", "-id"],
+                "verbose_name": "Serial Usage",
+                "verbose_name_plural": "Serial Usages",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="serialusage",
+            index=models.Index(
+                fields=["serial_key", "-created_at", "-id"],
+                name="serials_ser_serial__b6b089_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="serialusage",
+            index=models.Index(
+                fields=["customer", "-created_at", "-id"],
+                name="serials_ser_custome_5e9321_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="serialusage",
+            index=models.Index(
+                fields=["created_at"], name="serials_ser_created_238ba3_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="serialdailyusage",
+            name="serial_key",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="daily_usage",
+                to="serials.serialkey",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="filetypedailyusage",
+            constraint=models.UniqueConstraint(
+                fields=("file_type", "day"), name="filetypedailyusage_type_day_uniq"
+            ),
+        ),
+        migrations.AddField(
+            model_name="customerdailyusage",
+            name="customer",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="daily_usage",
+                to="accounts.customer",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="serialdailyusage",
+            constraint=models.UniqueConstraint(
+                fields=("serial_key", "day"), name="serialdailyusage_serial_day_uniq"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="customerdailyusage",
+            constraint=models.UniqueConstraint(
+                fields=("customer", "day"), name="customerdailyusage_customer_day_uniq"
+            ),
+        ),
+    ]
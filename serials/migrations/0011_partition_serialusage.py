@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from serials.services.partitions import MonthlyPartitions
+
+
+def partition_serial_usage(apps, schema_editor):
+    # على Postgres فقط، باقي القواعد تستخدم الأرشفة إلى SerialUsageArchive
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    MonthlyPartitions("serials_serialusage").convert()
+
+
+class Migration(migrations.Migration):
+    # convert يبدّل الجدول في معاملة قصيرة ثم ينقل الصفوف بدفعات، كل دفعة في معاملتها،
+    # فلا يبقى قفل على serials_serialusage طوال النسخ
+    atomic = False
+
+    dependencies = [
+        ("serials", "0010_usage_rollups"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_serial_usage, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,15 @@
-import random
+import secrets
 import string
-from django.db import models
+from collections import namedtuple
+
+from django.db import connection, models
+from django.db.models import Q
+
+from .services import pins
+from .services.bloom import serial_filter
+
+# نتيجة خصم ناجح: الصف بعد الخصم كما رجع من UPDATE ... RETURNING
+TokenDebit = namedtuple('TokenDebit', 'id tokens_used tokens_remaining customer_id')
 
 
 class SerialPackage(models.Model):
@@ -18,9 +27,21 @@ class SerialPackage(models.Model):
         return f"{self.name} ({self.tokens_limit} tokens)"
 
 
+class SerialKeyQuerySet(models.QuerySet):
+    def get_by_pin(self, serial_number, pin, **filters):
+        """جلب السيريال عبر فهرس serial_number وحده ثم التحقق من الـ PIN بزمن ثابت"""
+        if not serial_filter.might_contain(serial_number):
+            raise self.model.DoesNotExist("Invalid serial or PIN")
+        serial_key = self.get(serial_number=serial_number, **filters)
+        if not serial_key.check_pin(pin):
+            raise self.model.DoesNotExist("Invalid serial or PIN")
+        return serial_key
+
+
 class SerialKey(models.Model):
     serial_number = models.CharField(max_length=32, unique=True)
-    pin = models.CharField(max_length=8)
+    # HMAC للـ PIN (serials.services.pins)، الـ PIN الفعلي لا يُخزن ويُتاح فقط عبر raw_pin عند توليده
+    pin = models.CharField(max_length=64)
     package = models.ForeignKey(SerialPackage, on_delete=models.CASCADE)
     tokens_total = models.IntegerField()
     tokens_used = models.IntegerField(default=0)
@@ -33,6 +54,8 @@ class SerialKey(models.Model):
     )
     is_active = models.BooleanField(default=True)
     is_used_up = models.BooleanField(default=False)
+    # سيريال مولّد مسبقاً في مخزون الباقة، غير مباع وغير مفعّل حتى يُسحب عبر serial_pool
+    in_pool = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     used_at = models.DateTimeField(null=True, blank=True)
     
@@ -46,11 +69,20 @@ class SerialKey(models.Model):
         verbose_name="Payment ID (Chargily)"
     )
 
+    objects = SerialKeyQuerySet.as_manager()
+
+    SERIAL_PREFIX = 'SC'
+    SERIAL_CHARS = string.ascii_uppercase + string.digits
+    SERIAL_CODE_LENGTH = 14
+
     class Meta:
         verbose_name = "Serial Key"
         verbose_name_plural = "Serial Keys"
         indexes = [
-            models.Index(fields=['serial_number', 'pin']),  # فهرس مركب لتحسين أداء البحث
+            models.Index(fields=['package', 'id'], condition=models.Q(in_pool=True), name='serialkey_pool_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(tokens_remaining__gte=0), name='serialkey_tokens_remaining_gte_0'),
         ]
 
     def __str__(self):
@@ -59,8 +91,9 @@ class SerialKey(models.Model):
     def save(self, *args, **kwargs):
         if not self.serial_number:
             self.serial_number = self.generate_serial()
+            serial_filter.add([self.serial_number])
         if not self.pin:
-            self.pin = self.generate_pin()
+            self.set_pin(self.generate_pin())
         if self.tokens_total is None:
             self.tokens_total = self.package.tokens_limit
         if self.tokens_remaining is None:
@@ -72,28 +105,69 @@ class SerialKey(models.Model):
 
         super().save(*args, **kwargs)
 
-    @staticmethod
-    def generate_serial():
-        prefix = 'SC'
-        chars = string.ascii_uppercase + string.digits
-        code = ''.join(random.choices(chars, k=14))
-        return f"{prefix}{code}"
+    def set_pin(self, raw_pin):
+        self.pin = pins.hash_pin(self.serial_number, raw_pin)
+        self.raw_pin = raw_pin
+
+    def check_pin(self, raw_pin):
+        return pins.check_pin(self.serial_number, raw_pin, self.pin)
+
+    @classmethod
+    def generate_serial(cls):
+        code = ''.join(secrets.choice(cls.SERIAL_CHARS) for _ in range(cls.SERIAL_CODE_LENGTH))
+        return f"{cls.SERIAL_PREFIX}{code}"
 
     @staticmethod
     def generate_pin():
         # 🎯 يضمن دائماً 4 أرقام بين 1000 و 9999 لا تبدأ بصفر
-        return str(random.randint(1000, 9999))
+        return str(1000 + secrets.randbelow(9000))
+
+    @classmethod
+    def debit(cls, amount, **lookup):
+        """خصم amount توكن بجملة UPDATE مشروطة واحدة بدون قفل صفوف
+
+        lookup أعمدة مساواة (id، أو serial_number و pin). الخصم يتم فقط إذا كان
+        السيريال نشطاً ورصيده يكفي، ويُقفل السيريال في نفس الجملة عند نفاد الرصيد.
+        ترجع TokenDebit أو None إذا لم يوجد سيريال نشط برصيد كافٍ.
+
+        مع pin: جلب السيريال عبر فهرس serial_number، ومقارنة الـ PIN في Python بزمن ثابت
+        (مثل get_by_pin)، ثم الخصم المشروط بالـ id. الـ PIN لا يدخل شرط WHERE أبداً.
+        """
+        if 'serial_number' in lookup and not serial_filter.might_contain(lookup['serial_number']):
+            return None
+        if 'pin' in lookup:
+            pin = lookup.pop('pin')
+            row = cls.objects.filter(**lookup).values_list('id', 'pin').first()
+            if row is None or not pins.check_pin(lookup['serial_number'], pin, row[1]):
+                return None
+            lookup = {'id': row[0]}
+        qn = connection.ops.quote_name
+        where = ' AND '.join(f'{qn(cls._meta.get_field(name).column)} = %s' for name in lookup)
+        sql = (
+            f'UPDATE {qn(cls._meta.db_table)} SET '
+            f'tokens_used = tokens_used + %s, '
+            f'tokens_remaining = tokens_remaining - %s, '
+            f'is_used_up = CASE WHEN tokens_remaining - %s <= 0 THEN %s ELSE is_used_up END, '
+            f'is_active = CASE WHEN tokens_remaining - %s <= 0 THEN %s ELSE is_active END '
+            f'WHERE {where} AND is_active = %s AND tokens_remaining >= %s '
+            f'RETURNING id, tokens_used, tokens_remaining, customer_id'
+        )
+        params = [amount, amount, amount, True, amount, False, *lookup.values(), True, amount]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        return TokenDebit(*row) if row else None
 
     def use_tokens(self, amount):
-        if self.tokens_remaining >= amount:
-            self.tokens_used += amount
-            self.tokens_remaining -= amount
-            if self.tokens_remaining <= 0:
-                self.is_active = False
-                self.is_used_up = True
-            self.save()
-            return True
-        return False
+        debit = self.debit(amount, id=self.pk)
+        if debit is None:
+            return False
+        self.tokens_used = debit.tokens_used
+        self.tokens_remaining = debit.tokens_remaining
+        if self.tokens_remaining <= 0:
+            self.is_active = False
+            self.is_used_up = True
+        return True
 
 
 class SerialUsage(models.Model):
@@ -119,7 +193,13 @@ class SerialUsage(models.Model):
     class Meta:
         verbose_name = "Serial Usage"
         verbose_name_plural = "Serial Usages"
-        ordering = ['-created_at']  # ✅ ترتيب افتراضي من الأحدث للأقدم
+        ordering = ['-created_at', '-id']  # ✅ ترتيب افتراضي من الأحدث للأقدم (keyset)
+        # على Postgres الجدول مقسّم شهرياً على created_at (serials.services.partitions)
+        indexes = [
+            models.Index(fields=['serial_key', '-created_at', '-id']),
+            models.Index(fields=['customer', '-created_at', '-id']),
+            models.Index(fields=['created_at']),
+        ]
 
     def __str__(self):
         return f"{self.serial_key.serial_number} - {self.file_name}"
@@ -129,3 +209,179 @@ class SerialUsage(models.Model):
         if not self.tokens_used:
             self.tokens_used = self.tokens_before - self.tokens_after
         super().save(*args, **kwargs)
+
+
+class SerialUsageArchive(models.Model):
+    """استخدامات أقدم من مدة الاحتفاظ على القواعد غير المقسّمة، منقولة من SerialUsage
+
+    على Postgres الأرشفة تتم بفصل partition الشهر كاملاً بدل نقل الصفوف.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    serial_key_id = models.BigIntegerField(db_index=True)
+    customer_id = models.BigIntegerField(null=True, blank=True)
+    file_name = models.CharField(max_length=200)
+    file_type = models.CharField(max_length=20)
+    tokens_before = models.IntegerField()
+    tokens_after = models.IntegerField()
+    tokens_used = models.IntegerField()
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Serial Usage Archive"
+        verbose_name_plural = "Serial Usages Archive"
+
+    def __str__(self):
+        return f"{self.serial_key_id} - {self.file_name}"
+
+
+class DailyUsage(models.Model):
+    """مجموع الاستخدام ليوم واحد (بالتوقيت المحلي)، يُحسب من SerialUsage بـ rollup_serial_usage"""
+    day = models.DateField()
+    downloads = models.IntegerField(default=0)
+    tokens_used = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class SerialDailyUsage(DailyUsage):
+    serial_key = models.ForeignKey(SerialKey, on_delete=models.CASCADE, related_name='daily_usage')
+
+    class Meta:
+        verbose_name = "Serial Daily Usage"
+        verbose_name_plural = "Serial Daily Usage"
+        constraints = [
+            models.UniqueConstraint(fields=['serial_key', 'day'], name='serialdailyusage_serial_day_uniq'),
+        ]
+
+
+class CustomerDailyUsage(DailyUsage):
+    customer = models.ForeignKey('accounts.Customer', on_delete=models.CASCADE, related_name='daily_usage')
+
+    class Meta:
+        verbose_name = "Customer Daily Usage"
+        verbose_name_plural = "Customer Daily Usage"
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'day'], name='customerdailyusage_customer_day_uniq'),
+        ]
+
+
+class FileTypeDailyUsage(DailyUsage):
+    file_type = models.CharField(max_length=20)
+
+    class Meta:
+        verbose_name = "File Type Daily Usage"
+        verbose_name_plural = "File Type Daily Usage"
+        constraints = [
+            models.UniqueConstraint(fields=['file_type', 'day'], name='filetypedailyusage_type_day_uniq'),
+        ]
+
+
+class UsageRollupRun(models.Model):
+    """سجل تشغيلات rollup_serial_usage، الأيام قبل rolled_until في آخر تشغيل مكتملة في الـ rollup"""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rolled_from = models.DateField()
+    rolled_until = models.DateField()
+    rows = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Usage Rollup Run"
+        verbose_name_plural = "Usage Rollup Runs"
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.rolled_from} → {self.rolled_until}"
+
+
+class ReconciliationRun(models.Model):
+    """سجل تشغيلات reconcile_balances، آخر تشغيل ناجح هو نقطة البداية للوضع التدريجي"""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    incremental = models.BooleanField(default=False)
+    serials_checked = models.IntegerField(default=0)
+    customers_checked = models.IntegerField(default=0)
+    discrepancies = models.IntegerField(default=0)
+    report_path = models.CharField(max_length=500, blank=True)
+
+    class Meta:
+        verbose_name = "Reconciliation Run"
+        verbose_name_plural = "Reconciliation Runs"
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} ({self.discrepancies} discrepancies)"
+
+
+class WebhookEvent(models.Model):
+    """جسم webhook دفعة Chargily كما وصل (وضع الرد السريع)، checkout_id الفريد يمنع تكرار الإعادات"""
+    checkout_id = models.CharField(max_length=255, unique=True)
+    body = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    serial = models.ForeignKey(SerialKey, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        verbose_name = "Webhook Event"
+        verbose_name_plural = "Webhook Events"
+        ordering = ['-received_at']
+
+    def __str__(self):
+        return f"{self.checkout_id} ({'processed' if self.processed_at else 'pending'})"
+
+
+class OutboxMessage(models.Model):
+    """مهمة لاحقة تُكتب في نفس معاملة التغيير، وينفذها run_outbox_worker مع إعادة المحاولة"""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (DEAD, 'Dead letter'),
+    ]
+
+    topic = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    # موعد المحاولة التالية، وأثناء المعالجة نهاية مهلة العامل (بعدها تُستعاد إذا توقف العامل)
+    available_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Outbox Message"
+        verbose_name_plural = "Outbox Messages"
+        indexes = [
+            models.Index(
+                fields=['available_at', 'id'], name='outbox_due_idx',
+                condition=Q(status__in=['pending', 'processing']),
+            ),
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.pk} ({self.status})"
+
+
+class PinAttempt(models.Model):
+    """عداد محاولات PIN الفاشلة لكل سيريال أو IP، مشترك بين كل العمال"""
+    key = models.CharField(max_length=100, unique=True)
+    window_start = models.DateTimeField()
+    previous_failures = models.IntegerField(default=0)
+    failures = models.IntegerField(default=0)
+    lockouts = models.IntegerField(default=0)
+    locked_until = models.DateTimeField(null=True, blank=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "PIN Attempt"
+        verbose_name_plural = "PIN Attempts"
+
+    def __str__(self):
+        return f"{self.key} ({self.failures} failures)"
@@ -7,6 +7,15 @@ class SerialVerifySerializer(serializers.Serializer):
     pin = serializers.CharField(max_length=8, required=True)
 
 
+class SerialBulkSerializer(serializers.Serializer):
+    # الحد الأقصى للعناصر يُفحص في الـ view قبل التحقق (bulk_serials.max_items)
+    items = serializers.ListField(child=SerialVerifySerializer(), min_length=1)
+
+
+class SerialBulkActivateSerializer(SerialBulkSerializer):
+    customer_id = serializers.IntegerField(required=True)
+
+
 class SerialDownloadSerializer(serializers.Serializer):
     serial_number = serializers.CharField(max_length=32, required=True)
     pin = serializers.CharField(max_length=8, required=True)
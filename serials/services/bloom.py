@@ -0,0 +1,252 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+MASK64 = (1 << 64) - 1
+
+
+def key_hashes(key):
+    """بصمتان 64-bit للمفتاح، تُشتق منهما كل مواقع البتات (Kirsch-Mitzenmacher)"""
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+class BloomFilter:
+    """Bloom filter على bytearray، الإضافة بالجملة عبر numpy"""
+
+    def __init__(self, capacity, fp_rate=0.01):
+        capacity = max(int(capacity), 1000)
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.size = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def positions(self, h1, h2):
+        return [((h1 + i * h2) & MASK64) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for pos in self.positions(*key_hashes(key)):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def add_many(self, keys):
+        if not keys:
+            return
+        digests = b''.join(hashlib.blake2b(key.encode(), digest_size=16).digest() for key in keys)
+        hashes = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        # الجمع والضرب uint64 يلتف تلقائياً مثل & MASK64 في positions
+        positions = (hashes[:, :1] + steps * hashes[:, 1:]) % np.uint64(self.size)
+        positions = positions.ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.count += len(keys)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(*key_hashes(key)))
+
+
+class SerialNumberFilter:
+    """Bloom filter لكل أرقام السيريال داخل كل عامل، لرفض السيريالات غير الموجودة بدون قاعدة البيانات
+
+    يُبنى في الخلفية عند start() (من post_worker_init في gunicorn)، وقبل اكتمال البناء
+    (أو في العمليات التي لا تستدعي start) يجيب "ربما" دائماً. السيريالات الجديدة تُضاف
+    فوراً في العامل الذي أنشأها (add)، وفي باقي العمال بجلب id > آخر id كل refresh_interval،
+    ويُعاد البناء كاملاً كل rebuild_interval أو عند تجاوز السعة.
+
+    الرفض من الذاكرة فقط: عند عدم الوجود يُجرى تحديث إجباري واحد على الأكثر كل
+    miss_refresh_interval ثانية في كل عامل، فسيريال أُنشئ في عامل آخر للتو يُقبل غالباً،
+    وطلبات السيريالات العشوائية لا تكلف استعلاماً لكل طلب.
+    """
+
+    def __init__(self, fp_rate=0.01, refresh_interval=1, rebuild_interval=21600, headroom=1.5,
+                 chunk_size=50000, gap_ttl=300, miss_refresh_interval=0.1):
+        self.fp_rate = fp_rate
+        self.gap_ttl = gap_ttl
+        self.refresh_interval = refresh_interval
+        self.miss_refresh_interval = miss_refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.headroom = headroom
+        self.chunk_size = chunk_size
+        self._filter = None
+        self._max_id = 0
+        self._gaps = {}
+        self._built_at = 0.0
+        self._next_refresh = 0.0
+        self._next_miss_refresh = 0.0
+        # سيريالات أُضيفت محلياً ولم يرها التحديث بعد، حتى لا تُضاف (وتُعدّ) مرتين
+        self._local = set()
+        self._building = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def ready(self):
+        return self._filter is not None
+
+    def start(self):
+        """بدء البناء في الخلفية (مرة واحدة في كل مرة)"""
+        with self._lock:
+            if self._building:
+                return False
+            self._building = True
+        threading.Thread(target=self._build_in_background, daemon=True).start()
+        return True
+
+    def might_contain(self, serial_number):
+        """False يعني أن السيريال غير موجود بالتأكيد"""
+        bloom = self._filter
+        if bloom is None or not serial_number:
+            return True
+        if serial_number in bloom:
+            return True
+        now = time.monotonic()
+        if now >= self._next_miss_refresh:
+            self._next_miss_refresh = now + self.miss_refresh_interval
+            self.refresh(force=True)
+            if serial_number in self._filter:
+                return True
+        self.rejected += 1
+        return False
+
+    def add(self, serial_numbers):
+        """إضافة سيريالات أُنشئت في هذا العامل فوراً، العمال الآخرون يرونها عند التحديث التالي"""
+        bloom = self._filter
+        if bloom is not None:
+            serial_numbers = list(serial_numbers)
+            with self._lock:
+                bloom.add_many(serial_numbers)
+                self._local.update(serial_numbers)
+
+    def _add_fetched(self, bloom, serial_numbers):
+        """إضافة سيريالات من قاعدة البيانات، عدا ما أُضيف محلياً بـ add"""
+        fresh = [serial_number for serial_number in serial_numbers if serial_number not in self._local]
+        self._local.difference_update(serial_numbers)
+        bloom.add_many(fresh)
+
+    def refresh(self, force=False):
+        """force: تجاهل refresh_interval (عند عدم الوجود، مرة كل miss_refresh_interval)"""
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        needs_rebuild = False
+        try:
+            bloom = self._filter
+            if bloom is None:
+                return
+            from serials.models import SerialKey
+
+            rows = list(
+                SerialKey.objects.filter(id__gt=self._max_id).order_by('id')
+                .values_list('id', 'serial_number')[:self.chunk_size]
+            )
+            if rows:
+                # ids تُحجز قبل الـ commit، فقد يظهر id أصغر بعد id أكبر منه.
+                # الفجوات تُراجع في كل تحديث حتى gap_ttl حتى لا يُرفض سيريال موجود
+                seen = {pk for pk, _ in rows}
+                missing = set(range(self._max_id + 1, rows[-1][0])) - seen
+                if len(missing) <= self.chunk_size:
+                    self._gaps.update(dict.fromkeys(missing, now))
+                self._add_fetched(bloom, [serial_number for _, serial_number in rows])
+                self._max_id = rows[-1][0]
+            if self._gaps:
+                late = list(
+                    SerialKey.objects.filter(id__in=list(self._gaps)).values_list('id', 'serial_number')
+                )
+                self._add_fetched(bloom, [serial_number for _, serial_number in late])
+                for pk, _ in late:
+                    self._gaps.pop(pk, None)
+                self._gaps = {pk: seen_at for pk, seen_at in self._gaps.items() if now - seen_at < self.gap_ttl}
+            needs_rebuild = bloom.count > bloom.capacity or now - self._built_at > self.rebuild_interval
+        except Exception as e:
+            logger.error(f"❌ Serial filter refresh failed: {e}")
+        finally:
+            self._next_refresh = now + self.refresh_interval
+            self._lock.release()
+        if needs_rebuild:
+            self.start()
+
+    def build(self):
+        """بناء فلتر جديد بقراءة متدفقة لكل أرقام السيريال ثم استبدال الحالي"""
+        from serials.models import SerialKey
+
+        started = time.perf_counter()
+        total = SerialKey.objects.count()
+        bloom = BloomFilter(total * self.headroom, self.fp_rate)
+        max_id = 0
+        batch = []
+        recent_ids = deque(maxlen=self.chunk_size)
+        for pk, serial_number in SerialKey.objects.order_by('id').values_list('id', 'serial_number').iterator(
+            chunk_size=self.chunk_size
+        ):
+            batch.append(serial_number)
+            recent_ids.append(pk)
+            max_id = pk
+            if len(batch) >= self.chunk_size:
+                bloom.add_many(batch)
+                batch = []
+        bloom.add_many(batch)
+
+        # فجوات آخر دفعة قد تكون صفوفاً لم تُكمل الـ commit بعد
+        gaps = set(range(recent_ids[0], max_id)) - set(recent_ids) if recent_ids else set()
+        now = time.monotonic()
+        with self._lock:
+            # التحديثات التالية تكمل من آخر id في هذا البناء
+            self._filter = bloom
+            self._max_id = max_id
+            self._gaps = dict.fromkeys(gaps, now)
+            # ما أُضيف محلياً قبل الاستبدال في الفلتر القديم فقط، التحديث يضيفه للجديد
+            self._local = set()
+            self._built_at = now
+        logger.info(
+            f"✅ Serial filter built: {bloom.count} keys, {bloom.nbytes / 1024 / 1024:.1f} MB, "
+            f"k={bloom.hash_count}, {time.perf_counter() - started:.1f}s"
+        )
+        return bloom
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        except Exception as e:
+            logger.error(f"❌ Serial filter build failed: {e}")
+        finally:
+            with self._lock:
+                self._building = False
+            connection.close()
+
+    def stats(self):
+        bloom = self._filter
+        return {
+            'ready': bloom is not None,
+            'keys': bloom.count if bloom else 0,
+            'capacity': bloom.capacity if bloom else 0,
+            'fp_rate': self.fp_rate,
+            'hash_count': bloom.hash_count if bloom else 0,
+            'memory_bytes': bloom.nbytes if bloom else 0,
+            'rejected': self.rejected,
+        }
+
+
+serial_filter = SerialNumberFilter(
+    fp_rate=getattr(settings, 'SERIAL_FILTER_FP_RATE', 0.01),
+    refresh_interval=getattr(settings, 'SERIAL_FILTER_REFRESH_INTERVAL', 1),
+    rebuild_interval=getattr(settings, 'SERIAL_FILTER_REBUILD_INTERVAL', 21600),
+    miss_refresh_interval=getattr(settings, 'SERIAL_FILTER_MISS_REFRESH_INTERVAL', 0.1),
+)
@@ -0,0 +1,169 @@
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Customer, Transaction
+from serials.models import SerialKey
+from .bloom import serial_filter
+from .pin_guard import pin_guard
+
+# حالات كل عنصر في نتيجة الطلب الجماعي
+VALID = 'valid'
+USED_UP = 'used_up'
+ACTIVATED = 'activated'
+ALREADY_ACTIVATED = 'already_activated'
+INVALID = 'invalid'
+LOCKED = 'locked'
+DUPLICATE = 'duplicate'
+
+
+class BulkSerialService:
+    """التحقق من آلاف أزواج (serial_number, pin) وتفعيلها في طلب واحد
+
+    الأزواج تُجلب باستعلام IN على فهرس serial_number ثم يُقارن الـ PIN في الذاكرة.
+    التحقق يعمل بدفعات ويُرجع النتائج تدريجياً، والتفعيل كله داخل معاملة واحدة.
+    النتيجة عنصر لكل زوج بنفس الترتيب، وعدد الأزواج لا يتجاوز max_items.
+    """
+
+    # حد تقريبي لحجم الجسم لكل عنصر (serial_number + pin + JSON)، يُرفض الطلب قبل قراءته
+    ITEM_BYTES = 128
+
+    def __init__(self, max_items=5000, chunk_size=500):
+        self.max_items = max_items
+        self.chunk_size = chunk_size
+
+    def exceeds(self, content_length=0, items=()):
+        return content_length > self.max_items * self.ITEM_BYTES or len(items) > self.max_items
+
+    def prepare(self, pairs, seen=None):
+        """نتيجة أولية لكل زوج: None للأزواج التي ستُبحث، أو حالة نهائية (مكرر/مقفل)"""
+        results = []
+        seen = set() if seen is None else seen
+        for serial_number, _ in pairs:
+            if serial_number in seen:
+                results.append({'serial_number': serial_number, 'status': DUPLICATE})
+                continue
+            seen.add(serial_number)
+            # أقفال الـ PIN guard في الذاكرة، فلا كلفة على قاعدة البيانات هنا
+            if pin_guard.retry_after(serial_number, None):
+                results.append({'serial_number': serial_number, 'status': LOCKED})
+                continue
+            results.append(None)
+        return results
+
+    def lookup(self, pairs, queryset):
+        """{serial_number: SerialKey} للأزواج الصحيحة، وقائمة السيريالات الموجودة بـ PIN خاطئ"""
+        candidates = [serial_number for serial_number, _ in pairs if serial_filter.might_contain(serial_number)]
+        if not candidates:
+            return {}, []
+        found = {serial.serial_number: serial for serial in queryset.filter(serial_number__in=candidates)}
+        matched, wrong_pin = {}, []
+        for serial_number, pin in pairs:
+            serial = found.get(serial_number)
+            if serial is None:
+                continue
+            if serial.check_pin(pin):
+                matched[serial_number] = serial
+            else:
+                wrong_pin.append(serial_number)
+        return matched, wrong_pin
+
+    def verify(self, pairs):
+        """generator بنتيجة لكل زوج، يُبحث كل chunk_size زوج باستعلام واحد"""
+        seen = set()
+        queryset = SerialKey.objects.filter(in_pool=False).select_related('package')
+        for start in range(0, len(pairs), self.chunk_size):
+            chunk = pairs[start:start + self.chunk_size]
+            results = self.prepare(chunk, seen)
+            pending = [pair for pair, result in zip(chunk, results) if result is None]
+            matched, wrong_pin = self.lookup(pending, queryset)
+            self.record_failures(wrong_pin)
+
+            for (serial_number, _), result in zip(chunk, results):
+                if result is not None:
+                    yield result
+                    continue
+                serial = matched.get(serial_number)
+                if serial is None:
+                    yield {'serial_number': serial_number, 'status': INVALID}
+                    continue
+                yield {
+                    'serial_number': serial_number,
+                    'status': USED_UP if serial.is_used_up else VALID,
+                    'package': serial.package.name,
+                    'tokens_remaining': serial.tokens_remaining,
+                }
+
+    def activate(self, pairs, customer, source=None):
+        """تفعيل كل الأزواج الصحيحة غير المفعّلة لحساب customer في معاملة واحدة"""
+        results = self.prepare(pairs)
+        pending = [pair for pair, result in zip(pairs, results) if result is None]
+        now = timezone.now()
+
+        with transaction.atomic():
+            matched, wrong_pin = self.lookup(
+                pending,
+                SerialKey.objects.select_for_update().filter(in_pool=False).only(
+                    'id', 'serial_number', 'pin', 'customer_id', 'tokens_remaining'
+                ),
+            )
+            activated = [serial for serial in matched.values() if serial.customer_id is None]
+            if activated:
+                SerialKey.objects.filter(id__in=[serial.id for serial in activated]).update(
+                    customer=customer, used_at=now
+                )
+                Customer.adjust_balance(customer.pk, sum(serial.tokens_remaining for serial in activated))
+                Transaction.objects.bulk_create([
+                    Transaction(
+                        customer_id=customer.pk, transaction_type=Transaction.SERIAL_ACTIVATION,
+                        amount=serial.tokens_remaining, source=source,
+                        description=f"تفعيل السيريال {serial.serial_number}",
+                    )
+                    for serial in activated
+                ])
+        # خارج المعاملة حتى لا يُلغى تسجيل المحاولات الخاطئة مع أي rollback
+        self.record_failures(wrong_pin)
+
+        activated_ids = {serial.id for serial in activated}
+        for i, (serial_number, _) in enumerate(pairs):
+            if results[i] is not None:
+                continue
+            serial = matched.get(serial_number)
+            if serial is None:
+                results[i] = {'serial_number': serial_number, 'status': INVALID}
+            elif serial.id in activated_ids:
+                results[i] = {
+                    'serial_number': serial_number, 'status': ACTIVATED,
+                    'tokens_remaining': serial.tokens_remaining,
+                }
+            else:
+                results[i] = {'serial_number': serial_number, 'status': ALREADY_ACTIVATED}
+        return results
+
+    @staticmethod
+    def record_failures(serial_numbers):
+        # الطلب موثّق بمفتاح الموزع، فالعدّ لكل سيريال فقط وليس لكل IP
+        for serial_number in serial_numbers:
+            pin_guard.record_failure(serial_number, None)
+
+    def stream(self, results):
+        """NDJSON: سطر لكل عنصر ثم سطر الملخص، كتلة لكل chunk_size سطر فور جاهزيتها"""
+        summary = {'total': 0}
+        chunk = []
+        for index, result in enumerate(results):
+            summary['total'] += 1
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+            chunk.append(json.dumps({'index': index, **result}, ensure_ascii=False))
+            if len(chunk) >= self.chunk_size:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        chunk.append(json.dumps({'summary': summary}, ensure_ascii=False))
+        yield '\n'.join(chunk) + '\n'
+
+
+bulk_serials = BulkSerialService(
+    max_items=getattr(settings, 'SERIAL_BULK_MAX_ITEMS', 5000),
+    chunk_size=getattr(settings, 'SERIAL_BULK_CHUNK_SIZE', 500),
+)
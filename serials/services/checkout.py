@@ -0,0 +1,206 @@
+import hashlib
+import hmac
+import json
+import logging
+import re
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from accounts.models import Customer, Transaction
+from serialcotv.http_client import http_client
+from serials.models import SerialKey, SerialPackage, WebhookEvent
+from .outbox import outbox
+from .pool import serial_pool
+
+logger = logging.getLogger(__name__)
+
+EMAIL_REGEX = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+CHARGILY_TEST_API = "https://pay.chargily.net/test/api/v2"
+CHARGILY_LIVE_API = "https://pay.chargily.net/api/v2"
+
+
+def clean_url(url):
+    if not url:
+        return ''
+    url = url.strip().strip("'\"").strip('[](){}').strip().replace(' ', '')
+    if not url.startswith(('http://', 'https://')):
+        return ''
+    return url
+
+
+def extract_email_from_payload(data, raw_body_str=""):
+    email_keys = ['email', 'customer_email', 'client_email', 'payer_email', 'user_email']
+    def _recursive_search(value):
+        if not value:
+            return None
+        if isinstance(value, dict):
+            for key in email_keys:
+                if key in value:
+                    val = value[key]
+                    if isinstance(val, str) and '@' in val:
+                        return val.strip()
+            for v in value.values():
+                result = _recursive_search(v)
+                if result:
+                    return result
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                result = _recursive_search(item)
+                if result:
+                    return result
+        elif isinstance(value, str):
+            match = EMAIL_REGEX.search(value)
+            if match:
+                return match.group(0)
+        return None
+    email = _recursive_search(data)
+    if email:
+        return email
+    if raw_body_str:
+        match = EMAIL_REGEX.search(raw_body_str)
+        if match:
+            return match.group(0)
+    return None
+
+
+def get_chargily_customer_email(customer_id, mode, api_secret_key):
+    try:
+        api_base = CHARGILY_TEST_API if mode == 'test' else CHARGILY_LIVE_API
+        headers = {"Authorization": f"Bearer {api_secret_key}"}
+        response = http_client.upstream('chargily').get(f"{api_base}/customers/{customer_id}", headers=headers)
+        if response.status_code == 200:
+            return response.json().get('email')
+    except:
+        pass
+    return None
+
+
+def parse_metadata(metadata):
+    if isinstance(metadata, dict):
+        return metadata
+    elif isinstance(metadata, str):
+        try:
+            return json.loads(metadata)
+        except:
+            pass
+    return {}
+
+
+class CheckoutError(Exception):
+    """دفعة لا يمكن تنفيذها (لا توجد باقة مثلاً)، يعيد الـ outbox المحاولة ثم ينقلها إلى dead"""
+
+
+def webhook_secrets():
+    """(سر توقيع الـ webhook، مفتاح Chargily API)"""
+    webhook_secret = getattr(settings, 'CHARGILY_APP_SECRET', '') or getattr(settings, 'CHARGILY_SECRET_KEY', '')
+    api_secret_key = getattr(settings, 'CHARGILY_SECRET_KEY', '') or webhook_secret
+    return webhook_secret, api_secret_key
+
+
+def valid_signature(body, signature, secret):
+    secret_bytes = secret.encode() if isinstance(secret, str) else secret
+    computed = hmac.new(secret_bytes, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(computed, signature)
+
+
+def fulfil_checkout(checkout_data, raw_body=''):
+    """تنفيذ دفعة checkout.paid: سيريال، رصيد العميل، ورسائل البريد والـ Sheet في معاملة واحدة
+
+    ترجع السيريال (مع raw_pin)، أو None إذا كانت الدفعة منفذة سابقاً (payment_id فريد).
+    """
+    checkout_id = checkout_data.get('id')
+    client_email = extract_email_from_payload(checkout_data, raw_body)
+
+    chargily_customer_id = checkout_data.get('customer_id')
+    if not client_email and chargily_customer_id:
+        mode = checkout_data.get('account', {}).get('mode', 'test')
+        client_email = get_chargily_customer_email(chargily_customer_id, mode, webhook_secrets()[1])
+
+    metadata = parse_metadata(checkout_data.get('metadata', {}))
+    client_name = metadata.get('name', '') or 'عميل'
+
+    package = None
+    if metadata.get('package_id'):
+        package = SerialPackage.objects.filter(id=metadata['package_id']).first()
+    if not package and metadata.get('package_name'):
+        package = SerialPackage.objects.filter(name=metadata['package_name']).first()
+    if not package:
+        package = SerialPackage.objects.filter(is_active=True).first()
+    if not package:
+        raise CheckoutError('No package')
+
+    customer_instance = None
+    customer_id = metadata.get('user_id') or metadata.get('customer_id')
+    if customer_id:
+        try:
+            customer_instance = Customer.objects.get(id=customer_id, is_active=True)
+        except:
+            pass
+    if not customer_instance and client_email:
+        customer_instance = Customer.objects.filter(email__iexact=client_email, is_active=True).first()
+
+    try:
+        with transaction.atomic():
+            create_kwargs = {'customer': customer_instance}
+            if customer_instance:
+                create_kwargs['used_at'] = timezone.now()
+            if checkout_id:
+                create_kwargs['payment_id'] = checkout_id
+            # سحب سيريال جاهز من المخزون، والتوليد داخل الطلب فقط إذا كان المخزون فارغاً
+            serial = serial_pool.claim(package, **create_kwargs)
+            if serial is None:
+                serial = SerialKey.objects.create(package=package, is_active=True, **create_kwargs)
+
+            if customer_instance:
+                Customer.adjust_balance(customer_instance.pk, package.tokens_limit)
+                Transaction.record(
+                    customer_instance.pk, package.tokens_limit, Transaction.PURCHASE,
+                    f"شراء باقة {package.name} ({checkout_id})"
+                )
+
+            # البريد والـ Sheet يُنفذان من run_outbox_worker، ويُكتبان هنا حتى لا يضيعا إذا توقف العامل
+            post_purchase = {
+                'client_email': client_email,
+                'client_name': client_name,
+                'package_id': package.id,
+                'serial_id': serial.id,
+                'pin': serial.raw_pin,
+                'customer_id': customer_instance.id if customer_instance else None,
+            }
+            if client_email:
+                outbox.enqueue('purchase.email', post_purchase)
+            sheet_url = clean_url(getattr(settings, 'GOOGLE_SHEET_URL', ''))
+            if sheet_url:
+                outbox.enqueue('purchase.sheet', {**post_purchase, 'sheet_url': sheet_url})
+    except IntegrityError:
+        return None
+    return serial
+
+
+def store_webhook(checkout_id, body):
+    """وضع الرد السريع: حفظ الجسم الخام ورسالة outbox لمعالجته، ترجع False لإعادة إرسال مكررة"""
+    try:
+        with transaction.atomic():
+            event = WebhookEvent.objects.create(checkout_id=checkout_id, body=body.decode('utf-8', errors='replace'))
+            outbox.enqueue('chargily.checkout', {'event_id': event.pk})
+    except IntegrityError:
+        return False
+    return True
+
+
+def process_webhook_event(payload):
+    """معالج الـ outbox لـ WebhookEvent محفوظ، آمن للتكرار"""
+    event = WebhookEvent.objects.get(pk=payload['event_id'])
+    if event.processed_at:
+        return
+    checkout_data = json.loads(event.body).get('data', {})
+    serial = fulfil_checkout(checkout_data, event.body)
+    if serial is None:
+        # منفذة سابقاً (مثلاً عبر المسار المتزامن قبل تفعيل الوضع السريع)
+        serial = SerialKey.objects.filter(payment_id=event.checkout_id).first()
+    event.serial = serial
+    event.processed_at = timezone.now()
+    event.save(update_fields=['serial', 'processed_at'])
+    logger.info(f"✅ Chargily checkout {event.checkout_id} processed")
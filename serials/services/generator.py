@@ -0,0 +1,114 @@
+import secrets
+import time
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from serials.models import SerialKey
+from . import pins
+from .bloom import serial_filter
+
+# كل بايت عشوائي يُحوَّل إلى حرف من SERIAL_CHARS، والبايتات فوق أكبر مضاعف
+# لطول الأبجدية تُرمى حتى يبقى التوزيع منتظماً (بدون modulo bias)
+_ALPHABET = SerialKey.SERIAL_CHARS.encode()
+_LIMIT = 256 - 256 % len(_ALPHABET)
+_TABLE = bytes(_ALPHABET[b % len(_ALPHABET)] for b in range(256))
+_REJECTED = bytes(range(_LIMIT, 256))
+
+INSERT_COLUMNS = (
+    'serial_number', 'pin', 'package_id', 'tokens_total', 'tokens_used',
+    'tokens_remaining', 'is_active', 'is_used_up', 'in_pool', 'created_at',
+)
+
+
+def generate_codes(count):
+    """count كود سيريال من secrets، أسرع بكثير من secrets.choice حرفاً بحرف"""
+    length = SerialKey.SERIAL_CODE_LENGTH
+    needed = count * length
+    chars = b''
+    while len(chars) < needed:
+        chars += secrets.token_bytes(needed - len(chars) + 64).translate(_TABLE, _REJECTED)
+    text = chars[:needed].decode()
+    prefix = SerialKey.SERIAL_PREFIX
+    return [prefix + text[i:i + length] for i in range(0, needed, length)]
+
+
+class SerialGenerator:
+    """توليد سيريالات بالجملة لباقة: أكواد فريدة من secrets وإدخال على دفعات
+
+    pooled=True يولّد سيريالات مخزون (in_pool، غير مفعّلة) تُسحب لاحقاً عبر serial_pool،
+    ويُعاد تعيين الـ PIN عند السحب. غير ذلك تُمرر أزواج (serial, pin) الفعلية لكل دفعة
+    إلى on_batch، لأنها لا تُخزن إلا كـ HMAC.
+    """
+
+    def __init__(self, package, batch_size=5000, progress=None, pooled=False, on_batch=None):
+        self.package = package
+        self.pooled = pooled
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.progress = progress
+        self.created = 0
+        self.collisions = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return self.created / self.elapsed if self.elapsed else 0.0
+
+    def run(self, count):
+        started = time.perf_counter()
+        while self.created < count:
+            codes = self.fresh_codes(min(self.batch_size, count - self.created))
+            try:
+                issued = self.insert(codes)
+            except IntegrityError:
+                # سباق مع مُولّد آخر على نفس الكود، نعيد الدفعة بأكواد جديدة
+                self.collisions += 1
+                continue
+            if self.on_batch and not self.pooled:
+                self.on_batch(issued)
+            self.created += len(codes)
+            self.elapsed = time.perf_counter() - started
+            if self.progress:
+                self.progress(self)
+        self.elapsed = time.perf_counter() - started
+        return self.created
+
+    def fresh_codes(self, count):
+        """أكواد غير مكررة داخل الدفعة وغير موجودة في قاعدة البيانات"""
+        codes = set()
+        while len(codes) < count:
+            codes.update(generate_codes(count - len(codes)))
+            existing = set(
+                SerialKey.objects.filter(serial_number__in=codes).values_list('serial_number', flat=True)
+            )
+            self.collisions += len(existing)
+            codes -= existing
+        return list(codes)
+
+    def insert(self, codes):
+        """إدخال الدفعة بـ COPY على Postgres و executemany على غيره، بدون بناء كائنات ORM
+
+        ترجع أزواج (serial, pin) الفعلية للدفعة.
+        """
+        tokens = self.package.tokens_limit
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        key = pins.pin_key()
+        issued = [(code, SerialKey.generate_pin()) for code in codes]
+        rows = [
+            (code, pins.hash_pin(code, pin, key), self.package.pk, tokens, 0, tokens,
+             not self.pooled, False, self.pooled, now)
+            for code, pin in issued
+        ]
+        table = connection.ops.quote_name(SerialKey._meta.db_table)
+        columns = ', '.join(INSERT_COLUMNS)
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                with cursor.cursor.copy(f'COPY {table} ({columns}) FROM STDIN') as copy:
+                    for row in rows:
+                        copy.write_row(row)
+            else:
+                placeholders = ', '.join(['%s'] * len(INSERT_COLUMNS))
+                cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', rows)
+        serial_filter.add(codes)
+        return issued
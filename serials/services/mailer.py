@@ -0,0 +1,125 @@
+import logging
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+# أخطاء تعني أن الاتصال نفسه انقطع، فنعيد فتحه ونرسل الرسالة مرة أخرى.
+# رفض المستلم أو المحتوى خاص بالرسالة ولا يفيد معه إعادة الاتصال.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+class RateLimiter:
+    """token bucket: rate رسالة في الثانية مع دفعة أولى حتى burst (rate=0 يعطله)"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class EmailDispatcher:
+    """إرسال البريد عبر اتصال SMTP واحد مفتوح لكل عامل
+
+    send_mail يفتح اتصالاً جديداً (TCP + STARTTLS + AUTH) لكل رسالة، وهذا أغلب زمن
+    الإرسال. هنا يبقى الاتصال مفتوحاً بين الدفعات ويُغلق بعد idle_timeout ثانية من
+    الخمول (المزود يقطع الاتصالات الخاملة). كل رسالة تُرسل بـ send_messages على نفس
+    الاتصال حتى يبقى الفشل خاصاً بها، وعند انقطاع الاتصال يُعاد فتحه مرة واحدة.
+    """
+
+    def __init__(self, rate=10, idle_timeout=30, backend=None):
+        self.limiter = RateLimiter(rate)
+        self.idle_timeout = idle_timeout
+        self.backend = backend
+        self._connection = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self.sent = self.failed = self.reconnects = 0
+
+    def send_messages(self, messages):
+        """إرسال EmailMessage[]، ترجع لكل رسالة None عند النجاح أو الاستثناء"""
+        results = []
+        with self._lock:
+            for message in messages:
+                self.limiter.acquire()
+                error = self._send(message)
+                self._last_used = time.monotonic()
+                if error is None:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                    logger.warning(f"⚠️ Email to {message.to} failed: {error}")
+                results.append(error)
+        return results
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def stats(self):
+        return {
+            'connected': self._connection is not None,
+            'sent': self.sent,
+            'failed': self.failed,
+            'reconnects': self.reconnects,
+            'rate': self.limiter.rate,
+        }
+
+    def _send(self, message):
+        for attempt in (1, 2):
+            try:
+                connection = self._open()
+                if connection.send_messages([message]) != 1:
+                    return smtplib.SMTPException('message was not sent')
+                return None
+            except CONNECTION_ERRORS as e:
+                self._close()
+                if attempt == 2:
+                    return e
+                self.reconnects += 1
+                logger.info(f"🔄 SMTP connection lost, reconnecting: {e}")
+            except Exception as e:
+                return e
+
+    def _open(self):
+        if self._connection is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self._close()
+        if self._connection is None:
+            connection = get_connection(self.backend, fail_silently=False)
+            connection.open()
+            self._connection = connection
+            self._last_used = time.monotonic()
+        return self._connection
+
+    def _close(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+
+
+email_dispatcher = EmailDispatcher(
+    rate=getattr(settings, 'EMAIL_RATE_LIMIT', 10),
+    idle_timeout=getattr(settings, 'EMAIL_IDLE_TIMEOUT', 30),
+)
@@ -0,0 +1,206 @@
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from serials.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# الموضوع -> المعالج (يستقبل payload ويرفع استثناء عند الفشل)
+HANDLERS = {
+    'purchase.email': 'serials.services.post_purchase.send_purchase_email',
+    'chargily.checkout': 'serials.services.checkout.process_webhook_event',
+}
+
+# مواضيع تُنفذ دفعة واحدة: المعالج يستقبل payload[] ويرجع لكل منها None أو استثناء
+# (البريد يُرسل عبر اتصال SMTP واحد بدل اتصال لكل رسالة)
+BATCH_HANDLERS = {
+    'purchase.email': 'serials.services.post_purchase.send_purchase_emails',
+}
+
+# مواضيع لها مُصدّر خاص يرسلها بالترتيب (claim العام لا يحجزها، run_outbox_worker يستدعي flush)
+EXPORTERS = {
+    'purchase.sheet': 'serials.services.sheets.sheet_exporter',
+}
+
+# مفاتيح تُحذف من payload عند النجاح أو الانتقال إلى dead (الـ PIN لا يُخزن نصاً في أي مكان آخر)
+SENSITIVE_KEYS = ('pin',)
+# مواضيع لا يمكن تنفيذها بعد حذف SENSITIVE_KEYS، فلا تُعاد من dead
+NEEDS_SENSITIVE = ('purchase.email', 'purchase.sheet')
+
+
+def scrub(payload):
+    return {key: value for key, value in payload.items() if key not in SENSITIVE_KEYS}
+
+
+class Outbox:
+    """طابور مهام في قاعدة البيانات: الكتابة داخل معاملة الطلب، والتنفيذ في run_outbox_worker
+
+    العامل يحجز الرسائل بـ SKIP LOCKED ويضع مهلة (lease)، فإذا توقف أثناء المعالجة
+    تعود الرسالة متاحة بعد انتهاء المهلة. الفشل يؤجل المحاولة التالية بتأخير يتضاعف،
+    وبعد max_attempts تنتقل الرسالة إلى حالة dead للمراجعة اليدوية.
+
+    complete و fail تكتبان فقط إذا كان العامل ما زال يملك الحجز (نفس attempts و available_at
+    من claim)، فالعامل الذي تجاوز مهلته لا يكتب فوق نتيجة عامل استعاد الرسالة بعده.
+    """
+
+    def __init__(self, max_attempts=8, base_delay=30, max_delay=3600, lease=300):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+
+    def enqueue(self, topic, payload, delay=0):
+        """إضافة رسالة، يجب استدعاؤها داخل نفس المعاملة التي أنشأت البيانات"""
+        if topic not in HANDLERS and topic not in EXPORTERS:
+            raise ValueError(f"Unknown outbox topic: {topic}")
+        return OutboxMessage.objects.create(
+            topic=topic, payload=payload, available_at=timezone.now() + timedelta(seconds=delay)
+        )
+
+    def claim(self, limit):
+        """حجز حتى limit رسالة مستحقة، الطلبات المتزامنة تأخذ صفوفاً مختلفة"""
+        now = timezone.now()
+        with transaction.atomic():
+            messages = list(
+                OutboxMessage.objects.select_for_update(skip_locked=True)
+                .filter(status__in=[OutboxMessage.PENDING, OutboxMessage.PROCESSING], available_at__lte=now)
+                .exclude(topic__in=EXPORTERS)
+                .order_by('available_at', 'id')[:limit]
+            )
+            if not messages:
+                return []
+            lease_until = now + timedelta(seconds=self.lease)
+            for message in messages:
+                message.status = OutboxMessage.PROCESSING
+                message.attempts += 1
+                message.available_at = lease_until
+            OutboxMessage.objects.bulk_update(messages, ['status', 'attempts', 'available_at'])
+        return messages
+
+    def process(self, message):
+        """تنفيذ رسالة محجوزة، ترجع True عند النجاح"""
+        try:
+            import_string(HANDLERS[message.topic])(message.payload)
+        except Exception as e:
+            self.fail(message, e)
+            return False
+        return self.complete(message)
+
+    def process_batch(self, messages):
+        """تنفيذ رسائل محجوزة من نفس الموضوع دفعة واحدة، ترجع عدد الناجحة"""
+        handler = BATCH_HANDLERS.get(messages[0].topic)
+        if handler is None:
+            return sum(self.process(message) for message in messages)
+        try:
+            results = import_string(handler)([message.payload for message in messages])
+        except Exception as e:
+            results = [e] * len(messages)
+        completed = 0
+        for message, error in zip(messages, results):
+            if error is None:
+                completed += self.complete(message)
+            else:
+                self.fail(message, error)
+        return completed
+
+    def owned(self, message):
+        """الرسالة ما دام حجز هذا العامل قائماً: claim يغير attempts و available_at عند كل حجز"""
+        return OutboxMessage.objects.filter(
+            pk=message.pk, status=OutboxMessage.PROCESSING,
+            attempts=message.attempts, available_at=message.available_at,
+        )
+
+    def lost(self, message):
+        logger.warning(f"⚠️ Outbox {message} lease lost (attempt {message.attempts}), result discarded")
+        return False
+
+    def complete(self, message):
+        """تعليم الرسالة منفذة، ترجع False إذا فقد العامل الحجز"""
+        updated = self.owned(message).update(
+            status=OutboxMessage.DONE, payload=scrub(message.payload), processed_at=timezone.now(), last_error=''
+        )
+        return bool(updated) or self.lost(message)
+
+    def fail(self, message, error):
+        """تأجيل المحاولة التالية أو النقل إلى dead، ترجع False إذا فقد العامل الحجز"""
+        if message.attempts >= self.max_attempts:
+            updated = self.owned(message).update(
+                status=OutboxMessage.DEAD, payload=scrub(message.payload),
+                processed_at=timezone.now(), last_error=str(error)[:2000],
+            )
+            if not updated:
+                return self.lost(message)
+            logger.error(f"❌ Outbox {message} dead after {message.attempts} attempts: {error}")
+            return True
+        delay = self.backoff(message.attempts)
+        updated = self.owned(message).update(
+            status=OutboxMessage.PENDING,
+            available_at=timezone.now() + timedelta(seconds=delay),
+            last_error=str(error)[:2000],
+        )
+        if not updated:
+            return self.lost(message)
+        logger.warning(f"⚠️ Outbox {message} failed (attempt {message.attempts}), retry in {delay:.0f}s: {error}")
+        return True
+
+    def backoff(self, attempts):
+        delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+        # تفاوت عشوائي حتى لا تعود الرسائل الفاشلة معاً في نفس اللحظة
+        return delay * random.uniform(0.8, 1.2)
+
+    def retry_dead(self, ids=None):
+        """إعادة رسائل dead إلى الطابور (بعد إصلاح السبب)
+
+        رسائل NEEDS_SENSITIVE التي حُذف منها الـ PIN لا تُعاد، فلا يمكن تنفيذها بعد الآن.
+        """
+        qs = OutboxMessage.objects.filter(status=OutboxMessage.DEAD)
+        for key in SENSITIVE_KEYS:
+            qs = qs.filter(~Q(topic__in=NEEDS_SENSITIVE) | Q(payload__has_key=key))
+        if ids is not None:
+            qs = qs.filter(pk__in=ids)
+        return qs.update(status=OutboxMessage.PENDING, attempts=0, available_at=timezone.now(), processed_at=None)
+
+    def purge(self, days, dead_days=0):
+        """حذف الرسائل المنفذة الأقدم من days يوماً، والـ dead الأقدم من dead_days (0 لتعطيل أيهما)"""
+        now = timezone.now()
+        query = Q()
+        for status, age in ((OutboxMessage.DONE, days), (OutboxMessage.DEAD, dead_days)):
+            if age:
+                query |= Q(status=status, processed_at__lt=now - timedelta(days=age))
+        if not query:
+            return 0
+        deleted, _ = OutboxMessage.objects.filter(query).delete()
+        return deleted
+
+    def stats(self):
+        """عمق الطابور لكل حالة وتأخر أقدم رسالة لم تُنفذ (lag)"""
+        now = timezone.now()
+        counts = dict(OutboxMessage.objects.order_by().values_list('status').annotate(n=Count('id')))
+        open_messages = OutboxMessage.objects.filter(status__in=[OutboxMessage.PENDING, OutboxMessage.PROCESSING])
+        oldest = open_messages.aggregate(oldest=Min('created_at'))['oldest']
+        due = open_messages.filter(available_at__lte=now).count()
+        by_topic = dict(open_messages.order_by().values_list('topic').annotate(n=Count('id')))
+        return {
+            'pending': counts.get(OutboxMessage.PENDING, 0),
+            'processing': counts.get(OutboxMessage.PROCESSING, 0),
+            'done': counts.get(OutboxMessage.DONE, 0),
+            'dead': counts.get(OutboxMessage.DEAD, 0),
+            'due': due,
+            'lag_seconds': (now - oldest).total_seconds() if oldest else 0,
+            'open_by_topic': by_topic,
+        }
+
+
+outbox = Outbox(
+    max_attempts=getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8),
+    base_delay=getattr(settings, 'OUTBOX_BASE_DELAY', 30),
+    max_delay=getattr(settings, 'OUTBOX_MAX_DELAY', 3600),
+    lease=getattr(settings, 'OUTBOX_LEASE', 300),
+)
@@ -0,0 +1,264 @@
+import logging
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(value):
+    """بداية الشهر بالتوقيت المحلي، حتى يقع كل يوم في تقارير الـ rollup داخل partition واحد"""
+    value = timezone.localtime(value)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    naive = datetime(index // 12, index % 12 + 1, 1)
+    return timezone.make_aware(naive, timezone.get_current_timezone())
+
+
+class MonthlyPartitions:
+    """جدول مقسّم شهرياً على Postgres (PARTITION BY RANGE على عمود التاريخ)
+
+    كل شهر partition باسم <table>_pYYYY_MM، وpartition افتراضي <table>_default يلتقط أي صف
+    خارج الأشهر المنشأة حتى لا تفشل الكتابة إذا تأخرت الصيانة. على قواعد أخرى لا شيء هنا يعمل.
+    """
+
+    def __init__(self, table, column='created_at'):
+        self.table = table
+        self.column = column
+
+    @property
+    def supported(self):
+        return connection.vendor == 'postgresql'
+
+    def partition_name(self, month):
+        return f'{self.table}_p{month.year:04d}_{month.month:02d}'
+
+    @property
+    def default_name(self):
+        return f'{self.table}_default'
+
+    @property
+    def legacy_name(self):
+        return f'{self.table}_legacy'
+
+    @property
+    def parted_name(self):
+        """اسم الجدول المقسّم أثناء التحويل، قبل أن يأخذ اسم الجدول"""
+        return f'{self.table}_parted'
+
+    def relkind(self, name=None):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass(%s)", [name or self.table]
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def is_partitioned(self):
+        return self.supported and self.relkind() == 'p'
+
+    def converting(self):
+        """convert بدأ ولم ينتهِ: الجدول view فوق الجدول المقسّم والقديم"""
+        return self.supported and self.relkind() == 'v'
+
+    def partitions(self, parent=None):
+        """[(اسم الـ partition، بداية الشهر)] للأشهر المرفقة حالياً، مرتبة"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname",
+                [parent or self.table],
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        prefix = f'{self.table}_p'
+        result = []
+        for name in names:
+            if not name.startswith(prefix):
+                continue
+            year, month = name[len(prefix):].split('_')
+            result.append((name, add_months(datetime(int(year), int(month), 1), 0)))
+        return result
+
+    def bounds_sql(self, month):
+        start, end = month, add_months(month, 1)
+        return f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+
+    def ensure(self, start, end, parent=None):
+        """إنشاء partitions للأشهر من start حتى end (شاملة)، ترجع أسماء المنشأة
+
+        أي صفوف لنفس الشهر وقعت في الـ partition الافتراضي تُنقل إلى الجديد قبل إرفاقه.
+        parent: الجدول المقسّم إذا لم يكن self.table (أثناء convert).
+        """
+        qn = connection.ops.quote_name
+        parent = parent or self.table
+        existing = {name for name, _ in self.partitions(parent)}
+        created = []
+        month = month_start(start)
+        last = month_start(end)
+        while month <= last:
+            name = self.partition_name(month)
+            if name not in existing:
+                lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(
+                        f'CREATE TABLE {qn(name)} (LIKE {qn(parent)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                    )
+                    cursor.execute(
+                        f'WITH moved AS (DELETE FROM {qn(self.default_name)} '
+                        f'WHERE {qn(self.column)} >= %s AND {qn(self.column)} < %s RETURNING *) '
+                        f'INSERT INTO {qn(name)} SELECT * FROM moved',
+                        [lower, upper],
+                    )
+                    cursor.execute(
+                        f'ALTER TABLE {qn(parent)} ATTACH PARTITION {qn(name)} FOR VALUES {self.bounds_sql(month)}'
+                    )
+                created.append(name)
+                logger.info(f"✅ Partition {name} created")
+            month = add_months(month, 1)
+        return created
+
+    def detach_before(self, month):
+        """فصل partitions الأشهر السابقة لـ month، تبقى كجداول مستقلة (أرشيف) ولا تُحذف"""
+        qn = connection.ops.quote_name
+        detached = []
+        for name, start in self.partitions():
+            if start >= month:
+                break
+            with connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {qn(self.table)} DETACH PARTITION {qn(name)}')
+            detached.append(name)
+            logger.info(f"✅ Partition {name} detached")
+        return detached
+
+    def convert(self, months_ahead=3, batch_size=10000):
+        """تحويل الجدول العادي إلى جدول مقسّم مع نقل البيانات، يُستدعى من migration غير ذرية
+
+        1. معاملة قصيرة: الجدول القديم يصبح <table>_legacy، ويُنشأ الجدول المقسّم <table>_parted
+           (فارغاً) بفهارسه ومفاتيحه، ويأخذ اسم الجدول view يجمعهما (UNION ALL) مع triggers
+           توجّه الكتابة إلى الجدول المقسّم. القراءة ترى كل الصفوف طوال النقل.
+        2. نقل الصفوف القديمة بدفعات من batch_size صف، كل دفعة في معاملة مستقلة.
+        3. معاملة قصيرة: حذف الـ view والجدول القديم، والجدول المقسّم يأخذ اسم الجدول.
+
+        إذا توقف التحويل في المنتصف، استدعاء convert مجدداً يكمله من حيث توقف.
+
+        المفتاح الأساسي يصبح (id, column) لأن Postgres يشترط أن يتضمن عمود التقسيم،
+        والـ id يبقى فريداً عبر sequence واحد. الفهارس والمفاتيح الأجنبية تُعاد بنفس أسمائها.
+        """
+        if not self.supported:
+            return False
+        kind = self.relkind()
+        if kind == 'p':
+            return False
+        if kind != 'v':
+            self._swap(months_ahead)
+        moved = self._copy_legacy(batch_size)
+        self._finish()
+        logger.info(f"✅ {self.table} converted to monthly partitions ({moved} rows moved)")
+        return True
+
+    def _swap(self, months_ahead):
+        qn = connection.ops.quote_name
+        legacy, parted = self.legacy_name, self.parted_name
+        with transaction.atomic(), connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, self.table)
+            cursor.execute(f'SELECT MIN({qn(self.column)}), MAX(id) FROM {qn(self.table)}')
+            oldest, max_id = cursor.fetchone()
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [self.table, 'id'])
+            legacy_sequence = cursor.fetchone()[0]
+            cursor.execute(f'ALTER TABLE {qn(self.table)} RENAME TO {qn(legacy)}')
+            if legacy_sequence:
+                cursor.execute(f'ALTER SEQUENCE {legacy_sequence} RENAME TO {qn(legacy + "_id_seq")}')
+            # أسماء الفهارس فريدة على مستوى الـ schema: نحررها للجدول الجديد، والجدول القديم
+            # يحتفظ بفهارسه بأسماء أخرى لأن القراءة عبر الـ view تستعملها حتى نهاية النقل
+            for name, info in constraints.items():
+                if info['primary_key']:
+                    cursor.execute(f'ALTER INDEX {qn(name)} RENAME TO {qn(legacy + "_pkey")}')
+                elif info['index'] and not info['unique']:
+                    cursor.execute(f'ALTER INDEX {qn(name)} RENAME TO {qn(name[:56] + "_legacy")}')
+
+            cursor.execute(
+                f'CREATE TABLE {qn(parted)} (LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                f'PARTITION BY RANGE ({qn(self.column)})'
+            )
+            sequence = f'{self.table}_id_seq'
+            cursor.execute(f'CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(parted)}.id')
+            cursor.execute('SELECT setval(%s, %s)', [sequence, max_id or 1])
+            cursor.execute(f"ALTER TABLE {qn(parted)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+            cursor.execute(
+                f'ALTER TABLE {qn(parted)} ADD CONSTRAINT {qn(self.table + "_pkey")} '
+                f'PRIMARY KEY (id, {qn(self.column)})'
+            )
+            for name, info in constraints.items():
+                columns = ', '.join(qn(column) for column in info['columns'])
+                if info['foreign_key']:
+                    to_table, to_column = info['foreign_key']
+                    cursor.execute(
+                        f'ALTER TABLE {qn(parted)} ADD CONSTRAINT {qn(name)} FOREIGN KEY ({columns}) '
+                        f'REFERENCES {qn(to_table)} ({qn(to_column)}) DEFERRABLE INITIALLY DEFERRED'
+                    )
+                elif info['index'] and not info['primary_key'] and not info['unique']:
+                    orders = info.get('orders') or []
+                    columns = ', '.join(
+                        f'{qn(column)} {order}' for column, order in zip(info['columns'], orders)
+                    ) if orders else columns
+                    cursor.execute(f'CREATE INDEX {qn(name)} ON {qn(parted)} ({columns})')
+            cursor.execute(f'CREATE TABLE {qn(self.default_name)} PARTITION OF {qn(parted)} DEFAULT')
+
+            # الـ view يأخذ اسم الجدول: الإدراج يذهب للجدول المقسّم (id من نفس الـ sequence)،
+            # والتعديل والحذف يطبقان على الجدولين (الصف المعدّل ينتقل إلى المقسّم)
+            function = qn(f'{self.table}_convert_write')
+            cursor.execute(
+                f'CREATE VIEW {qn(self.table)} AS '
+                f'SELECT * FROM {qn(parted)} UNION ALL SELECT * FROM {qn(legacy)}'
+            )
+            cursor.execute(f"ALTER VIEW {qn(self.table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+            cursor.execute(
+                f'CREATE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+                f"IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+                f'DELETE FROM {qn(parted)} WHERE id = OLD.id; DELETE FROM {qn(legacy)} WHERE id = OLD.id; '
+                f'END IF; '
+                f"IF TG_OP = 'DELETE' THEN RETURN OLD; END IF; "
+                f'INSERT INTO {qn(parted)} VALUES (NEW.*); RETURN NEW; END $$'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER {function} INSTEAD OF INSERT OR UPDATE OR DELETE ON {qn(self.table)} '
+                f'FOR EACH ROW EXECUTE FUNCTION {function}()'
+            )
+
+        now = timezone.now()
+        self.ensure(oldest or now, add_months(month_start(now), months_ahead), parent=parted)
+
+    def _copy_legacy(self, batch_size):
+        """نقل الصفوف من الجدول القديم إلى المقسّم بدفعات (DELETE ... RETURNING)"""
+        qn = connection.ops.quote_name
+        legacy = qn(self.legacy_name)
+        moved = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f'WITH moved AS (DELETE FROM {legacy} WHERE id IN '
+                    f'(SELECT id FROM {legacy} ORDER BY id LIMIT %s) RETURNING *) '
+                    f'INSERT INTO {qn(self.parted_name)} SELECT * FROM moved',
+                    [batch_size],
+                )
+                count = cursor.rowcount
+            moved += count
+            if count < batch_size:
+                break
+            logger.info(f"🔄 {self.table}: {moved} rows moved")
+        return moved
+
+    def _finish(self):
+        qn = connection.ops.quote_name
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DROP VIEW {qn(self.table)}')
+            cursor.execute(f'DROP FUNCTION {qn(self.table + "_convert_write")}()')
+            cursor.execute(f'DROP TABLE {qn(self.legacy_name)}')
+            cursor.execute(f'ALTER TABLE {qn(self.parted_name)} RENAME TO {qn(self.table)}')
+
+
+usage_partitions = MonthlyPartitions('serials_serialusage')
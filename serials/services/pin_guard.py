@@ -0,0 +1,221 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .bloom import serial_filter
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseAttemptStore:
+    """العدادات في جدول PinAttempt، كل تحديث يتم على صف مقفل داخل معاملة"""
+
+    def record_failure(self, key, apply_failure):
+        from serials.models import PinAttempt
+
+        with transaction.atomic():
+            PinAttempt.objects.get_or_create(key=key, defaults={'window_start': timezone.now()})
+            attempt = PinAttempt.objects.select_for_update().get(key=key)
+            apply_failure(attempt)
+            attempt.save()
+        return attempt.locked_until
+
+    def active_locks(self, now):
+        from serials.models import PinAttempt
+
+        return dict(PinAttempt.objects.filter(locked_until__gt=now).values_list('key', 'locked_until'))
+
+    def purge(self, before, now):
+        from serials.models import PinAttempt
+
+        deleted, _ = PinAttempt.objects.filter(updated_at__lt=before).exclude(locked_until__gt=now).delete()
+        return deleted
+
+
+class LocalMemoryAttemptStore:
+    """العدادات داخل العملية فقط (تطوير، اختبارات، أو عامل واحد)"""
+
+    def __init__(self):
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def record_failure(self, key, apply_failure):
+        from serials.models import PinAttempt
+
+        with self._lock:
+            attempt = self._attempts.get(key)
+            if attempt is None:
+                attempt = self._attempts[key] = PinAttempt(key=key, window_start=timezone.now())
+            apply_failure(attempt)
+            return attempt.locked_until
+
+    def purge(self, before, now):
+        with self._lock:
+            stale = [
+                key for key, attempt in self._attempts.items()
+                if attempt.window_start < before and not (attempt.locked_until and attempt.locked_until > now)
+            ]
+            for key in stale:
+                del self._attempts[key]
+        return len(stale)
+
+    def active_locks(self, now):
+        with self._lock:
+            return {
+                key: attempt.locked_until for key, attempt in self._attempts.items()
+                if attempt.locked_until and attempt.locked_until > now
+            }
+
+
+class PinGuard:
+    """حد لمحاولات PIN الفاشلة لكل سيريال ولكل IP: نافذة منزلقة ثم قفل يتضاعف
+
+    الأقفال النشطة محفوظة في ذاكرة العامل وتُحدّث من الـ store كل refresh_interval،
+    فرفض سيريال مقفل لا يلمس قاعدة البيانات. القفل الذي يسجله عامل آخر يظهر هنا
+    خلال refresh_interval على الأكثر. العدادات الخاملة أطول من max_lockout (ونافذتين
+    على الأقل) تُحذف كل purge_interval، فيبدأ تضاعف القفل من جديد بعدها.
+    """
+
+    def __init__(self, store, max_failures=5, ip_max_failures=20, window=900,
+                 lockout=60, max_lockout=86400, refresh_interval=5, purge_interval=3600):
+        self.store = store
+        self.max_failures = max_failures
+        self.ip_max_failures = ip_max_failures
+        self.window = window
+        self.lockout = lockout
+        self.max_lockout = max_lockout
+        self.refresh_interval = refresh_interval
+        self.purge_interval = purge_interval
+        self._locks = {}
+        self._next_refresh = 0.0
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+
+    def keys(self, serial_number, ip):
+        keys = [(f'serial:{serial_number}', self.max_failures)]
+        if ip:
+            keys.append((f'ip:{ip}', self.ip_max_failures))
+        return keys
+
+    def retry_after(self, serial_number, ip):
+        """عدد الثواني المتبقية على القفل (0 إذا لم يكن مقفلاً)"""
+        self.refresh()
+        now = timezone.now()
+        remaining = 0
+        for key, _ in self.keys(serial_number, ip):
+            locked_until = self._locks.get(key)
+            if locked_until and locked_until > now:
+                remaining = max(remaining, int((locked_until - now).total_seconds()) + 1)
+        return remaining
+
+    def record_failure(self, serial_number, ip):
+        for key, limit in self.keys(serial_number, ip):
+            try:
+                locked_until = self.store.record_failure(key, lambda attempt: self.apply_failure(attempt, limit))
+            except Exception as e:
+                logger.error(f"❌ PIN guard failed to record {key}: {e}")
+                continue
+            if locked_until:
+                locks = dict(self._locks)
+                locks[key] = locked_until
+                self._locks = locks
+
+    def apply_failure(self, attempt, limit):
+        """تقدير النافذة المنزلقة من نافذتين ثابتتين متتاليتين ثم القفل عند تجاوز الحد"""
+        now = timezone.now()
+        window = timedelta(seconds=self.window)
+        elapsed = now - attempt.window_start
+        if elapsed >= window:
+            periods = int(elapsed / window)
+            attempt.previous_failures = attempt.failures if periods == 1 else 0
+            attempt.failures = 0
+            attempt.window_start += window * periods
+            elapsed = now - attempt.window_start
+        attempt.failures += 1
+
+        weight = 1 - elapsed / window
+        if attempt.previous_failures * weight + attempt.failures < limit:
+            return
+        attempt.lockouts += 1
+        seconds = min(self.lockout * 2 ** (attempt.lockouts - 1), self.max_lockout)
+        attempt.locked_until = now + timedelta(seconds=seconds)
+        attempt.previous_failures = attempt.failures = 0
+        logger.warning(f"🔒 PIN guard locked {attempt.key} for {seconds}s")
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+        if not self._lock.acquire(blocking=force):
+            return
+        try:
+            self._locks = self.store.active_locks(timezone.now())
+            if now >= self._next_purge:
+                self._next_purge = now + self.purge_interval
+                self.purge()
+        except Exception as e:
+            logger.error(f"❌ PIN guard refresh failed: {e}")
+        finally:
+            self._next_refresh = now + self.refresh_interval
+            self._lock.release()
+
+    def purge(self):
+        """حذف العدادات غير المقفلة التي لم تتغير منذ max_lockout ثانية (ونافذتين على الأقل)"""
+        now = timezone.now()
+        before = now - timedelta(seconds=max(self.max_lockout, 2 * self.window))
+        deleted = self.store.purge(before, now)
+        if deleted:
+            logger.info(f"✅ PIN guard purged {deleted} idle counters")
+        return deleted
+
+
+pin_guard = PinGuard(
+    store=import_string(getattr(
+        settings, 'PIN_GUARD_STORE', 'serials.services.pin_guard.DatabaseAttemptStore'
+    ))(),
+    max_failures=getattr(settings, 'PIN_GUARD_MAX_FAILURES', 5),
+    ip_max_failures=getattr(settings, 'PIN_GUARD_IP_MAX_FAILURES', 20),
+    window=getattr(settings, 'PIN_GUARD_WINDOW', 900),
+    lockout=getattr(settings, 'PIN_GUARD_LOCKOUT', 60),
+    max_lockout=getattr(settings, 'PIN_GUARD_MAX_LOCKOUT', 86400),
+    refresh_interval=getattr(settings, 'PIN_GUARD_REFRESH_INTERVAL', 5),
+)
+
+
+def pin_locked_response(request, serial_number):
+    """رد 429 إذا كان السيريال أو الـ IP مقفلاً بسبب محاولات PIN خاطئة (بدون قاعدة البيانات)"""
+    retry_after = pin_guard.retry_after(serial_number, BaseThrottle().get_ident(request))
+    if not retry_after:
+        return None
+    response = Response({'success': False, 'message': 'محاولات خاطئة كثيرة، حاول لاحقاً'}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def record_pin_failure(request, serial_number, pin=None):
+    """تسجيل محاولة فاشلة، ترجع True إذا كان السيريال أو الـ PIN خاطئاً فعلاً
+
+    مع pin: إذا كان الزوج صحيحاً (سيريال منتهي أو معطل أو مفعل مسبقاً) لا تُعدّ المحاولة،
+    حتى لا يُقفل المالك الحقيقي.
+    """
+    # سيريال رفضه الـ Bloom filter غير موجود أصلاً، فلا داعي لكتابة عداد له في قاعدة البيانات
+    if not serial_filter.might_contain(serial_number):
+        return True
+    if pin is not None:
+        from serials.models import SerialKey
+
+        try:
+            SerialKey.objects.get_by_pin(serial_number, pin)
+            return False
+        except SerialKey.DoesNotExist:
+            pass
+    pin_guard.record_failure(serial_number, BaseThrottle().get_ident(request))
+    return True
@@ -0,0 +1,21 @@
+import hashlib
+import hmac
+
+from django.conf import settings
+
+
+def pin_key():
+    return (getattr(settings, 'SERIAL_PIN_KEY', '') or settings.SECRET_KEY).encode()
+
+
+def hash_pin(serial_number, pin, key=None):
+    """HMAC-SHA256 للـ PIN مربوط برقم السيريال، حتى لا يتطابق نفس الـ PIN بين سيريالين"""
+    message = f"{serial_number}:{pin}".encode()
+    return hmac.new(key or pin_key(), message, hashlib.sha256).hexdigest()
+
+
+def check_pin(serial_number, pin, pin_hash):
+    """مقارنة بزمن ثابت"""
+    if not pin or not pin_hash:
+        return False
+    return hmac.compare_digest(hash_pin(serial_number, str(pin)), pin_hash)
@@ -0,0 +1,107 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+
+from serials.models import SerialKey, SerialPackage
+from .generator import SerialGenerator
+
+logger = logging.getLogger(__name__)
+
+
+class SerialPool:
+    """مخزون سيريالات مولّدة مسبقاً لكل باقة، يُسحب منه في مسار الدفع بدل التوليد داخل الطلب"""
+
+    def __init__(self, low_water=200, target=1000, batch_size=5000):
+        self.low_water = low_water
+        self.target = target
+        self.batch_size = batch_size
+        self._refilling = set()
+        self._lock = threading.Lock()
+
+    def claim(self, package, **fields):
+        """سحب سيريال من مخزون الباقة وتعيين الحقول عليه، يجب استدعاؤها داخل transaction.atomic
+
+        SKIP LOCKED يجعل الطلبات المتزامنة تأخذ صفوفاً مختلفة بدل الانتظار على نفس الصف.
+        ترجع None إذا كان المخزون فارغاً.
+        """
+        serial = (
+            SerialKey.objects.select_for_update(skip_locked=True)
+            .filter(package=package, in_pool=True)
+            .order_by('id')
+            .first()
+        )
+        if serial is None:
+            logger.warning(f"⚠️ Serial pool empty for package {package.pk}")
+            transaction.on_commit(lambda: self.check_depth(package))
+            return None
+
+        # حدود التوكنز تؤخذ من الباقة وقت البيع، لا وقت التوليد
+        serial.tokens_total = serial.tokens_remaining = package.tokens_limit
+        serial.tokens_used = 0
+        serial.in_pool = False
+        serial.is_active = True
+        # PIN جديد وقت البيع، المتاح للمشتري عبر serial.raw_pin
+        serial.set_pin(SerialKey.generate_pin())
+        for name, value in fields.items():
+            setattr(serial, name, value)
+        serial.save()
+
+        transaction.on_commit(lambda: self.check_depth(package))
+        return serial
+
+    def depth(self, package_id=None):
+        """عدد السيريالات المتاحة في المخزون لكل باقة {package_id: count}"""
+        qs = SerialKey.objects.filter(in_pool=True)
+        if package_id is not None:
+            qs = qs.filter(package_id=package_id)
+        return dict(qs.order_by().values_list('package_id').annotate(n=Count('id')))
+
+    def refill(self, package):
+        """تعبئة مخزون الباقة حتى target، ترجع عدد السيريالات المضافة"""
+        missing = self.target - self.depth(package.pk).get(package.pk, 0)
+        if missing <= 0:
+            return 0
+        generator = SerialGenerator(package, batch_size=self.batch_size, pooled=True)
+        generator.run(missing)
+        logger.info(f"✅ Serial pool refilled for package {package.pk}: +{generator.created}")
+        return generator.created
+
+    def refill_all(self):
+        """تعبئة كل الباقات النشطة التي نزلت تحت low_water"""
+        depths = self.depth()
+        refilled = {}
+        for package in SerialPackage.objects.filter(is_active=True):
+            if depths.get(package.pk, 0) < self.low_water:
+                refilled[package.pk] = self.refill(package)
+        return refilled
+
+    def check_depth(self, package):
+        """تشغيل تعبئة في الخلفية إذا نزل المخزون تحت low_water (مرة واحدة لكل باقة في العامل)"""
+        if self.depth(package.pk).get(package.pk, 0) >= self.low_water:
+            return False
+        with self._lock:
+            if package.pk in self._refilling:
+                return False
+            self._refilling.add(package.pk)
+        threading.Thread(target=self._background_refill, args=(package,), daemon=True).start()
+        return True
+
+    def _background_refill(self, package):
+        try:
+            self.refill(package)
+        except Exception as e:
+            logger.error(f"❌ Serial pool refill failed for package {package.pk}: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(package.pk)
+            connection.close()
+
+
+serial_pool = SerialPool(
+    low_water=getattr(settings, 'SERIAL_POOL_LOW_WATER', 200),
+    target=getattr(settings, 'SERIAL_POOL_TARGET', 1000),
+    batch_size=getattr(settings, 'SERIAL_POOL_BATCH_SIZE', 5000),
+)
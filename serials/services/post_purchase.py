@@ -0,0 +1,67 @@
+import logging
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import get_template
+
+from serials.models import SerialKey, SerialPackage
+from .mailer import email_dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def purchase_templates():
+    """قالبا البريد (نص وHTML) يُحمّلان ويُترجمان مرة واحدة لكل عامل"""
+    return get_template('serials/emails/purchase.txt'), get_template('serials/emails/purchase.html')
+
+
+def build_purchase_email(payload, package, serial):
+    text_template, html_template = purchase_templates()
+    context = {
+        'client_name': payload['client_name'],
+        'intro': 'تم تفعيل اشتراكك!' if payload.get('customer_id') else 'شكراً لاشتراكك!',
+        'package_name': package.name,
+        'serial_number': serial.serial_number,
+        'pin': payload['pin'],
+        'tokens_limit': package.tokens_limit,
+    }
+    message = EmailMultiAlternatives(
+        subject="تم تفعيل اشتراكك بنجاح 🎉",
+        body=text_template.render(context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[payload['client_email']],
+    )
+    message.attach_alternative(html_template.render(context), 'text/html')
+    return message
+
+
+def send_purchase_emails(payloads):
+    """بريد السيريال لعدة مشترين عبر اتصال SMTP واحد
+
+    ترجع لكل payload None عند النجاح أو الاستثناء، والـ outbox يعيد المحاولة للفاشلة فقط.
+    """
+    packages = SerialPackage.objects.in_bulk({payload['package_id'] for payload in payloads})
+    serials = SerialKey.objects.in_bulk({payload['serial_id'] for payload in payloads})
+    results = [None] * len(payloads)
+    messages, positions = [], []
+    for i, payload in enumerate(payloads):
+        package, serial = packages.get(payload['package_id']), serials.get(payload['serial_id'])
+        if package is None or serial is None:
+            results[i] = LookupError(f"package {payload['package_id']} / serial {payload['serial_id']} not found")
+            continue
+        messages.append(build_purchase_email(payload, package, serial))
+        positions.append(i)
+    for i, error in zip(positions, email_dispatcher.send_messages(messages)):
+        results[i] = error
+    sent = sum(error is None for error in results)
+    logger.info(f"✅ Purchase emails sent: {sent}/{len(payloads)}")
+    return results
+
+
+def send_purchase_email(payload):
+    """بريد السيريال لمشترٍ واحد، أي استثناء يعني إعادة المحاولة لاحقاً من الـ outbox"""
+    error = send_purchase_emails([payload])[0]
+    if error is not None:
+        raise error
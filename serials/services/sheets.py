@@ -0,0 +1,116 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from serialcotv.http_client import http_client
+from serials.models import OutboxMessage, SerialKey, SerialPackage
+from .outbox import outbox
+
+logger = logging.getLogger(__name__)
+
+TOPIC = 'purchase.sheet'
+
+
+class SheetExporter:
+    """تصدير المشتريات إلى Google Sheet بدفعات مرتبة
+
+    الصفوف تبقى رسائل purchase.sheet في الـ outbox حتى يؤكد الـ Sheet استلامها. flush
+    ترسل حتى batch_size صف في POST واحد ({"rows": [...]}) عبر upstream 'sheets'، عندما
+    يكتمل العدد أو يمر max_wait ثانية على أقدم صف. مع batch_size=1 يُرسل الصف وحده
+    بالشكل القديم ({client, email, ...}) الذي يقبله الـ Apps Script المنشور.
+
+    الدفعة الفاشلة تُعاد كما هي بعد تأخير الـ outbox، ولا يُرسل صف أحدث قبل أن يُستلم
+    الأقدم منه. إذا وصل الأقدم إلى dead يتوقف التصدير حتى يعالجه المشرف (حذفه من الـ admin).
+    """
+
+    def __init__(self, batch_size=1, max_wait=5, timeout=10):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.upstream = http_client.upstream('sheets')
+        self.blocked_by = None
+
+    def flush(self, force=False):
+        """إرسال الدفعة المستحقة إن وجدت، ترجع عدد الصفوف المستلمة (0 إذا لم يُرسل شيء)"""
+        batch = self.claim(force)
+        if not batch:
+            return 0
+        try:
+            rows = self.rows(batch)
+            body = rows[0] if self.batch_size == 1 else {'rows': rows}
+            response = self.upstream.post(batch[0].payload['sheet_url'], json=body, timeout=self.timeout)
+            response.raise_for_status()
+        except Exception as e:
+            for message in batch:
+                outbox.fail(message, e)
+            return 0
+        completed = sum(outbox.complete(message) for message in batch)
+        logger.info(f"✅ Sheet updated with {len(batch)} rows")
+        return completed
+
+    def claim(self, force=False):
+        """حجز أقدم الصفوف المفتوحة بالترتيب، أو [] إذا كان الأقدم dead أو مؤجلاً أو الدفعة غير مستحقة"""
+        now = timezone.now()
+        open_rows = OutboxMessage.objects.filter(topic=TOPIC).exclude(status=OutboxMessage.DONE).order_by('id')
+        with transaction.atomic():
+            try:
+                rows = list(open_rows.select_for_update(nowait=True)[:self.batch_size])
+            except DatabaseError:
+                # عامل آخر يحجز نفس الصفوف الآن
+                return []
+            if rows and rows[0].status == OutboxMessage.DEAD:
+                self.block(rows[0])
+                return []
+            self.blocked_by = None
+            if not rows or rows[0].available_at > now:
+                return []
+            if not force and len(rows) < self.batch_size and rows[0].created_at > now - timedelta(seconds=self.max_wait):
+                return []
+            # دفعة واحدة لكل عنوان Sheet، بالترتيب حتى أول صف بعنوان مختلف
+            url = rows[0].payload['sheet_url']
+            batch = []
+            for message in rows:
+                if message.payload['sheet_url'] != url:
+                    break
+                batch.append(message)
+            lease_until = now + timedelta(seconds=outbox.lease)
+            for message in batch:
+                message.status = OutboxMessage.PROCESSING
+                message.attempts += 1
+                message.available_at = lease_until
+            OutboxMessage.objects.bulk_update(batch, ['status', 'attempts', 'available_at'])
+        return batch
+
+    def block(self, message):
+        # تخطي الصف dead يرسل الأحدث قبله، وإعادته لاحقاً تكسر ترتيب الـ Sheet
+        if self.blocked_by != message.pk:
+            self.blocked_by = message.pk
+            logger.error(f"❌ Sheet export blocked by dead {message}: {message.last_error}")
+
+    @staticmethod
+    def rows(batch):
+        packages = SerialPackage.objects.in_bulk({message.payload['package_id'] for message in batch})
+        serials = SerialKey.objects.in_bulk({message.payload['serial_id'] for message in batch})
+        rows = []
+        for message in batch:
+            payload = message.payload
+            package, serial = packages[payload['package_id']], serials[payload['serial_id']]
+            rows.append({
+                'client': payload['client_name'],
+                'email': payload.get('client_email') or '',
+                'package': package.name,
+                'serial': str(serial.serial_number),
+                'pin': str(payload['pin']),
+                'tokens': package.tokens_limit,
+            })
+        return rows
+
+
+sheet_exporter = SheetExporter(
+    batch_size=getattr(settings, 'GOOGLE_SHEET_BATCH_SIZE', 1),
+    max_wait=getattr(settings, 'GOOGLE_SHEET_MAX_WAIT', 5),
+    timeout=getattr(settings, 'GOOGLE_SHEET_TIMEOUT', 10),
+)
@@ -0,0 +1,153 @@
+import logging
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from serials.models import (
+    CustomerDailyUsage, FileTypeDailyUsage, SerialDailyUsage, SerialUsage, SerialUsageArchive, UsageRollupRun,
+)
+from .partitions import add_months, month_start, usage_partitions
+
+logger = logging.getLogger(__name__)
+
+# البعد -> (جدول الـ rollup، عمود التجميع في SerialUsage)
+DIMENSIONS = {
+    'serial': (SerialDailyUsage, 'serial_key_id'),
+    'customer': (CustomerDailyUsage, 'customer_id'),
+    'file_type': (FileTypeDailyUsage, 'file_type'),
+}
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+class UsageRollup:
+    """تجميعات يومية لـ SerialUsage لكل سيريال وعميل ونوع ملف
+
+    الأيام قبل rolled_until تُقرأ من جداول الـ rollup، وما بعدها (اليوم الحالي) من
+    SerialUsage مباشرة، فالتقارير على المدى الطويل لا تمسح صفوف الاستخدام الخام.
+    """
+
+    def __init__(self, batch_size=5000):
+        self.batch_size = batch_size
+
+    def rolled_until(self):
+        """أول يوم غير مكتمل في الـ rollup (None إذا لم يعمل بعد)"""
+        return (
+            UsageRollupRun.objects.filter(finished_at__isnull=False)
+            .order_by('-rolled_until').values_list('rolled_until', flat=True).first()
+        )
+
+    def roll(self, start, end):
+        """إعادة حساب الأيام [start, end) بالكامل لكل الأبعاد، ترجع عدد صفوف الـ rollup"""
+        run = UsageRollupRun.objects.create(started_at=timezone.now(), rolled_from=start, rolled_until=end)
+        usages = SerialUsage.objects.filter(created_at__gte=day_start(start), created_at__lt=day_start(end))
+        rows = 0
+        with transaction.atomic():
+            for model, column in DIMENSIONS.values():
+                model.objects.filter(day__gte=start, day__lt=end).delete()
+                grouped = (
+                    usages.exclude(**{f'{column}__isnull': True})
+                    .annotate(day=TruncDate('created_at'))
+                    .order_by().values('day', column)
+                    .annotate(downloads=Count('id'), tokens=Sum('tokens_used'))
+                )
+                batch = []
+                for row in grouped.iterator(chunk_size=self.batch_size):
+                    batch.append(model(**{
+                        'day': row['day'], column: row[column],
+                        'downloads': row['downloads'], 'tokens_used': row['tokens'] or 0,
+                    }))
+                    if len(batch) >= self.batch_size:
+                        model.objects.bulk_create(batch)
+                        rows += len(batch)
+                        batch = []
+                model.objects.bulk_create(batch)
+                rows += len(batch)
+            run.rows = rows
+            run.finished_at = timezone.now()
+            run.save()
+        logger.info(f"✅ Usage rollup {start} → {end}: {rows} rows")
+        return rows
+
+    def daily(self, dimension, value, start, end):
+        """[{day, downloads, tokens_used}] للأيام [start, end) لقيمة واحدة من البعد"""
+        model, column = DIMENSIONS[dimension]
+        boundary = self.rolled_until() or start
+        boundary = min(max(boundary, start), end)
+
+        days = {}
+        for day, downloads, tokens in model.objects.filter(
+            **{column: value}, day__gte=start, day__lt=boundary
+        ).values_list('day', 'downloads', 'tokens_used'):
+            days[day] = (downloads, tokens)
+        if boundary < end:
+            live = (
+                SerialUsage.objects.filter(
+                    **{column: value}, created_at__gte=day_start(boundary), created_at__lt=day_start(end)
+                )
+                .annotate(day=TruncDate('created_at'))
+                .order_by().values('day')
+                .annotate(downloads=Count('id'), tokens=Sum('tokens_used'))
+            )
+            for row in live:
+                days[row['day']] = (row['downloads'], row['tokens'] or 0)
+        return [
+            {'day': day, 'downloads': downloads, 'tokens_used': tokens}
+            for day, (downloads, tokens) in sorted(days.items())
+        ]
+
+    def archive(self, before, months_ahead=3):
+        """أرشفة الاستخدامات قبل الشهر before، فقط إذا كان الـ rollup قد غطاها
+
+        Postgres: إنشاء partitions الأشهر القادمة وفصل partitions الأشهر القديمة.
+        غيره: نقل الصفوف إلى SerialUsageArchive على دفعات. ترجع وصفاً لما تم.
+        """
+        rolled_until = self.rolled_until()
+        if rolled_until is None:
+            return {'skipped': 'لم يعمل الـ rollup بعد'}
+        # لا نؤرشف يوماً لم يدخل الـ rollup أو قد يُعاد حسابه (next_range يعيد اليوم السابق)
+        cutoff = min(month_start(before), month_start(day_start(rolled_until - timedelta(days=1))))
+
+        if usage_partitions.converting():
+            return {'skipped': 'تحويل الجدول إلى partitions لم ينتهِ بعد'}
+        if usage_partitions.is_partitioned():
+            created = usage_partitions.ensure(timezone.now(), add_months(month_start(timezone.now()), months_ahead))
+            return {'created': created, 'detached': usage_partitions.detach_before(cutoff)}
+
+        fields = ('id', 'serial_key_id', 'customer_id', 'file_name', 'file_type',
+                  'tokens_before', 'tokens_after', 'tokens_used', 'created_at')
+        table = connection.ops.quote_name(SerialUsage._meta.db_table)
+        candidates = SerialUsage.objects.filter(created_at__lt=cutoff).order_by('id')
+        moved = 0
+        while True:
+            with transaction.atomic():
+                rows = list(candidates.values(*fields)[:self.batch_size])
+                if not rows:
+                    break
+                SerialUsageArchive.objects.bulk_create(
+                    [SerialUsageArchive(**row) for row in rows], ignore_conflicts=True
+                )
+                ids = [row['id'] for row in rows]
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+            moved += len(rows)
+        return {'archived': moved, 'before': cutoff.date()}
+
+    def next_range(self, today=None):
+        """الأيام المكتملة التي لم تدخل الـ rollup بعد، مع إعادة آخر يوم تحسباً لصفوف متأخرة"""
+        today = today or timezone.localdate()
+        rolled_until = self.rolled_until()
+        if rolled_until is None:
+            oldest = SerialUsage.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            start = timezone.localtime(oldest).date() if oldest else today
+        else:
+            start = rolled_until - timedelta(days=1)
+        return start, today
+
+
+usage_rollup = UsageRollup()
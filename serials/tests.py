@@ -1,3 +1,639 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import importlib
+import json
+import smtplib
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import (
+    OutboxMessage, ReconciliationRun, SerialDailyUsage, SerialKey, SerialPackage, SerialUsage, SerialUsageArchive,
+    WebhookEvent,
+)
+from .services.bulk import BulkSerialService
+from .services.checkout import fulfil_checkout, process_webhook_event
+from .services.generator import SerialGenerator, generate_codes
+from .services.mailer import EmailDispatcher
+from .services.outbox import outbox
+from .services import pins
+from .services.partitions import MonthlyPartitions, add_months, month_start
+from .services.pool import serial_pool
+from .services.post_purchase import send_purchase_emails
+from .services.sheets import SheetExporter
+from .services.usage import UsageRollup, day_start
+
+
+class PurchaseEmailDispatchTests(TestCase):
+    """بريد الشراء يُرسل دفعات عبر اتصال واحد ويعيد الاتصال عند انقطاعه"""
+
+    def setUp(self):
+        self.package = SerialPackage.objects.create(name='P', tokens_limit=100, price=10)
+        self.serials = [SerialKey.objects.create(package=self.package) for _ in range(3)]
+        self.dispatcher = EmailDispatcher(rate=0)
+        patcher = mock.patch('serials.services.post_purchase.email_dispatcher', self.dispatcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def payload(self, serial, name='Ali'):
+        return {
+            'package_id': self.package.id, 'serial_id': serial.id, 'pin': '1234',
+            'client_name': name, 'client_email': f'{serial.id}@example.com',
+        }
+
+    def test_batch_uses_one_connection(self):
+        payloads = [self.payload(serial) for serial in self.serials]
+        payloads[0]['client_name'] = '<b>Ali</b>'
+        with mock.patch('serials.services.mailer.get_connection', wraps=mail.get_connection) as get_connection:
+            results = send_purchase_emails(payloads)
+        self.assertEqual(results, [None, None, None])
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        html = mail.outbox[0].alternatives[0][0]
+        self.assertIn('&lt;b&gt;Ali&lt;/b&gt;', html)
+        self.assertIn(str(self.serials[0].serial_number), mail.outbox[0].body)
+
+    def test_reconnects_after_disconnect(self):
+        original = EmailBackend.send_messages
+        calls = []
+
+        def flaky(backend, messages):
+            calls.append(messages)
+            if len(calls) == 2:
+                raise smtplib.SMTPServerDisconnected('gone')
+            return original(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', flaky):
+            results = send_purchase_emails([self.payload(serial) for serial in self.serials])
+        self.assertEqual(results, [None, None, None])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(self.dispatcher.reconnects, 1)
+
+    def test_outbox_batch_fails_only_missing(self):
+        missing = self.payload(self.serials[0])
+        missing['serial_id'] = 0
+        messages = [outbox.enqueue('purchase.email', self.payload(self.serials[1])), outbox.enqueue('purchase.email', missing)]
+        claimed = outbox.claim(10)
+        self.assertEqual(outbox.process_batch(claimed), 1)
+        statuses = dict(OutboxMessage.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[messages[0].id], OutboxMessage.DONE)
+        self.assertEqual(statuses[messages[1].id], OutboxMessage.PENDING)
+        self.assertNotIn('pin', OutboxMessage.objects.get(id=messages[0].id).payload)
+
+    def test_expired_lease_cannot_overwrite_new_owner(self):
+        outbox.enqueue('purchase.email', self.payload(self.serials[0]))
+        [stale] = outbox.claim(10)
+        # العامل الأول تجاوز مهلته، وعامل آخر استعاد الرسالة
+        OutboxMessage.objects.filter(pk=stale.pk).update(available_at=timezone.now() - timedelta(seconds=1))
+        [current] = outbox.claim(10)
+
+        self.assertFalse(outbox.complete(stale))
+        self.assertFalse(outbox.fail(stale, smtplib.SMTPException('late')))
+        message = OutboxMessage.objects.get(pk=stale.pk)
+        self.assertEqual((message.status, message.attempts, message.last_error), (OutboxMessage.PROCESSING, 2, ''))
+        self.assertIn('pin', message.payload)
+
+        self.assertTrue(outbox.complete(current))
+        self.assertEqual(OutboxMessage.objects.get(pk=stale.pk).status, OutboxMessage.DONE)
+        self.assertFalse(outbox.fail(current, smtplib.SMTPException('late')))
+        self.assertEqual(OutboxMessage.objects.get(pk=stale.pk).status, OutboxMessage.DONE)
+
+    def test_dead_message_drops_pin(self):
+        message = outbox.enqueue('purchase.email', self.payload(self.serials[0]))
+        OutboxMessage.objects.filter(pk=message.pk).update(attempts=outbox.max_attempts - 1)
+        [message] = outbox.claim(10)
+        self.assertTrue(outbox.fail(message, smtplib.SMTPException('rejected')))
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.DEAD)
+        self.assertNotIn('pin', message.payload)
+        # بلا PIN لا يمكن إرسالها، فلا تعود للطابور وتُحذف بعد مدة الاحتفاظ
+        self.assertEqual(outbox.retry_dead(), 0)
+        OutboxMessage.objects.filter(pk=message.pk).update(processed_at=message.processed_at - timedelta(days=31))
+        self.assertEqual(outbox.purge(7, dead_days=30), 1)
+
+
+class SheetExporterTests(TestCase):
+    """صفوف الـ Sheet تُرسل دفعات بالترتيب وتبقى في الـ outbox حتى الاستلام"""
+
+    def setUp(self):
+        self.package = SerialPackage.objects.create(name='P', tokens_limit=100, price=10)
+        self.exporter = SheetExporter(batch_size=2, max_wait=60)
+        self.session = mock.Mock()
+        self.exporter.upstream = self.session
+        self.messages = [
+            outbox.enqueue('purchase.sheet', {
+                'package_id': self.package.id, 'serial_id': SerialKey.objects.create(package=self.package).id,
+                'pin': '1234', 'client_name': f'c{i}', 'client_email': '', 'sheet_url': 'https://sheet.test/exec',
+            })
+            for i in range(3)
+        ]
+
+    def sent_clients(self):
+        return [[row['client'] for row in call.kwargs['json']['rows']] for call in self.session.post.call_args_list]
+
+    def test_batches_in_order_and_waits_for_partial(self):
+        self.assertEqual(outbox.claim(10), [])
+        self.assertEqual(self.exporter.flush(), 2)
+        # صف واحد متبقٍ أحدث من max_wait
+        self.assertEqual(self.exporter.flush(), 0)
+        self.assertEqual(self.exporter.flush(force=True), 1)
+        self.assertEqual(self.sent_clients(), [['c0', 'c1'], ['c2']])
+        self.assertFalse(OutboxMessage.objects.exclude(status=OutboxMessage.DONE).exists())
+
+    def test_failed_batch_blocks_newer_rows(self):
+        self.session.post.return_value.raise_for_status.side_effect = OSError('timeout')
+        self.assertEqual(self.exporter.flush(), 0)
+        # الدفعة الفاشلة مؤجلة، فالصف الثالث لا يُرسل قبلها
+        self.assertEqual(self.exporter.flush(force=True), 0)
+        OutboxMessage.objects.update(available_at=self.messages[0].created_at - timedelta(seconds=1))
+        self.session.post.return_value.raise_for_status.side_effect = None
+        self.assertEqual(self.exporter.flush(), 2)
+        self.assertEqual(self.sent_clients(), [['c0', 'c1'], ['c0', 'c1']])
+
+    def test_dead_head_blocks_export(self):
+        OutboxMessage.objects.filter(pk=self.messages[0].pk).update(status=OutboxMessage.DEAD)
+        self.assertEqual(self.exporter.flush(force=True), 0)
+        self.assertEqual(self.exporter.blocked_by, self.messages[0].pk)
+        self.session.post.assert_not_called()
+        # المشرف يحذف الصف dead، فيكمل التصدير بالترتيب
+        OutboxMessage.objects.filter(pk=self.messages[0].pk).delete()
+        self.assertEqual(self.exporter.flush(), 2)
+        self.assertEqual(self.sent_clients(), [['c1', 'c2']])
+
+    def test_single_row_keeps_old_payload(self):
+        self.exporter.batch_size = 1
+        self.assertEqual(self.exporter.flush(), 1)
+        body = self.session.post.call_args.kwargs['json']
+        self.assertEqual((body['client'], body['pin']), ('c0', '1234'))
+
+
+class PinFailureCountingTests(TestCase):
+    """سيريال منتهي أو معطل مع PIN صحيح لا يُعدّ محاولة تخمين"""
+
+    def setUp(self):
+        package = SerialPackage.objects.create(name='P', tokens_limit=1, price=10)
+        self.serial = SerialKey.objects.create(package=package)
+        patcher = mock.patch('serials.services.pin_guard.pin_guard.record_failure')
+        self.record_failure = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_token(self, pin, **headers):
+        return self.client.post('/api/serials/use-token/', {
+            'serial_number': self.serial.serial_number, 'pin': pin, 'file_id': 1,
+        }, secure=True, **headers)
+
+    def test_used_up_serial_with_correct_pin_not_counted(self):
+        self.assertEqual(self.use_token(self.serial.raw_pin).status_code, 200)
+        response = self.use_token(self.serial.raw_pin)
+        self.assertEqual(response.status_code, 400)
+        SerialKey.objects.filter(pk=self.serial.pk).update(is_active=False)
+        self.assertEqual(self.use_token(self.serial.raw_pin).status_code, 400)
+        self.record_failure.assert_not_called()
+
+    def test_wrong_pin_counted(self):
+        wrong_pin = '00000000' if self.serial.raw_pin != '00000000' else '11111111'
+        self.assertEqual(self.use_token(wrong_pin).status_code, 404)
+        self.record_failure.assert_called_once()
+
+    def test_ip_key_ignores_client_forwarded_for(self):
+        # العميل يكتب بداية X-Forwarded-For، والـ proxy يضيف عنوانه الحقيقي في النهاية
+        wrong_pin = '00000000' if self.serial.raw_pin != '00000000' else '11111111'
+        for spoofed in ('1.1.1.1', '2.2.2.2'):
+            self.use_token(wrong_pin, HTTP_X_FORWARDED_FOR=f'{spoofed}, 203.0.113.9')
+        self.assertEqual(
+            [call.args for call in self.record_failure.call_args_list],
+            [(self.serial.serial_number, '203.0.113.9')] * 2,
+        )
+        self.assertEqual(SerialUsage.objects.count(), 0)
+        self.assertEqual(self.use_token(self.serial.raw_pin).status_code, 200)
+        self.assertEqual(SerialUsage.objects.get().file_name, 'File_1')
+
+
+class ReconcileBalancesTests(TestCase):
+    """تحميلات المحتوى تكتب SerialUsage، فلا تظهر كاختلاف في reconcile_balances"""
+
+    def test_content_download_reconciles(self):
+        from accounts.models import Customer
+        from content.models import Firmware, TVBrand
+
+        package = SerialPackage.objects.create(name='P', tokens_limit=1000, price=10)
+        serial = SerialKey.objects.create(package=package)
+        firmware = Firmware.objects.create(
+            brand=TVBrand.objects.create(name='B'), model_number='M', token_cost=500, file_url='https://files.test/f.bin'
+        )
+        response = self.client.get(f'/api/content/firmware/{firmware.pk}/', {
+            'serial_number': serial.serial_number, 'pin': serial.raw_pin,
+        }, secure=True)
+        self.assertEqual(response.status_code, 200, response.content)
+        Customer.objects.create(name='C', phone='0555555555', token_balance=20).spend_tokens(5)
+
+        with tempfile.NamedTemporaryFile(suffix='.csv') as report:
+            call_command('reconcile_balances', output=report.name, stdout=StringIO())
+        self.assertEqual(ReconciliationRun.objects.get().discrepancies, 0)
+
+
+class SerialFilterTests(TestCase):
+    """الرفض من الذاكرة: تحديث إجباري واحد على الأكثر كل miss_refresh_interval، ولا عدّ مزدوج للإضافة المحلية"""
+
+    def setUp(self):
+        from .services.bloom import SerialNumberFilter
+
+        self.package = SerialPackage.objects.create(name='P', tokens_limit=1, price=10)
+        SerialKey.objects.create(package=self.package)
+        self.bloom = SerialNumberFilter(refresh_interval=3600, miss_refresh_interval=60)
+        self.bloom.build()
+
+    def test_misses_share_one_forced_refresh(self):
+        # الإضافة تذهب لـ serial_filter العام، وهذا الفلتر يمثل عاملاً آخر
+        other = SerialKey.objects.create(package=self.package)
+        self.assertTrue(self.bloom.might_contain(other.serial_number))
+        with self.assertNumQueries(0):
+            for i in range(20):
+                self.assertFalse(self.bloom.might_contain(f'NOT-A-SERIAL-{i}'))
+        self.assertEqual(self.bloom.rejected, 20)
+
+    def test_local_add_not_counted_twice(self):
+        serial = SerialKey.objects.create(package=self.package)
+        self.bloom.add([serial.serial_number])
+        self.bloom.refresh(force=True)
+        self.assertEqual(self.bloom.stats()['keys'], 2)
+        self.assertTrue(self.bloom.might_contain(serial.serial_number))
+
+
+class BulkSerialTests(TestCase):
+    """الطلب الجماعي محدود بـ max_items، والتحقق يُبحث ويُكتب بدفعات"""
+
+    def setUp(self):
+        from accounts.models import Source
+
+        package = SerialPackage.objects.create(name='P', tokens_limit=10, price=10)
+        self.serials = [SerialKey.objects.create(package=package) for _ in range(3)]
+        self.key = Source.objects.create(name='S', prefix='S').issue_api_key()
+        service = BulkSerialService(max_items=4, chunk_size=2)
+        patcher = mock.patch('serials.views.bulk_serials', service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def check(self, items):
+        return self.client.post('/api/serials/bulk/check/', {'items': items}, content_type='application/json',
+                                secure=True, HTTP_X_SOURCE_KEY=self.key)
+
+    def test_rejects_more_than_max_items(self):
+        items = [{'serial_number': serial.serial_number, 'pin': serial.raw_pin} for serial in self.serials]
+        self.assertEqual(self.check(items * 2).status_code, 413)
+
+    def test_streams_results_in_order_across_chunks(self):
+        items = [{'serial_number': serial.serial_number, 'pin': serial.raw_pin} for serial in self.serials]
+        items.append(items[0])
+        response = self.check(items)
+        self.assertEqual(response.status_code, 200)
+        chunks = [chunk.decode() for chunk in response.streaming_content]
+        lines = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual([line.get('status') for line in lines[:4]], ['valid', 'valid', 'valid', 'duplicate'])
+        self.assertEqual(lines[-1]['summary'], {'total': 4, 'valid': 3, 'duplicate': 1})
+
+
+@skipUnless(connection.vendor == 'postgresql', 'partitions تعمل على Postgres فقط')
+class MonthlyPartitionsTests(TestCase):
+    """convert ينقل الصفوف بدفعات والقراءة ترى الجدول القديم حتى ينتهي النقل"""
+
+    def setUp(self):
+        self.partitions = MonthlyPartitions('scratch_usage')
+        self.now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE scratch_usage (id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, '
+                'note varchar(20) NOT NULL, created_at timestamptz NOT NULL)'
+            )
+            cursor.execute('CREATE INDEX scratch_usage_created ON scratch_usage (created_at)')
+            for months in range(5):
+                cursor.execute(
+                    'INSERT INTO scratch_usage (note, created_at) VALUES (%s, %s)',
+                    [f'm{months}', add_months(month_start(self.now), -months)],
+                )
+
+    def rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id, note FROM scratch_usage ORDER BY id')
+            return cursor.fetchall()
+
+    def insert(self, note):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO scratch_usage (note, created_at) VALUES (%s, %s) RETURNING id', [note, self.now]
+            )
+            return cursor.fetchone()[0]
+
+    def test_convert_moves_rows_in_batches(self):
+        before = self.rows()
+        self.assertTrue(self.partitions.convert(months_ahead=1, batch_size=2))
+        self.assertTrue(self.partitions.is_partitioned())
+        self.assertEqual(self.rows(), before)
+        self.assertEqual(len(self.partitions.partitions()), 6)
+        self.assertIsNone(self.partitions.relkind(self.partitions.legacy_name))
+        self.assertGreater(self.insert('new'), before[-1][0])
+        self.assertFalse(self.partitions.convert())
+
+    def test_view_serves_reads_and_writes_until_copied(self):
+        before = self.rows()
+        self.partitions._swap(months_ahead=1)
+        self.assertTrue(self.partitions.converting())
+        self.assertEqual(self.rows(), before)
+
+        new_id = self.insert('during')
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE scratch_usage SET note = 'edited' WHERE id = %s", [before[0][0]])
+            cursor.execute('DELETE FROM scratch_usage WHERE id = %s', [before[1][0]])
+            cursor.execute(f'SELECT count(*) FROM {self.partitions.legacy_name}')
+            self.assertEqual(cursor.fetchone()[0], len(before) - 2)
+
+        self.assertTrue(self.partitions.convert(batch_size=2))
+        self.assertFalse(self.partitions.converting())
+        expected = [(before[0][0], 'edited')] + before[2:] + [(new_id, 'during')]
+        self.assertEqual(self.rows(), expected)
+
+    def test_ensure_and_detach(self):
+        self.partitions.convert(months_ahead=0)
+        current = month_start(self.now)
+        created = self.partitions.ensure(self.now, add_months(current, 2))
+        self.assertEqual(created, [
+            self.partitions.partition_name(add_months(current, 1)),
+            self.partitions.partition_name(add_months(current, 2)),
+        ])
+        self.assertEqual(self.partitions.ensure(self.now, add_months(current, 2)), [])
+
+        detached = self.partitions.detach_before(add_months(current, -2))
+        self.assertEqual(len(detached), 2)
+        self.assertEqual(len(self.rows()), 3)
+        self.assertEqual([start for _, start in self.partitions.partitions()][0], add_months(current, -2))
+
+
+class UsageRollupTests(TestCase):
+    """التقارير اليومية من الـ rollup للأيام المكتملة ومن SerialUsage لما بعدها"""
+
+    def setUp(self):
+        self.rollup = UsageRollup(batch_size=2)
+        package = SerialPackage.objects.create(name='P', tokens_limit=100, price=10)
+        self.serial = SerialKey.objects.create(package=package)
+        self.today = timezone.localdate()
+
+    def usage(self, day, tokens=1, file_type='bin'):
+        usage = SerialUsage.objects.create(
+            serial_key=self.serial, file_name='f', file_type=file_type,
+            tokens_before=100, tokens_after=100 - tokens, tokens_used=tokens,
+        )
+        SerialUsage.objects.filter(pk=usage.pk).update(created_at=day_start(day) + timedelta(hours=1))
+        return usage
+
+    def test_roll_groups_by_day_and_dimension(self):
+        first, second = self.today - timedelta(days=2), self.today - timedelta(days=1)
+        self.usage(first, 2)
+        self.usage(first, 3, 'zip')
+        self.usage(second, 4)
+        self.usage(self.today, 5)
+
+        # 2 أيام للسيريال + 3 (يوم، نوع ملف)، والعميل فارغ فلا صفوف له
+        self.assertEqual(self.rollup.roll(first, self.today), 5)
+        self.assertEqual(
+            list(SerialDailyUsage.objects.order_by('day').values_list('day', 'downloads', 'tokens_used')),
+            [(first, 2, 5), (second, 1, 4)],
+        )
+        self.assertEqual(self.rollup.rolled_until(), self.today)
+        # إعادة الحساب تستبدل الأيام ولا تضاعفها
+        self.assertEqual(self.rollup.roll(first, self.today), 5)
+
+    def test_daily_reads_rollup_then_live_rows(self):
+        yesterday = self.today - timedelta(days=1)
+        stale = self.usage(yesterday, 2)
+        self.rollup.roll(yesterday, self.today)
+        # صف حُذف بعد الـ rollup لا يغيّر اليوم المكتمل، واليوم الحالي يُحسب مباشرة
+        stale.delete()
+        self.usage(self.today, 3)
+        self.usage(self.today, 4)
+        self.assertEqual(self.rollup.daily('serial', self.serial.id, yesterday, self.today + timedelta(days=1)), [
+            {'day': yesterday, 'downloads': 1, 'tokens_used': 2},
+            {'day': self.today, 'downloads': 2, 'tokens_used': 7},
+        ])
+
+    def test_archive_moves_rolled_up_months(self):
+        old_day = self.today - timedelta(days=100)
+        self.assertIn('skipped', self.rollup.archive(month_start(timezone.now())))
+
+        old = [self.usage(old_day, tokens) for tokens in (1, 2, 3)]
+        recent = self.usage(self.today)
+        self.rollup.roll(old_day, self.today)
+        result = self.rollup.archive(month_start(timezone.now()))
+
+        self.assertEqual(result['archived'], 3)
+        self.assertEqual(list(SerialUsage.objects.values_list('id', flat=True)), [recent.id])
+        self.assertEqual(
+            sorted(SerialUsageArchive.objects.values_list('id', 'tokens_used')),
+            [(usage.id, usage.tokens_used) for usage in old],
+        )
+
+
+@override_settings(CHARGILY_APP_SECRET='webhook-secret', CHARGILY_WEBHOOK_FAST_ACK=True, GOOGLE_SHEET_URL='')
+class ChargilyWebhookTests(TestCase):
+    """الوضع السريع: إعادة إرسال نفس الدفعة تنتج حدثاً واحداً وسيريالاً وبريداً واحداً"""
+
+    def setUp(self):
+        patcher = mock.patch('serials.services.post_purchase.email_dispatcher', EmailDispatcher(rate=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.body = json.dumps({'type': 'checkout.paid', 'data': {
+            'id': 'chk_1', 'metadata': {'name': 'Ali', 'package_name': 'P'}, 'customer_email': 'ali@example.com',
+        }}).encode()
+
+    def deliver(self):
+        signature = hmac.new(b'webhook-secret', self.body, hashlib.sha256).hexdigest()
+        return self.client.post('/api/webhook/chargily/', self.body, content_type='application/json',
+                                secure=True, HTTP_SIGNATURE=signature)
+
+    def run_outbox(self):
+        OutboxMessage.objects.filter(status=OutboxMessage.PENDING).update(available_at=timezone.now())
+        claimed = outbox.claim(10)
+        for topic in {message.topic for message in claimed}:
+            outbox.process_batch([message for message in claimed if message.topic == topic])
+
+    def test_replayed_checkout_fulfilled_once(self):
+        SerialPackage.objects.create(name='P', tokens_limit=100, price=10)
+        self.assertEqual(self.deliver().json(), {'status': 'accepted'})
+        self.assertEqual(self.deliver().json(), {'status': 'already_received'})
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(OutboxMessage.objects.filter(topic='chargily.checkout').count(), 1)
+
+        self.run_outbox()
+        event = WebhookEvent.objects.get()
+        self.assertIsNotNone(event.processed_at)
+        serial = SerialKey.objects.get(payment_id='chk_1')
+
+        # تسليم مكرر للرسالة بعد انقطاع العامل قبل تعليمها منفذة
+        WebhookEvent.objects.update(processed_at=None)
+        process_webhook_event({'event_id': event.pk})
+        process_webhook_event({'event_id': event.pk})
+        self.assertEqual(WebhookEvent.objects.get().serial, serial)
+        self.assertEqual(SerialKey.objects.filter(payment_id='chk_1').count(), 1)
+
+        self.run_outbox()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['ali@example.com'])
+        self.assertFalse(OutboxMessage.objects.exclude(status=OutboxMessage.DONE).exists())
+
+    def test_failed_processing_is_retried(self):
+        self.deliver()
+        self.run_outbox()
+        message = OutboxMessage.objects.get(topic='chargily.checkout')
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.PENDING, 1))
+        self.assertIn('No package', message.last_error)
+        self.assertIsNone(WebhookEvent.objects.get().processed_at)
+
+        SerialPackage.objects.create(name='P', tokens_limit=100, price=10)
+        self.run_outbox()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.DONE, 2))
+        self.assertEqual(WebhookEvent.objects.get().serial, SerialKey.objects.get(payment_id='chk_1'))
+
+
+class SerialPoolTests(TestCase):
+    """البيع يسحب سيريالاً من المخزون بـ PIN جديد، والمخزون الفارغ يعود للتوليد داخل الطلب"""
+
+    def setUp(self):
+        self.package = SerialPackage.objects.create(name='P', tokens_limit=10, price=10)
+        patcher = mock.patch.object(serial_pool, 'check_depth')
+        self.check_depth = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_claim_takes_pooled_serial_with_fresh_pin(self):
+        SerialGenerator(self.package, pooled=True).run(2)
+        first = SerialKey.objects.order_by('id').first()
+        self.package.tokens_limit = 50
+        self.package.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            serial = serial_pool.claim(self.package, payment_id='chk_pool')
+        self.assertEqual(serial.pk, first.pk)
+        raw_pin = serial.raw_pin
+        serial.refresh_from_db()
+        self.assertEqual(
+            (serial.in_pool, serial.is_active, serial.payment_id, serial.tokens_total, serial.tokens_remaining),
+            (False, True, 'chk_pool', 50, 50),
+        )
+        self.assertNotEqual(serial.pin, first.pin)
+        self.assertTrue(serial.check_pin(raw_pin))
+        self.assertEqual(serial_pool.depth(self.package.pk), {self.package.pk: 1})
+        self.check_depth.assert_called_once_with(self.package)
+
+    def test_empty_pool_creates_serial(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(serial_pool.claim(self.package))
+            serial = fulfil_checkout({'id': 'chk_empty', 'metadata': {'package_id': self.package.pk}})
+        self.assertEqual(SerialKey.objects.get().pk, serial.pk)
+        self.assertEqual((serial.payment_id, serial.in_pool, serial.tokens_remaining), ('chk_empty', False, 10))
+        self.assertTrue(SerialKey.objects.get().check_pin(serial.raw_pin))
+        self.assertEqual(self.check_depth.call_count, 2)
+
+
+class SerialGeneratorTests(TestCase):
+    """أكواد بالصيغة والطول الصحيحين، فريدة داخل الدفعة ومع الموجود، وأزواج (serial, pin) لكل دفعة"""
+
+    def setUp(self):
+        self.package = SerialPackage.objects.create(name='P', tokens_limit=10, price=10)
+
+    def test_code_format(self):
+        codes = generate_codes(2000)
+        length = len(SerialKey.SERIAL_PREFIX) + SerialKey.SERIAL_CODE_LENGTH
+        self.assertEqual(len(codes), 2000)
+        for code in codes:
+            self.assertEqual(len(code), length)
+            self.assertTrue(code.startswith(SerialKey.SERIAL_PREFIX))
+            self.assertTrue(set(code[len(SerialKey.SERIAL_PREFIX):]) <= set(SerialKey.SERIAL_CHARS))
+        self.assertEqual(len(set(codes)), len(codes))
+
+    def test_batch_codes_unique_and_new(self):
+        existing = SerialKey.objects.create(package=self.package).serial_number
+        repeated = ['SC' + 'A' * 14, 'SC' + 'A' * 14, existing]
+        with mock.patch('serials.services.generator.generate_codes',
+                        side_effect=[repeated, ['SC' + 'B' * 14, 'SC' + 'C' * 14]]):
+            generator = SerialGenerator(self.package, batch_size=3)
+            codes = generator.fresh_codes(3)
+        self.assertEqual(sorted(codes), ['SC' + 'A' * 14, 'SC' + 'B' * 14, 'SC' + 'C' * 14])
+        self.assertEqual(generator.collisions, 1)
+
+    def test_on_batch_receives_each_batch(self):
+        batches = []
+        generator = SerialGenerator(self.package, batch_size=4, on_batch=batches.append)
+        self.assertEqual(generator.run(10), 10)
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+
+        serials = {serial.serial_number: serial for serial in SerialKey.objects.all()}
+        issued = [pair for batch in batches for pair in batch]
+        self.assertEqual(sorted(serials), sorted(code for code, _ in issued))
+        for code, pin in issued:
+            self.assertTrue(serials[code].check_pin(pin))
+            self.assertEqual((serials[code].tokens_remaining, serials[code].in_pool), (10, False))
+
+    def test_pooled_batches_not_reported(self):
+        on_batch = mock.Mock()
+        SerialGenerator(self.package, on_batch=on_batch, pooled=True).run(3)
+        on_batch.assert_not_called()
+        self.assertEqual(SerialKey.objects.filter(in_pool=True, is_active=False).count(), 3)
+
+
+class HashedPinTests(TestCase):
+    """الـ PIN مخزن كـ HMAC ويُتحقق منه بزمن ثابت، والخصم لا يضع الـ PIN في شرط UPDATE"""
+
+    def setUp(self):
+        self.package = SerialPackage.objects.create(name='P', tokens_limit=10, price=10)
+        self.serial = SerialKey.objects.create(package=self.package)
+
+    def test_hashed_pin_verifies(self):
+        self.assertEqual(len(self.serial.pin), 64)
+        self.assertNotIn(self.serial.raw_pin, self.serial.pin)
+        self.assertTrue(pins.check_pin(self.serial.serial_number, int(self.serial.raw_pin), self.serial.pin))
+        self.assertFalse(pins.check_pin(self.serial.serial_number, '0000', self.serial.pin))
+        self.assertFalse(pins.check_pin(self.serial.serial_number, '', self.serial.pin))
+        # نفس الـ PIN على سيريال آخر أو بمفتاح آخر يعطي HMAC مختلفاً
+        self.assertNotEqual(pins.hash_pin('SCOTHER', self.serial.raw_pin), self.serial.pin)
+        with override_settings(SERIAL_PIN_KEY='rotated'):
+            self.assertFalse(self.serial.check_pin(self.serial.raw_pin))
+        self.assertEqual(
+            SerialKey.objects.get_by_pin(self.serial.serial_number, self.serial.raw_pin).pk, self.serial.pk
+        )
+        with self.assertRaises(SerialKey.DoesNotExist):
+            SerialKey.objects.get_by_pin(self.serial.serial_number, '0000')
+
+    def test_debit_compares_pin_in_python(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNone(SerialKey.debit(1, serial_number=self.serial.serial_number, pin='0000'))
+            debit = SerialKey.debit(3, serial_number=self.serial.serial_number, pin=self.serial.raw_pin)
+        self.assertEqual((debit.id, debit.tokens_remaining), (self.serial.pk, 7))
+        self.assertFalse(any(self.serial.pin in q['sql'] for q in queries.captured_queries))
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"pin"', updates[0])
+
+    def test_migration_hashing_is_idempotent(self):
+        migration = importlib.import_module('serials.migrations.0008_hash_serial_pins')
+        plain = [SerialKey.objects.create(package=self.package) for _ in range(4)]
+        for serial in plain:
+            SerialKey.objects.filter(pk=serial.pk).update(pin=serial.raw_pin)
+
+        with mock.patch.object(migration, 'BATCH_SIZE', 3):
+            migration.hash_plaintext_pins(apps, None)
+            hashed = dict(SerialKey.objects.values_list('id', 'pin'))
+            migration.hash_plaintext_pins(apps, None)
+        self.assertEqual(dict(SerialKey.objects.values_list('id', 'pin')), hashed)
+        self.assertEqual(hashed[self.serial.pk], self.serial.pin)
+        for serial in plain:
+            self.assertTrue(SerialKey.objects.get(pk=serial.pk).check_pin(serial.raw_pin))
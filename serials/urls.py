@@ -4,5 +4,13 @@ from . import views
 urlpatterns = [
     path('check/', views.CheckSerialAPI.as_view(), name='check-serial'),
     path('activate/', views.ActivateSerialAPI.as_view(), name='activate-serial'),
+    path('bulk/check/', views.BulkCheckSerialAPI.as_view(), name='bulk-check-serial'),
+    path('bulk/activate/', views.BulkActivateSerialAPI.as_view(), name='bulk-activate-serial'),
     path('use-token/', views.UseTokenAPI.as_view(), name='use-token'),
+    path('history/', views.SerialUsageHistoryAPI.as_view(), name='serial-usage-history'),
+    path('usage/report/', views.SerialUsageReportAPI.as_view(), name='serial-usage-report'),
+    path('outbox/', views.OutboxStatusAPI.as_view(), name='outbox-status'),
+    path('pool/', views.SerialPoolStatusAPI.as_view(), name='serial-pool-status'),
+    path('filter/', views.SerialFilterStatusAPI.as_view(), name='serial-filter-status'),
+    path('upstreams/', views.UpstreamStatusAPI.as_view(), name='upstream-status'),
 ]
\ No newline at end of file
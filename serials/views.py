@@ -1,29 +1,36 @@
-import hashlib
-import hmac
 import json
 import logging
-import re
-import threading
+from datetime import date, timedelta
 from typing import Optional, Dict, Any
 from urllib.parse import urlparse
 
-import requests
 from django.conf import settings
-from django.core.mail import send_mail
-from django.db import transaction, IntegrityError, connection
-from django.db.models import F
-from django.db.models.functions import Coalesce
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from accounts.models import Customer
+from accounts.authentication import IsSource, SourceKeyAuthentication
+from accounts.models import Customer, Transaction
+from accounts.pagination import InvalidCursor, keyset_page, parse_limit
+from content.views import debit_serial
+from serialcotv.http_client import http_client
 from .models import SerialKey, SerialPackage, SerialUsage
+from .services.bloom import serial_filter
+from .services.bulk import bulk_serials
+from .services.checkout import CheckoutError, fulfil_checkout, store_webhook, valid_signature, webhook_secrets
+from .services.outbox import outbox
+from .services.pin_guard import pin_locked_response, record_pin_failure
+from .services.pool import serial_pool
+from .services.usage import DIMENSIONS, usage_rollup
 from .serializers import (
+    SerialBulkActivateSerializer,
+    SerialBulkSerializer,
     SerialDownloadSerializer,
     SerialPackageSerializer,
     SerialUsageSerializer,
@@ -32,137 +39,6 @@ from .serializers import (
 
 logger = logging.getLogger(__name__)
 
-EMAIL_REGEX = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
-CHARGILY_TEST_API = "https://pay.chargily.net/test/api/v2"
-CHARGILY_LIVE_API = "https://pay.chargily.net/api/v2"
-
-
-def clean_url(url):
-    if not url:
-        return ''
-    url = url.strip().strip("'\"").strip('[](){}').strip().replace(' ', '')
-    if not url.startswith(('http://', 'https://')):
-        return ''
-    return url
-
-
-def extract_email_from_payload(data, raw_body_str=""):
-    email_keys = ['email', 'customer_email', 'client_email', 'payer_email', 'user_email']
-    def _recursive_search(value):
-        if not value:
-            return None
-        if isinstance(value, dict):
-            for key in email_keys:
-                if key in value:
-                    val = value[key]
-                    if isinstance(val, str) and '@' in val:
-                        return val.strip()
-            for v in value.values():
-                result = _recursive_search(v)
-                if result:
-                    return result
-        elif isinstance(value, (list, tuple)):
-            for item in value:
-                result = _recursive_search(item)
-                if result:
-                    return result
-        elif isinstance(value, str):
-            match = EMAIL_REGEX.search(value)
-            if match:
-                return match.group(0)
-        return None
-    email = _recursive_search(data)
-    if email:
-        return email
-    if raw_body_str:
-        match = EMAIL_REGEX.search(raw_body_str)
-        if match:
-            return match.group(0)
-    return None
-
-
-def get_chargily_customer_email(customer_id, mode, api_secret_key):
-    try:
-        api_base = CHARGILY_TEST_API if mode == 'test' else CHARGILY_LIVE_API
-        headers = {"Authorization": f"Bearer {api_secret_key}"}
-        response = requests.get(f"{api_base}/customers/{customer_id}", headers=headers, timeout=5)
-        if response.status_code == 200:
-            return response.json().get('email')
-    except:
-        pass
-    return None
-
-
-def parse_metadata(metadata):
-    if isinstance(metadata, dict):
-        return metadata
-    elif isinstance(metadata, str):
-        try:
-            return json.loads(metadata)
-        except:
-            pass
-    return {}
-
-
-def async_post_processing(client_email, client_name, package_id, serial_id, customer_instance_id, customer_id, sheet_url):
-    try:
-        from .models import SerialKey, SerialPackage
-        from accounts.models import Customer
-        
-        package = SerialPackage.objects.get(id=package_id)
-        serial = SerialKey.objects.get(id=serial_id)
-        customer_instance = None
-        if customer_instance_id:
-            try:
-                customer_instance = Customer.objects.get(id=customer_instance_id)
-            except Customer.DoesNotExist:
-                pass
-        
-        if client_email:
-            try:
-                logger.info(f"📧 [Async] Sending email to {client_email}")
-                
-                if customer_instance:
-                    email_html = f"<p>مرحباً {client_name}،</p><p>تم تفعيل اشتراكك!</p><p>الباقة: {package.name}<br>السيريال: {serial.serial_number}<br>البين: {serial.pin}<br>التوكنز: {package.tokens_limit}</p>"
-                else:
-                    email_html = f"<p>مرحباً {client_name}،</p><p>شكراً لاشتراكك!</p><p>الباقة: {package.name}<br>السيريال: {serial.serial_number}<br>البين: {serial.pin}<br>التوكنز: {package.tokens_limit}</p>"
-                
-                send_mail(
-                    subject="تم تفعيل اشتراكك بنجاح 🎉",
-                    message="",
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[client_email],
-                    html_message=email_html,
-                    fail_silently=False,
-                )
-                logger.info(f"✅ [Async] Email sent via Django SMTP")
-                
-            except Exception as e:
-                logger.error(f"❌ [Async] Email FAILED: {e}")
-
-        if sheet_url:
-            try:
-                requests.post(sheet_url, json={
-                    'client': client_name,
-                    'email': client_email or '',
-                    'package': package.name,
-                    'serial': str(serial.serial_number),
-                    'pin': str(serial.pin),
-                    'tokens': package.tokens_limit,
-                }, timeout=10)
-                logger.info("✅ [Async] Sheet updated")
-            except Exception as e:
-                logger.error(f"❌ [Async] Sheet error: {e}")
-                
-    except Exception as e:
-        logger.error(f"💥 [Async] Error: {e}")
-    finally:
-        try:
-            connection.close()
-        except:
-            pass
-
-
 class PackageListAPI(APIView):
     def get(self, request):
         packages = SerialPackage.objects.filter(is_active=True)
@@ -175,10 +51,14 @@ class CheckSerialAPI(APIView):
         serializer = SerialVerifySerializer(data=request.data)
         if not serializer.is_valid():
             return Response({'success': False, 'message': 'بيانات غير صحيحة'}, status=400)
+        locked = pin_locked_response(request, serializer.validated_data['serial_number'])
+        if locked:
+            return locked
         try:
-            serial_key = SerialKey.objects.get(
-                serial_number=serializer.validated_data['serial_number'],
-                pin=serializer.validated_data['pin']
+            serial_key = SerialKey.objects.get_by_pin(
+                serializer.validated_data['serial_number'],
+                serializer.validated_data['pin'],
+                in_pool=False
             )
             return Response({
                 'success': not serial_key.is_used_up,
@@ -190,6 +70,7 @@ class CheckSerialAPI(APIView):
                 }
             })
         except SerialKey.DoesNotExist:
+            record_pin_failure(request, serializer.validated_data['serial_number'])
             return Response({'success': False, 'message': 'سيريال غير صحيح'}, status=404)
 
 
@@ -200,20 +81,25 @@ class ActivateSerialAPI(APIView):
         customer_id = request.data.get('customer_id')
         if not all([serial_number, pin, customer_id]):
             return Response({'success': False, 'message': 'بيانات ناقصة'}, status=400)
+        locked = pin_locked_response(request, serial_number)
+        if locked:
+            return locked
         try:
             customer = Customer.objects.get(id=customer_id, is_active=True)
         except Customer.DoesNotExist:
             return Response({'success': False, 'message': 'حساب غير موجود'}, status=404)
         try:
             with transaction.atomic():
-                serial_key = SerialKey.objects.select_for_update().get(
-                    serial_number=serial_number, pin=pin, customer__isnull=True
+                serial_key = SerialKey.objects.select_for_update().get_by_pin(
+                    serial_number, pin, customer__isnull=True, in_pool=False
                 )
                 serial_key.customer = customer
                 serial_key.used_at = timezone.now()
                 serial_key.save()
-                Customer.objects.filter(pk=customer.pk).update(
-                    token_balance=Coalesce(F('token_balance'), 0) + serial_key.tokens_remaining
+                Customer.adjust_balance(customer.pk, serial_key.tokens_remaining)
+                Transaction.record(
+                    customer.pk, serial_key.tokens_remaining, Transaction.SERIAL_ACTIVATION,
+                    f"تفعيل السيريال {serial_key.serial_number}"
                 )
                 return Response({
                     'success': True,
@@ -221,34 +107,123 @@ class ActivateSerialAPI(APIView):
                     'serial': {'number': serial_key.serial_number, 'tokens_remaining': serial_key.tokens_remaining}
                 })
         except SerialKey.DoesNotExist:
+            record_pin_failure(request, serial_number, pin)
             return Response({'success': False, 'message': 'سيريال غير صحيح'}, status=404)
 
 
+def bulk_response(results):
+    return StreamingHttpResponse(bulk_serials.stream(results), content_type='application/x-ndjson')
+
+
+def bulk_too_large(request):
+    """413 قبل قراءة الجسم إذا تجاوز حجمه الحد، وقبل التحقق من العناصر إذا تجاوز عددها max_items"""
+    content_length = request.META.get('CONTENT_LENGTH') or ''
+    too_large = bulk_serials.exceeds(content_length=int(content_length) if content_length.isdigit() else 0)
+    if not too_large:
+        items = request.data.get('items') if hasattr(request.data, 'get') else None
+        too_large = isinstance(items, list) and bulk_serials.exceeds(items=items)
+    if not too_large:
+        return None
+    return Response({
+        'success': False, 'message': f'الحد الأقصى {bulk_serials.max_items} عنصر في الطلب الواحد',
+    }, status=413)
+
+
+class BulkCheckSerialAPI(APIView):
+    """التحقق من عدة سيريالات للموزعين في طلب واحد، الرد NDJSON بنفس ترتيب items"""
+    authentication_classes = [SourceKeyAuthentication]
+    permission_classes = [IsSource]
+
+    def post(self, request):
+        too_large = bulk_too_large(request)
+        if too_large:
+            return too_large
+        serializer = SerialBulkSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'success': False, 'message': 'بيانات غير صحيحة', 'errors': serializer.errors}, status=400)
+        pairs = [(item['serial_number'], item['pin']) for item in serializer.validated_data['items']]
+        return bulk_response(bulk_serials.verify(pairs))
+
+
+class BulkActivateSerialAPI(APIView):
+    """تفعيل عدة سيريالات لحساب واحد في معاملة واحدة، الرد NDJSON بنفس ترتيب items"""
+    authentication_classes = [SourceKeyAuthentication]
+    permission_classes = [IsSource]
+
+    def post(self, request):
+        too_large = bulk_too_large(request)
+        if too_large:
+            return too_large
+        serializer = SerialBulkActivateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'success': False, 'message': 'بيانات غير صحيحة', 'errors': serializer.errors}, status=400)
+        try:
+            customer = Customer.objects.get(id=serializer.validated_data['customer_id'], is_active=True)
+        except Customer.DoesNotExist:
+            return Response({'success': False, 'message': 'حساب غير موجود'}, status=404)
+        pairs = [(item['serial_number'], item['pin']) for item in serializer.validated_data['items']]
+        return bulk_response(bulk_serials.activate(pairs, customer, source=request.auth))
+
+
 class UseTokenAPI(APIView):
     def post(self, request):
         serializer = SerialDownloadSerializer(data=request.data)
         if not serializer.is_valid():
             return Response({'success': False, 'message': 'بيانات غير صحيحة'}, status=400)
-        try:
-            with transaction.atomic():
-                serial_key = SerialKey.objects.select_for_update().get(
-                    serial_number=serializer.validated_data['serial_number'],
-                    pin=serializer.validated_data['pin'],
-                    is_active=True
-                )
-                if serial_key.tokens_remaining < 1:
-                    return Response({'success': False, 'message': 'رصيد غير كافي'}, status=400)
-                tokens_before = serial_key.tokens_remaining
-                serial_key.use_tokens(1)
-                tokens_after = serial_key.tokens_remaining
-                SerialUsage.objects.create(
-                    serial_key=serial_key, customer=serial_key.customer,
-                    file_name=f"File_{serializer.validated_data['file_id']}",
-                    tokens_before=tokens_before, tokens_after=tokens_after
-                )
-                return Response({'success': True, 'tokens_remaining': tokens_after})
-        except SerialKey.DoesNotExist:
-            return Response({'success': False, 'message': 'سيريال غير صحيح'}, status=404)
+        debit, error = debit_serial(
+            request, 1, f"File_{serializer.validated_data['file_id']}", 'unknown',
+            serial_number=serializer.validated_data['serial_number'], pin=serializer.validated_data['pin'],
+        )
+        if error:
+            return error
+        return Response({'success': True, 'tokens_remaining': debit.tokens_remaining})
+
+
+class SerialFilterStatusAPI(APIView):
+    """حالة Bloom filter أرقام السيريال في هذا العامل (الحجم في الذاكرة وعدد الرفض)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({'success': True, **serial_filter.stats()})
+
+
+class UpstreamStatusAPI(APIView):
+    """زمن الرد والأخطاء وحالة قاطع الدائرة لكل خدمة خارجية في هذا العامل"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({'success': True, 'upstreams': http_client.stats()})
+
+
+class OutboxStatusAPI(APIView):
+    """عمق طابور الـ outbox لكل حالة وتأخر أقدم رسالة (للمراقبة)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({'success': True, **outbox.stats()})
+
+
+class SerialPoolStatusAPI(APIView):
+    """عمق مخزون السيريالات لكل باقة (للمراقبة)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        depths = serial_pool.depth()
+        packages = SerialPackage.objects.filter(is_active=True).order_by('id')
+        return Response({
+            'success': True,
+            'low_water': serial_pool.low_water,
+            'target': serial_pool.target,
+            'packages': [
+                {
+                    'id': package.id,
+                    'name': package.name,
+                    'depth': depths.get(package.id, 0),
+                    'below_low_water': depths.get(package.id, 0) < serial_pool.low_water,
+                }
+                for package in packages
+            ],
+        })
 
 
 class SerialUsageHistoryAPI(APIView):
@@ -256,33 +231,86 @@ class SerialUsageHistoryAPI(APIView):
         serializer = SerialVerifySerializer(data=request.data)
         if not serializer.is_valid():
             return Response({'success': False, 'message': 'بيانات غير صحيحة'}, status=400)
+        locked = pin_locked_response(request, serializer.validated_data['serial_number'])
+        if locked:
+            return locked
         try:
-            serial_key = SerialKey.objects.get(
-                serial_number=serializer.validated_data['serial_number'],
-                pin=serializer.validated_data['pin']
+            serial_key = SerialKey.objects.get_by_pin(
+                serializer.validated_data['serial_number'],
+                serializer.validated_data['pin'],
+                in_pool=False
             )
-            usages = SerialUsage.objects.filter(serial_key=serial_key).order_by('-created_at')
-            return Response({'success': True, 'history': SerialUsageSerializer(usages, many=True).data})
         except SerialKey.DoesNotExist:
+            record_pin_failure(request, serializer.validated_data['serial_number'])
             return Response({'success': False, 'message': 'سيريال غير صحيح'}, status=404)
 
+        try:
+            usages, next_cursor = keyset_page(
+                SerialUsage.objects.filter(serial_key=serial_key),
+                cursor=request.data.get('cursor') or None,
+                limit=parse_limit(request.data.get('limit')),
+            )
+        except InvalidCursor:
+            return Response({'success': False, 'message': 'cursor غير صالح'}, status=400)
+        data = {
+            'success': True,
+            'history': SerialUsageSerializer(usages, many=True).data,
+            'next_cursor': next_cursor,
+        }
+        # ملخص يومي اختياري: الأيام القديمة من الـ rollup بدل مسح صفوف الاستخدام
+        days = request.data.get('days')
+        if days:
+            try:
+                days = max(1, min(int(days), 366))
+            except (TypeError, ValueError):
+                return Response({'success': False, 'message': 'days غير صالح'}, status=400)
+            today = timezone.localdate()
+            data['daily'] = usage_rollup.daily(
+                'serial', serial_key.pk, today - timedelta(days=days - 1), today + timedelta(days=1)
+            )
+        return Response(data)
+
+
+class SerialUsageReportAPI(APIView):
+    """تقرير الاستخدام اليومي لسيريال أو عميل أو نوع ملف خلال فترة (للإدارة)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        dimension = request.query_params.get('dimension')
+        value = request.query_params.get('value')
+        if dimension not in DIMENSIONS or not value:
+            return Response({'success': False, 'message': 'dimension و value مطلوبان'}, status=400)
+        try:
+            end = date.fromisoformat(request.query_params.get('end') or timezone.localdate().isoformat())
+            start = date.fromisoformat(request.query_params.get('start') or (end - timedelta(days=30)).isoformat())
+        except ValueError:
+            return Response({'success': False, 'message': 'تاريخ غير صالح'}, status=400)
+        if start > end or (end - start).days > 3660:
+            return Response({'success': False, 'message': 'فترة غير صالحة'}, status=400)
+        daily = usage_rollup.daily(dimension, value, start, end + timedelta(days=1))
+        return Response({
+            'success': True,
+            'dimension': dimension,
+            'value': value,
+            'daily': daily,
+            'totals': {
+                'downloads': sum(day['downloads'] for day in daily),
+                'tokens_used': sum(day['tokens_used'] for day in daily),
+            },
+        })
+
 
 @csrf_exempt
 def chargily_webhook(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
 
-    webhook_secret = getattr(settings, 'CHARGILY_APP_SECRET', '') or getattr(settings, 'CHARGILY_SECRET_KEY', '')
-    api_secret_key = getattr(settings, 'CHARGILY_SECRET_KEY', '') or webhook_secret
-
+    webhook_secret, _ = webhook_secrets()
     if not webhook_secret:
         return JsonResponse({'error': 'Config error'}, status=500)
 
-    secret_bytes = webhook_secret.encode() if isinstance(webhook_secret, str) else webhook_secret
     signature = request.headers.get('signature', '') or request.headers.get('Chargily-Signature', '')
-    computed = hmac.new(secret_bytes, request.body, hashlib.sha256).hexdigest()
-
-    if not hmac.compare_digest(computed, signature):
+    if not valid_signature(request.body, signature, webhook_secret):
         return JsonResponse({'error': 'Invalid signature'}, status=400)
 
     try:
@@ -296,66 +324,23 @@ def chargily_webhook(request):
     checkout_data = payload.get('data', {})
     checkout_id = checkout_data.get('id')
 
-    client_email = extract_email_from_payload(checkout_data, request.body.decode('utf-8', errors='ignore'))
-    
-    chargily_customer_id = checkout_data.get('customer_id')
-    if not client_email and chargily_customer_id:
-        mode = checkout_data.get('account', {}).get('mode', 'test')
-        client_email = get_chargily_customer_email(chargily_customer_id, mode, api_secret_key)
-
-    metadata = parse_metadata(checkout_data.get('metadata', {}))
-    client_name = metadata.get('name', '') or 'عميل'
-
-    package = None
-    if metadata.get('package_id'):
-        package = SerialPackage.objects.filter(id=metadata['package_id']).first()
-    if not package and metadata.get('package_name'):
-        package = SerialPackage.objects.filter(name=metadata['package_name']).first()
-    if not package:
-        package = SerialPackage.objects.filter(is_active=True).first()
-    if not package:
-        return JsonResponse({'error': 'No package'}, status=404)
-
-    customer_instance = None
-    customer_id = metadata.get('user_id') or metadata.get('customer_id')
-    if customer_id:
-        try:
-            customer_instance = Customer.objects.get(id=customer_id, is_active=True)
-        except:
-            pass
-    if not customer_instance and client_email:
-        customer_instance = Customer.objects.filter(email__iexact=client_email, is_active=True).first()
+    # الوضع السريع: حفظ الجسم فقط والرد فوراً، والتنفيذ الكامل في run_outbox_worker
+    if checkout_id and getattr(settings, 'CHARGILY_WEBHOOK_FAST_ACK', False):
+        if not store_webhook(checkout_id, request.body):
+            return JsonResponse({'status': 'already_received'})
+        return JsonResponse({'status': 'accepted'})
 
     try:
-        with transaction.atomic():
-            create_kwargs = {'package': package, 'customer': customer_instance, 'is_active': True}
-            if customer_instance:
-                create_kwargs['used_at'] = timezone.now()
-            if checkout_id and hasattr(SerialKey, 'payment_id'):
-                create_kwargs['payment_id'] = checkout_id
-            serial = SerialKey.objects.create(**create_kwargs)
-            
-            if customer_instance:
-                Customer.objects.filter(pk=customer_instance.pk).update(
-                    token_balance=Coalesce(F('token_balance'), 0) + package.tokens_limit
-                )
-    except IntegrityError:
-        return JsonResponse({'status': 'already_processed'})
+        serial = fulfil_checkout(checkout_data, request.body.decode('utf-8', errors='ignore'))
+    except CheckoutError:
+        return JsonResponse({'error': 'No package'}, status=404)
     except:
         return JsonResponse({'error': 'Failed'}, status=500)
-
-    sheet_url = clean_url(getattr(settings, 'GOOGLE_SHEET_URL', ''))
-    
-    threading.Thread(
-        target=async_post_processing,
-        args=(client_email, client_name, package.id, serial.id,
-              customer_instance.id if customer_instance else None,
-              customer_id, sheet_url),
-        daemon=True
-    ).start()
+    if serial is None:
+        return JsonResponse({'status': 'already_processed'})
 
     return JsonResponse({
         'success': True,
         'serial': serial.serial_number,
-        'pin': serial.pin,
+        'pin': serial.raw_pin,
     })
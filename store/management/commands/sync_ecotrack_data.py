@@ -1,6 +1,6 @@
-import requests
 from django.core.management.base import BaseCommand
 from decouple import config
+from serialcotv.http_client import http_client
 from store.models import Wilaya, ShippingFee
 
 class Command(BaseCommand):
@@ -21,7 +21,7 @@ class Command(BaseCommand):
         }
         
         try:
-            response = requests.get(self.ECOTRACK_URL, headers=headers)
+            response = http_client.upstream('ecotrack').get(self.ECOTRACK_URL, headers=headers, timeout=30)
             response.raise_for_status()
             data = response.json()
             
@@ -1,5 +1,6 @@
 import requests
 from decouple import config
+from serialcotv.http_client import http_client
 from store.models import EcotrackShipment
 
 class EcotrackService:
@@ -35,7 +36,7 @@ class EcotrackService:
         }
         
         try:
-            response = requests.post(
+            response = http_client.upstream('ecotrack').post(
                 f"{cls.BASE_URL}/add-order",
                 json=payload,
                 headers=cls.get_headers()
@@ -79,7 +80,7 @@ class EcotrackService:
             if tracking:
                 params['tracking'] = tracking
             
-            response = requests.get(
+            response = http_client.upstream('ecotrack').get(
                 f"{cls.BASE_URL}/get/orders",
                 params=params,
                 headers=cls.get_headers()
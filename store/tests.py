@@ -1,3 +1,48 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.test import SimpleTestCase
+
+from serialcotv.http_client import Upstream
+from .services.ecotrack_service import EcotrackService
+
+
+class EcotrackUpstreamTests(SimpleTestCase):
+    """Ecotrack عبر Upstream: مهلة دائماً، إعادة للأخطاء المؤقتة، وقاطع يوقف الطلبات عند التعطل"""
+
+    def setUp(self):
+        self.upstream = Upstream('ecotrack', connect_timeout=1, read_timeout=2, retries=2, backoff=0,
+                                 failure_threshold=3, reset_timeout=60)
+        self.request = mock.Mock()
+        self.upstream._session = mock.Mock(request=self.request)
+        patcher = mock.patch('serialcotv.http_client.HttpClient.upstream', return_value=self.upstream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def response(self, status_code, data=None):
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = data or {}
+        response.raise_for_status.side_effect = requests.HTTPError(str(status_code)) if status_code >= 400 else None
+        return response
+
+    def test_retries_transient_errors_with_timeout(self):
+        self.request.side_effect = [self.response(503), requests.ConnectionError('reset'), self.response(200, {'ok': 1})]
+        self.assertEqual(EcotrackService.get_orders_status(), {'ok': 1})
+        self.assertEqual(self.request.call_count, 3)
+        self.assertEqual(self.request.call_args.kwargs['timeout'], (1, 2))
+        self.assertEqual(self.upstream.stats()['retries'], 2)
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        self.request.side_effect = requests.ReadTimeout('slow')
+        self.assertIn('error', EcotrackService.get_orders_status())
+        self.assertEqual(self.upstream.breaker.state, 'open')
+        self.request.reset_mock()
+        self.assertIn('circuit is open', EcotrackService.get_orders_status()['error'])
+        self.request.assert_not_called()
+        self.assertEqual(self.upstream.stats()['short_circuited'], 1)
+
+    def test_post_not_retried_after_sending(self):
+        self.request.side_effect = requests.ReadTimeout('slow')
+        with self.assertRaises(requests.ReadTimeout):
+            self.upstream.post('https://ecotrack.test/add-order', json={})
+        self.assertEqual(self.request.call_count, 1)